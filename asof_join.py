@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+
+# 1時間足を基準にした as-of 結合（merge_asof(direction="backward") の置き換え）
+# 各データの時刻は最初に1回だけ int64 のエポック時間(1970年からの経過時間数)に変換し、
+# 補助データ側は作成時に1回だけ並べ替えておく。結合は searchsorted（補助データが1時間刻みで
+# 欠けなく並んでいる場合は引き算だけ）で行うので、補助データの数が増えても並べ替えを繰り返さない
+
+HOUR_MS = 60 * 60 * 1000
+HOUR_NS = HOUR_MS * 1_000_000
+
+
+def to_epoch_hours(times, ceil=False):
+    """
+    datetime型または整数ミリ秒の時刻を int64 のエポック時間に変換する。
+    ceil=False は切り捨て、ceil=True は切り上げ（ちょうど正時の時刻はどちらでも同じ値）。
+    """
+    values = np.asarray(times)
+    if np.issubdtype(values.dtype, np.datetime64):
+        values, unit = values.astype("datetime64[ns]").astype(np.int64), HOUR_NS
+    else:
+        values, unit = values.astype(np.int64), HOUR_MS
+    return -(-values // unit) if ceil else values // unit
+
+
+class AsofSide:
+    """
+    as-of 結合する補助データ1つ分。時刻キーの計算と並べ替えは作成時に1回だけ行う。
+      columns    : 結合する列（省略時は time 以外の全列）
+      unit_hours : キーの粒度（日足は24。基準側・補助データ側とも日単位に丸めて比較する）
+      suffix     : 基準側と同じ名前の列に付ける接尾辞
+    補助データの各行は、その時刻以降の最初のキー（切り上げ）から参照できるようになる。
+    """
+
+    def __init__(self, frame, columns=None, unit_hours=1, suffix=None, time_col="time"):
+        self.unit_hours = unit_hours
+        self.suffix = suffix
+        self.columns = [col for col in frame.columns if col != time_col] if columns is None else list(columns)
+        keys = to_epoch_hours(frame[time_col].to_numpy(), ceil=True) if len(frame) else np.empty(0, np.int64)
+        keys = -(-keys // unit_hours)
+        order = None
+        diffs = np.diff(keys)
+        if (diffs < 0).any():
+            order = np.argsort(keys, kind="stable")
+            keys = keys[order]
+            diffs = np.diff(keys)
+        self.keys = keys
+        self.values = {}
+        for col in self.columns:
+            values = frame[col].to_numpy()
+            self.values[col] = values[order] if order is not None else values
+        # キーが1刻みで欠けも重複も無ければ、searchsorted の代わりに引き算で位置を求められる
+        self.dense = len(keys) > 0 and bool((diffs == 1).all())
+
+    def indices(self, base_hours):
+        """基準側のエポック時間に対応する行番号（該当なしは -1）を返す"""
+        keys = base_hours // self.unit_hours
+        if len(self.keys) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        if self.dense:
+            return np.clip(keys - self.keys[0], -1, len(self.keys) - 1)
+        return np.searchsorted(self.keys, keys, side="right") - 1
+
+    def take(self, col, idx):
+        """行番号の位置の値を取り出す（-1 の位置は欠損値）"""
+        values = self.values[col]
+        if len(values) == 0:
+            return np.full(len(idx), np.nan)
+        taken = values[np.maximum(idx, 0)]
+        missing = idx < 0
+        if missing.any():
+            if taken.dtype.kind in "iub":
+                taken = taken.astype(np.float64)
+            elif taken.dtype.kind == "M":
+                taken = taken.copy()
+                taken[missing] = np.datetime64("NaT")
+                return taken
+            elif taken.dtype.kind != "f":
+                taken = taken.astype(object)
+            taken[missing] = np.nan
+        return taken
+
+
+def asof_join(base, sides, time_col="time"):
+    """
+    基準のDataFrame(base)に、各補助データ(AsofSide)の「その時刻以前で最新の行」の値を列として追加して返す。
+    base は時刻順でなければ1回だけ並べ替える。
+    """
+    if not base[time_col].is_monotonic_increasing:
+        base = base.sort_values(time_col, kind="stable")
+    base = base.reset_index(drop=True)
+    base_hours = to_epoch_hours(base[time_col].to_numpy())
+    columns = {}
+    for side in sides:
+        idx = side.indices(base_hours)
+        for col in side.columns:
+            name = col
+            if name in base.columns or name in columns:
+                if side.suffix is None:
+                    raise ValueError(f"列 '{col}' が重複しています。AsofSide に suffix を指定してください。")
+                name = col + side.suffix
+            columns[name] = side.take(col, idx)
+    return pd.concat([base, pd.DataFrame(columns, index=base.index)], axis=1)
@@ -0,0 +1,189 @@
+import glob
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import pandas as pd
+
+from bybit_api import BASE_URL, get_json, split_windows
+from dataset_io import DATASET_FORMAT, FORMAT_EXTENSIONS, read_dataset, write_dataset
+
+# 長期間(数年分)の履歴データの一括取得（バックフィル）
+# 期間を1リクエストで取り切れる大きさのウィンドウに分割してスレッドプールで並列に取得し
+# （間隔の制御は bybit_api のエンドポイントごとのトークンバケットで共有）、
+# ウィンドウごとに型付きのパーティションファイルへまとめて書き出す。
+# 書き出し済みのウィンドウはチェックポイント(JSON)に記録するので、途中で失敗しても再実行で続きから取得できる
+
+BACKFILL_DIR = "backfill"
+HOUR_MS = 60 * 60 * 1000
+
+# データの種類ごとの取得設定
+#   columns: パーティションに保存する列と型（time_field はエポックミリ秒の int64）
+BACKFILL_SPECS = {
+    "funding": {
+        "path": "/v5/market/funding/history",
+        "params": {},
+        "limit": 200,
+        "interval_ms": 8 * HOUR_MS,
+        "time_field": "fundingRateTimestamp",
+        "columns": {"fundingRateTimestamp": "int64", "fundingRate": "float64"},
+    },
+    "open_interest": {
+        "path": "/v5/market/open-interest",
+        "params": {"intervalTime": "1h"},
+        "limit": 200,
+        "interval_ms": HOUR_MS,
+        "time_field": "timestamp",
+        "columns": {"timestamp": "int64", "openInterest": "float64"},
+    },
+    "long_short_ratio": {
+        "path": "/v5/market/account-ratio",
+        "params": {"period": "1h"},
+        "limit": 500,
+        "interval_ms": HOUR_MS,
+        "time_field": "timestamp",
+        "columns": {"timestamp": "int64", "buyRatio": "float64", "sellRatio": "float64"},
+    },
+}
+
+
+# -------------------------------
+# チェックポイント
+# -------------------------------
+def job_dir(kind, symbol, category="linear", root=BACKFILL_DIR):
+    return os.path.join(root, kind, category, symbol)
+
+
+def window_key(window):
+    return f"{window[0]}-{window[1]}"
+
+
+def load_checkpoint(directory):
+    """書き出し済みウィンドウのキーの集合を返す（パーティションファイルが消えているものは除く）"""
+    try:
+        with open(os.path.join(directory, "checkpoint.json"), "r", encoding="utf-8") as f:
+            done = json.load(f)["completed"]
+    except (OSError, ValueError, KeyError):
+        return set()
+    return {key for key, file_name in done.items() if os.path.exists(os.path.join(directory, file_name))}
+
+
+def save_checkpoint(directory, completed):
+    """チェックポイントを一時ファイル経由で置き換える（書き込み途中で落ちても壊れない）"""
+    path = os.path.join(directory, "checkpoint.json")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"completed": completed}, f, indent=0, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+# -------------------------------
+# ウィンドウ単位の取得と書き出し
+# -------------------------------
+def fetch_window_records(spec, symbol, category, window, base_url=BASE_URL):
+    """
+    1ウィンドウ分のレコードを取得する。ページ送り(nextPageCursor)があれば続けて取得する。
+    API呼び出しの例外やエラー応答は例外として呼び出し元に返し、そのウィンドウは未完了のままにする。
+    """
+    records = []
+    cursor = None
+    while True:
+        params = {"category": category, "symbol": symbol, **spec["params"],
+                  "startTime": window[0], "endTime": window[1], "limit": spec["limit"]}
+        if cursor:
+            params["cursor"] = cursor
+        # 取得結果はパーティションとして保存するので、レスポンスキャッシュには保存しない
+        response = get_json(spec["path"], params, base_url=base_url, use_cache=False)
+        if response.get("retCode") != 0:
+            raise RuntimeError(f"APIエラー: {response.get('retMsg')}")
+        result = response.get("result", {})
+        page = result.get("list", [])
+        records.extend(page)
+        cursor = result.get("nextPageCursor")
+        if not cursor or not page:
+            return records
+
+
+def records_to_partition(spec, records, window):
+    """レコードを型付きのDataFrameにする（ウィンドウ外・重複を除いて時刻順に並べる）"""
+    df = pd.DataFrame(records, columns=list(spec["columns"])).astype(spec["columns"])
+    time_field = spec["time_field"]
+    df = df[(df[time_field] >= window[0]) & (df[time_field] <= window[1])]
+    return df.drop_duplicates(subset=[time_field]).sort_values(time_field).reset_index(drop=True)
+
+
+def run_backfill(kind, symbol, start_ts, end_ts, category="linear", root=BACKFILL_DIR,
+                 max_workers=8, fmt=None, base_url=BASE_URL):
+    """
+    [start_ts, end_ts) の kind(BACKFILL_SPECS のキー)のデータをバックフィルする。
+    チェックポイントに記録済みのウィンドウは飛ばし、残りを並列に取得して1ウィンドウ1ファイルで書き出す。
+    (完了ウィンドウ数, 失敗ウィンドウ数) を返す。失敗したウィンドウは再実行で取得し直す。
+    """
+    spec = BACKFILL_SPECS[kind]
+    directory = job_dir(kind, symbol, category, root)
+    os.makedirs(directory, exist_ok=True)
+    ext = FORMAT_EXTENSIONS[fmt or DATASET_FORMAT]
+    windows = split_windows(start_ts, end_ts, spec["interval_ms"] * spec["limit"], align=True)
+    done = load_checkpoint(directory)
+    completed = {window_key(w): f"part-{w[0]}{ext}" for w in windows if window_key(w) in done}
+    pending = [w for w in windows if window_key(w) not in done]
+    print(f"[BACKFILL {kind}] {symbol}: 全 {len(windows)} ウィンドウ中 {len(completed)} 件は取得済み、"
+          f"{len(pending)} 件を最大 {max_workers} 並列で取得します。")
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(fetch_window_records, spec, symbol, category, w, base_url): w for w in pending}
+        for future in as_completed(futures):
+            window = futures[future]
+            start_dt = datetime.fromtimestamp(window[0] / 1000)
+            try:
+                df = records_to_partition(spec, future.result(), window)
+            except Exception as e:
+                failed += 1
+                print(f"[BACKFILL {kind}] {start_dt} ～ の取得に失敗しました: {e}")
+                continue
+            file_name = f"part-{window[0]}{ext}"
+            tmp_path = os.path.join(directory, f"tmp-{window[0]}{ext}")
+            write_dataset(df, tmp_path)
+            os.replace(tmp_path, os.path.join(directory, file_name))
+            completed[window_key(window)] = file_name
+            save_checkpoint(directory, completed)
+            print(f"[BACKFILL {kind}] {start_dt} ～: {len(df)} 件保存 ({len(completed)}/{len(windows)})")
+    print(f"[BACKFILL {kind}] {symbol}: 完了 {len(completed)} / 失敗 {failed} ウィンドウ")
+    return len(completed), failed
+
+
+# -------------------------------
+# パーティションの読み込み
+# -------------------------------
+def read_backfill(kind, symbol, category="linear", root=BACKFILL_DIR):
+    """書き出し済みのパーティションを連結し、時刻順に並べたDataFrameを返す"""
+    spec = BACKFILL_SPECS[kind]
+    directory = job_dir(kind, symbol, category, root)
+    paths = sorted(p for ext in FORMAT_EXTENSIONS.values() for p in glob.glob(os.path.join(directory, f"part-*{ext}")))
+    if not paths:
+        return pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in spec["columns"].items()})
+    df = pd.concat([read_dataset(path) for path in paths], ignore_index=True)
+    time_field = spec["time_field"]
+    df = df.drop_duplicates(subset=[time_field]).sort_values(time_field).reset_index(drop=True)
+    return df.astype(spec["columns"])
+
+
+def export_csv(kind, symbol, csv_file, category="linear", root=BACKFILL_DIR):
+    """パーティションを1つのCSVにまとめて書き出す（old/ の取得スクリプトと同じ列＋symbol列）"""
+    df = read_backfill(kind, symbol, category, root)
+    df["symbol"] = symbol
+    df.to_csv(csv_file, index=False)
+    return len(df)
+
+
+def main(symbol="BTCUSDT", category="linear", start=datetime(2020, 4, 1), end=datetime(2024, 12, 1)):
+    start_ts = int(start.timestamp() * 1000)
+    end_ts = int(end.timestamp() * 1000)
+    for kind in BACKFILL_SPECS:
+        run_backfill(kind, symbol, start_ts, end_ts, category=category)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from main import calculate_indicators
+from indicators import INDICATOR_COLUMNS
+
+# calculate_indicators の速度比較用スクリプト
+# 従来のpandas rolling版と、indicators.compute_indicator_arrays を使う現行版を
+# 同じ疑似データで実行し、所要時間と結果の一致を確認する
+
+
+def make_synthetic_klines(n_rows, seed=0):
+    """ランダムウォークの疑似ローソク足（APIと同じ列構成、time はミリ秒）を作成する"""
+    rng = np.random.default_rng(seed)
+    close = 30000 + np.cumsum(rng.normal(0, 5, n_rows))
+    return pd.DataFrame({
+        "time": 1_600_000_000_000 + np.arange(n_rows, dtype=np.int64) * 60_000,
+        "open": close + rng.normal(0, 2, n_rows),
+        "high": close + rng.uniform(0, 10, n_rows),
+        "low": close - rng.uniform(0, 10, n_rows),
+        "close": close,
+        "volume": rng.uniform(1, 100, n_rows),
+        "turnover": rng.uniform(1, 100, n_rows),
+    })
+
+
+def calculate_indicators_pandas(df):
+    """比較用：列ごとに pandas の rolling を呼ぶ従来の calculate_indicators"""
+    df["time"] = pd.to_datetime(df["time"].astype(int), unit="ms")
+    df.sort_values("time", inplace=True)
+    df.reset_index(drop=True, inplace=True)
+    num_cols = ["open", "high", "low", "close", "volume", "turnover"]
+    df[num_cols] = df[num_cols].apply(pd.to_numeric)
+
+    df["prev_close"] = df["close"].shift(1)
+    tr1 = df["high"] - df["low"]
+    tr2 = (df["high"] - df["prev_close"]).abs()
+    tr3 = (df["low"] - df["prev_close"]).abs()
+    df["TR"] = pd.concat([tr1, tr2, tr3], axis=1).max(axis=1)
+    df["ATR"] = df["TR"].rolling(window=14, min_periods=14).mean()
+    df["MA20"] = df["close"].rolling(window=20, min_periods=20).mean()
+    df["std20"] = df["close"].rolling(window=20, min_periods=20).std()
+    df["BB_upper"] = df["MA20"] + 2 * df["std20"]
+    df["BB_lower"] = df["MA20"] - 2 * df["std20"]
+    df["MA5"] = df["close"].rolling(window=5, min_periods=5).mean()
+    df["MA10"] = df["close"].rolling(window=10, min_periods=10).mean()
+    df["MA20_calc"] = df["MA20"]
+    delta = df["close"].diff()
+    gain = delta.clip(lower=0)
+    loss = -delta.clip(upper=0)
+    avg_gain = gain.rolling(window=14, min_periods=14).mean()
+    avg_loss = loss.rolling(window=14, min_periods=14).mean()
+    rs = avg_gain / avg_loss
+    df["RSI"] = 100 - (100 / (1 + rs))
+    df["avg_gain"] = avg_gain
+    df["avg_loss"] = avg_loss
+    df["EMA"] = df["close"].ewm(span=20, adjust=False).mean()
+    df.drop(columns=["prev_close", "std20", "TR"], inplace=True)
+    return df
+
+
+def best_of(func, df, repeat):
+    """repeat回実行したうちの最短時間(秒)と最後の結果を返す"""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        data = df.copy()
+        start = time.perf_counter()
+        result = func(data)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(sizes=(100_000, 1_000_000, 5_000_000), repeat=3):
+    for n_rows in sizes:
+        df = make_synthetic_klines(n_rows)
+        t_pandas, expected = best_of(calculate_indicators_pandas, df, repeat)
+        t_numpy, actual = best_of(calculate_indicators, df, repeat)
+        same = all(np.allclose(actual[col].to_numpy(dtype=float), expected[col].to_numpy(dtype=float),
+                               rtol=1e-7, atol=1e-6, equal_nan=True) for col in INDICATOR_COLUMNS)
+        print(f"{n_rows:>9} 行: pandas {t_pandas:.3f}s / numpy {t_numpy:.3f}s "
+              f"(x{t_pandas / t_numpy:.1f}) 列一致: {same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+import argparse
+import json
+import os
+import resource
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import pandas as pd
+
+import bybit_api
+from benchmark_indicators import make_synthetic_klines
+from dataset_check import validate_dataset
+from dataset_io import write_dataset
+from kline_store import KLINE_COLUMNS, parse_kline_page
+from main import iter_kline_pages, calculate_indicators, merge_features
+from schema import apply_schema
+
+# データ作成パイプラインのステージ別ベンチマーク
+# 疑似データ(ローソク足・資金調達率・OI)と、応答遅延を設定できるローカルのスタブAPIサーバーを使い、
+# ページ取得・パース・指標計算・結合・型の変換・ファイル書き出し・データ検証・モデル学習をステージごとに計測する。
+# 所要時間・行数/秒・ピークRSSを記録し、保存済みのベースラインと比較して遅くなったステージを報告する
+
+HOUR_MS = 60 * 60 * 1000
+START_MS = 1_577_836_800_000  # 2020-01-01 00:00 UTC
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000, 10_000_000)
+BASELINE_FILE = "benchmark_baseline.json"
+# APIを経由するページ取得と学習は時間がかかるので、この行数までに抑えて計測する
+PAGING_MAX_ROWS = 200_000
+TRAIN_MAX_ROWS = 1_000_000
+
+
+# -------------------------------
+# 疑似データ
+# -------------------------------
+def make_hourly_klines(n_rows, seed=0):
+    """2020-01-01から始まる1時間足の疑似ローソク足（time はミリ秒）"""
+    df = make_synthetic_klines(n_rows, seed)
+    df["time"] = START_MS + np.arange(n_rows, dtype=np.int64) * HOUR_MS
+    return df
+
+
+def make_funding_hourly(n_hours, seed=0):
+    """build_funding_hourly の出力と同じ形の、1時間足に補間済みの資金調達率"""
+    rng = np.random.default_rng(seed)
+    knots = np.arange(0, n_hours + 8, 8)  # 8時間ごとの確定値を線形補間する
+    rates = np.interp(np.arange(n_hours), knots, rng.normal(1e-4, 5e-5, len(knots)))
+    return pd.DataFrame({"time": pd.to_datetime(START_MS + np.arange(n_hours, dtype=np.int64) * HOUR_MS, unit="ms"),
+                         "symbol": "BTCUSDT", "fundingRate": rates})
+
+
+def make_open_interest_frame(n_hours, seed=0):
+    """build_open_interest_frame の出力と同じ形の、1時間ごとのオープンインタレスト"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({"time": pd.to_datetime(START_MS + np.arange(n_hours, dtype=np.int64) * HOUR_MS, unit="ms"),
+                         "openInterest": 50_000 + np.cumsum(rng.normal(0, 100, n_hours))})
+
+
+# -------------------------------
+# スタブAPIサーバー
+# -------------------------------
+class StubBybitServer:
+    """
+    疑似ローソク足を /v5/market/kline と同じ形式(新しい順)で返すローカルサーバー。
+    latency 秒の応答遅延を入れられる。with 文で起動・停止する。
+    """
+
+    def __init__(self, klines, latency=0.0):
+        self.times = klines["time"].to_numpy(dtype=np.int64)
+        self.rows = klines[KLINE_COLUMNS].astype(str).to_numpy().tolist()
+        self.latency = latency
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                query = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+                lo = np.searchsorted(stub.times, int(query["start"]), side="left")
+                hi = np.searchsorted(stub.times, int(query["end"]), side="right")
+                hi = min(hi, lo + int(query.get("limit", 1000)))
+                body = json.dumps({"retCode": 0, "result": {"list": stub.rows[lo:hi][::-1]}}).encode("utf-8")
+                if stub.latency:
+                    time.sleep(stub.latency)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# -------------------------------
+# 計測
+# -------------------------------
+def current_rss_bytes():
+    """現在のRSS(バイト)。/proc が無い環境では ru_maxrss(これまでの最大値)で代用する"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class StageTimer:
+    """ステージの所要時間とピークRSS(10ミリ秒ごとのサンプリング)を計測し、結果を results に追加する"""
+
+    def __init__(self, results, stage, rows):
+        self.results = results
+        self.stage = stage
+        self.rows = rows
+
+    def _sample(self):
+        while not self.stop.wait(0.01):
+            self.peak = max(self.peak, current_rss_bytes())
+
+    def __enter__(self):
+        self.peak = current_rss_bytes()
+        self.stop = threading.Event()
+        self.sampler = threading.Thread(target=self._sample, daemon=True)
+        self.sampler.start()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        self.stop.set()
+        self.sampler.join()
+        self.peak = max(self.peak, current_rss_bytes())
+        if exc_type is None:
+            self.results[f"{self.stage}@{self.rows}"] = {
+                "stage": self.stage,
+                "rows": self.rows,
+                "seconds": round(seconds, 6),
+                "rows_per_sec": round(self.rows / seconds, 1) if seconds > 0 else None,
+                "peak_rss_mb": round(self.peak / 2**20, 1),
+            }
+
+
+def run_size(n_rows, workdir, latency=0.0, results=None):
+    """n_rows 行の1時間足で全ステージを計測し、results(dict)に追加して返す"""
+    results = {} if results is None else results
+    df_raw = make_hourly_klines(n_rows)
+
+    # ページ取得(スタブサーバー経由)とパース
+    paging_rows = min(n_rows, PAGING_MAX_ROWS)
+    pages = []
+    with StubBybitServer(df_raw.iloc[:paging_rows], latency=latency) as stub:
+        with StageTimer(results, "paging", paging_rows):
+            end_ts = START_MS + paging_rows * HOUR_MS - 1
+            pages = list(iter_kline_pages(start_ts=START_MS, end_ts=end_ts, base_url=stub.url))
+    with StageTimer(results, "parse", paging_rows):
+        for page in pages:
+            parse_kline_page(page)
+    del pages
+
+    with StageTimer(results, "calculate_indicators", n_rows):
+        df_hourly = calculate_indicators(df_raw)
+
+    df_funding = make_funding_hourly(n_rows)
+    df_oi = make_open_interest_frame(n_rows)
+    with StageTimer(results, "merge_features", n_rows):
+        df_final = merge_features(df_hourly, df_funding, df_oi)
+    with StageTimer(results, "apply_schema", n_rows):
+        df_final = apply_schema(df_final)
+
+    for fmt, ext in (("csv", ".csv"), ("parquet", ".parquet"), ("feather", ".feather")):
+        with StageTimer(results, f"write_{fmt}", n_rows):
+            write_dataset(df_final, os.path.join(workdir, "merged_dataset" + ext))
+
+    with StageTimer(results, "dataset_check", n_rows):
+        validate_dataset(os.path.join(workdir, "merged_dataset.feather"))
+
+    import lightgbm as lgb
+    train_rows = min(n_rows, TRAIN_MAX_ROWS)
+    feature_cols = ["open", "high", "low", "close", "volume", "ATR", "MA20", "RSI", "EMA", "fundingRate", "openInterest"]
+    X = df_final[feature_cols].to_numpy(dtype=np.float64)[:train_rows]
+    y = np.diff(df_final["close"].to_numpy(), append=np.nan)[:train_rows]
+    with StageTimer(results, "train_lightgbm", train_rows):
+        lgb.train({"objective": "regression", "verbosity": -1},
+                  lgb.Dataset(X[:-1], label=y[:-1]), num_boost_round=100)
+    return results
+
+
+# -------------------------------
+# ベースラインとの比較
+# -------------------------------
+def compare_with_baseline(results, baseline, tolerance=0.2):
+    """所要時間がベースラインの (1+tolerance) 倍を超えたステージを (キー, ベースライン秒, 今回秒) のリストで返す"""
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base and result["seconds"] > base["seconds"] * (1 + tolerance):
+            regressions.append((key, base["seconds"], result["seconds"]))
+    return regressions
+
+
+def print_results(results, baseline):
+    print(f"{'stage':<22}{'rows':>10}{'seconds':>11}{'rows/sec':>14}{'peak RSS(MB)':>14}{'vs baseline':>13}")
+    for key, r in results.items():
+        base = baseline.get(key)
+        ratio = f"x{r['seconds'] / base['seconds']:.2f}" if base and base["seconds"] > 0 else "-"
+        print(f"{r['stage']:<22}{r['rows']:>10}{r['seconds']:>11.3f}{r['rows_per_sec'] or 0:>14.0f}"
+              f"{r['peak_rss_mb']:>14.1f}{ratio:>13}")
+
+
+def main(sizes=DEFAULT_SIZES, latency=0.0, baseline_file=BASELINE_FILE, save_baseline=False, tolerance=0.2):
+    # ベンチマークではレスポンスキャッシュとレートリミッタを使わず、パイプライン自体の処理時間を測る
+    bybit_api.CACHE_ENABLED = False
+    bybit_api._limiters["/v5/market/kline"] = bybit_api.TokenBucket(1e9)
+
+    results = {}
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    try:
+        for n_rows in sizes:
+            print(f"{n_rows} 行で計測中...")
+            run_size(n_rows, workdir, latency=latency, results=results)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = {}
+    if os.path.exists(baseline_file):
+        with open(baseline_file, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    regressions = compare_with_baseline(results, baseline, tolerance)
+    for key, base_seconds, seconds in regressions:
+        print(f"[REGRESSION] {key}: {base_seconds:.3f}s -> {seconds:.3f}s")
+    if save_baseline:
+        with open(baseline_file, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"ベースラインを '{baseline_file}' に保存しました。")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="データ作成パイプラインのステージ別ベンチマーク")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="計測する行数")
+    parser.add_argument("--latency", type=float, default=0.0, help="スタブAPIの応答遅延(秒)")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="ベースラインのJSONファイル")
+    parser.add_argument("--save-baseline", action="store_true", help="今回の結果をベースラインとして保存する")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="遅くなったとみなす割合")
+    args = parser.parse_args()
+    regressions = main(args.sizes, args.latency, args.baseline, args.save_baseline, args.tolerance)
+    raise SystemExit(1 if regressions else 0)
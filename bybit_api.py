@@ -0,0 +1,217 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from kline_store import KLINE_INTERVAL_MS
+from metrics import METRICS, ROW_BUCKETS
+from response_cache import DEFAULT_CACHE_DIR, ResponseCache, response_ttl
+
+# Bybit REST API 共通処理（レートリミッタ・コネクションプール・レスポンスキャッシュ・時間ウィンドウ分割・並列取得）
+# main.py や old/ 配下の取得処理から共有して使う
+
+BASE_URL = "https://api.bybit.com"
+
+# エンドポイントごとの1秒あたりリクエスト上限
+# Bybitの公開エンドポイントはIP単位で「5秒間に600リクエスト」までなので、
+# 複数エンドポイントを同時に叩いても余裕が残るよう控えめに設定している
+RATE_LIMITS = {
+    "/v5/market/kline": 10,
+    "/v5/market/open-interest": 10,
+    "/v5/market/funding/history": 10,
+    "/v5/market/account-ratio": 10,
+}
+DEFAULT_RATE_LIMIT = 10
+
+# intervalTime / period 表記ごとのミリ秒
+INTERVAL_TIME_MS = {
+    "5min": 5 * 60 * 1000,
+    "15min": 15 * 60 * 1000,
+    "30min": 30 * 60 * 1000,
+    "1h": 60 * 60 * 1000,
+    "4h": 4 * 60 * 60 * 1000,
+    "1d": 24 * 60 * 60 * 1000,
+}
+
+
+# -------------------------------
+# レートリミッタ（トークンバケット）
+# -------------------------------
+class TokenBucket:
+    """
+    トークンバケット方式のレートリミッタ。
+    rate: 1秒あたりに補充されるトークン数、capacity: バースト時に一度に使えるトークン数。
+    スレッドセーフなので、複数ワーカーから同じインスタンスを共有して使う。
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """トークンを取得できるまで待機し、待機した秒数を返す"""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return waited
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(path):
+    """エンドポイントのパスに対応する共有レートリミッタを返す"""
+    with _limiters_lock:
+        if path not in _limiters:
+            _limiters[path] = TokenBucket(RATE_LIMITS.get(path, DEFAULT_RATE_LIMIT))
+        return _limiters[path]
+
+
+# -------------------------------
+# セッション（コネクションプール）
+# -------------------------------
+_session = None
+_session_lock = threading.Lock()
+
+
+def create_session(pool_size=16, retries=5, backoff_factor=0.5):
+    """
+    Keep-Aliveで接続を使い回す requests.Session を作成する。
+    429や5xxは指数バックオフ付きで自動リトライする。
+    """
+    retry = Retry(total=retries, backoff_factor=backoff_factor,
+                  status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=("GET",))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session():
+    """プロセス内で共有するセッションを返す（全エンドポイント・全スレッドで接続を共有する）"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
+
+
+# -------------------------------
+# レスポンスキャッシュ
+# -------------------------------
+# 環境変数 BYBIT_HTTP_CACHE=0 で無効化、BYBIT_HTTP_CACHE_DIR で保存先を変更できる
+CACHE_ENABLED = os.environ.get("BYBIT_HTTP_CACHE", "1") != "0"
+CACHE_DIR = os.environ.get("BYBIT_HTTP_CACHE_DIR", DEFAULT_CACHE_DIR)
+FUNDING_INTERVAL_MS = 8 * 60 * 60 * 1000
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """プロセス内で共有するレスポンスキャッシュを返す（無効化されている場合はNone）"""
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(CACHE_DIR)
+        return _cache
+
+
+def request_interval_ms(path, params):
+    """リクエストが対象とするデータの足の長さ(ミリ秒)を返す（確定済みかどうかの判定に使う）"""
+    if "interval" in params:
+        return KLINE_INTERVAL_MS.get(str(params["interval"]), KLINE_INTERVAL_MS["D"])
+    for name in ("intervalTime", "period"):
+        if name in params:
+            return INTERVAL_TIME_MS.get(params[name], INTERVAL_TIME_MS["1d"])
+    if path == "/v5/market/funding/history":
+        return FUNDING_INTERVAL_MS
+    return INTERVAL_TIME_MS["1d"]
+
+
+# -------------------------------
+# リクエスト送信
+# -------------------------------
+def get_json(path, params, base_url=BASE_URL, timeout=10, use_cache=True):
+    """
+    レートリミッタを通して共有セッションでGETリクエストを送り、レスポンスのJSONを返す。
+    キャッシュに有効なレスポンスがあればリクエストせずにそれを返し、成功レスポンス(retCode=0)は保存する。
+    レイテンシ・受信バイト数・リトライ回数・レートリミッタの待ち時間・ページの件数は metrics に記録する。
+    """
+    cache = get_cache() if use_cache else None
+    if cache is not None:
+        key = ResponseCache.make_key(base_url, path, params)
+        cached = cache.get(key)
+        if cached is not None:
+            METRICS.inc("http_cache_hits_total", endpoint=path)
+            return cached
+    METRICS.observe("rate_limit_wait_seconds", get_limiter(path).acquire(), endpoint=path)
+    start = time.perf_counter()
+    response = get_session().get(base_url + path, params=params, timeout=timeout)
+    result = response.json()
+    METRICS.observe("http_request_seconds", time.perf_counter() - start, endpoint=path)
+    METRICS.inc("http_requests_total", endpoint=path, status=response.status_code)
+    METRICS.inc("http_response_bytes_total", len(response.content), endpoint=path)
+    retries = getattr(response.raw, "retries", None)
+    if retries is not None and retries.history:
+        METRICS.inc("http_retries_total", len(retries.history), endpoint=path)
+    if result.get("retCode") != 0:
+        METRICS.inc("api_errors_total", endpoint=path)
+    else:
+        rows = result.get("result", {}).get("list")
+        if isinstance(rows, list):
+            METRICS.observe("page_rows", len(rows), buckets=ROW_BUCKETS, endpoint=path)
+    if cache is not None and result.get("retCode") == 0:
+        cache.put(key, result, ttl=response_ttl(params, request_interval_ms(path, params)))
+    return result
+
+
+# -------------------------------
+# 時間ウィンドウ分割＆並列取得
+# -------------------------------
+def split_windows(start_ts, end_ts, window_ms, align=False):
+    """
+    [start_ts, end_ts) を window_ms ごとのウィンドウ (start, end) に分割する（endは含む）。
+    align=True の場合は境界を window_ms の倍数に揃え、先頭ウィンドウも境界から始める。
+    実行時刻がずれても最新以外のウィンドウは同じ範囲になるので、レスポンスキャッシュが効く
+    （先頭ウィンドウでstart_tsより前のデータが返る分は呼び出し側で取り除く）。
+    """
+    windows = []
+    current_start = start_ts - start_ts % window_ms if align else start_ts
+    while current_start < end_ts:
+        current_end = min(current_start + window_ms, end_ts)
+        windows.append((current_start, current_end - 1))
+        current_start = current_end
+    return windows
+
+
+def fetch_windows_concurrently(fetch_window, windows, max_workers=8):
+    """
+    各ウィンドウに対して fetch_window(start, end) をスレッドプールで並列実行し、
+    結果をウィンドウの順番（＝時刻順）に並べたリストで返す。
+    リクエスト間隔の制御は fetch_window 内で使うレートリミッタに任せる。
+    """
+    if not windows:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(windows))) as executor:
+        return list(executor.map(lambda w: fetch_window(*w), windows))
@@ -0,0 +1,276 @@
+import argparse
+import glob
+import itertools
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# 分割されたCSV(MT形式のエクスポートなど)を時刻順に1つのファイルへ結合するツール
+# 各ファイルの時刻列を明示したフォーマットでまとめてパースし、時刻順に並んでいるかをプロセスプールで並列に確認する
+# （並んでいないファイルだけチャンクごとに並べ替えた一時ファイル(ラン)に書き出す）。
+# その後、全ファイル・ランをブロック単位で読み進める k-way マージで時刻順に並べ、同じ時刻の重複を除いて逐次書き出す。
+# ラン数が MAX_FAN_IN を超える場合は、連続した MAX_FAN_IN 個ずつを中間ランにマージしてから結合する（同時に開くファイル数の上限）。
+# 行の文字列は読み込んだまま出力するので、日時や数値の書式は変わらない。
+# メモリに載るのは「MAX_FAN_IN × ブロック行数」分だけなので、ファイルの合計サイズがメモリより大きくても結合できる
+
+DEFAULT_TIME_FORMAT = "%Y.%m.%d %H:%M"  # MT形式（例：2024.11.01 00:00）
+CHUNK_ROWS = 200_000  # 並べ替えの単位（時刻順でないファイルのみ）
+BLOCK_ROWS = 50_000  # マージ時に各ファイルから一度に読む行数
+MAX_FAN_IN = 128  # 1回のマージで同時に開くランの数の上限
+NAT = np.iinfo(np.int64).min
+
+
+def parse_times(lines, time_columns=(0,), time_format=DEFAULT_TIME_FORMAT, sep=","):
+    """
+    行(文字列)のリストから時刻列を取り出し、int64 のエポックナノ秒にまとめて変換する。
+    time_columns に複数の列を指定すると空白でつないでからパースする（日付と時刻が別の列の場合）。
+    パースできない行は NAT になる。
+    """
+    if not lines:
+        return np.empty(0, dtype=np.int64)
+    # 時刻の列だけを取り出す（pandas の str.split(expand=True) より、必要な列までの split の方が速い）
+    n_split = max(time_columns) + 1
+    text = []
+    for line in lines:
+        fields = line.split(sep, n_split)
+        text.append(" ".join(fields[col].strip() if col < len(fields) else "" for col in time_columns))
+    times = pd.to_datetime(pd.Series(text, dtype=object), format=time_format, errors="coerce")
+    return times.to_numpy(dtype="datetime64[ns]").view(np.int64)
+
+
+def _read_lines(f, n):
+    """ファイルから最大n行を改行を除いて読む（空行は飛ばす）"""
+    return [line.rstrip("\r\n") for line in itertools.islice(f, n) if line.strip()]
+
+
+# -------------------------------
+# 1. ファイルごとの確認と並べ替え（並列）
+# -------------------------------
+def prepare_runs(path, run_dir, index, time_columns=(0,), time_format=DEFAULT_TIME_FORMAT, sep=",",
+                 header=False, chunk_rows=CHUNK_ROWS):
+    """
+    (プロセスで実行) ファイルが時刻順に並んでいればそのまま1つのランとして使い、
+    並んでいない・パースできない行がある場合はチャンクごとに並べ替えたランを run_dir に書き出す。
+    (ランのパスのリスト, 読んだ行数, パースできずに除いた行数) を返す。
+    """
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if header:
+            f.readline()
+        rows = 0
+        last = NAT
+        in_order = True
+        while True:
+            lines = _read_lines(f, chunk_rows)
+            if not lines:
+                break
+            keys = parse_times(lines, time_columns, time_format, sep)
+            rows += len(lines)
+            if (keys == NAT).any() or keys[0] < last or (np.diff(keys) < 0).any():
+                in_order = False
+                break
+            last = keys[-1]
+    if in_order:
+        return [path], rows, 0
+
+    runs = []
+    rows = skipped = 0
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if header:
+            f.readline()
+        for chunk in itertools.count():
+            lines = _read_lines(f, chunk_rows)
+            if not lines:
+                break
+            keys = parse_times(lines, time_columns, time_format, sep)
+            rows += len(lines)
+            valid = keys != NAT
+            skipped += int((~valid).sum())
+            order = np.flatnonzero(valid)[np.argsort(keys[valid], kind="stable")]
+            run_path = os.path.join(run_dir, f"run-{index:06d}-{chunk:06d}.csv")
+            with open(run_path, "w", encoding="utf-8", newline="") as out:
+                out.writelines(lines[i] + "\n" for i in order)
+            runs.append(run_path)
+    return runs, rows, skipped
+
+
+# -------------------------------
+# 2. k-way マージ
+# -------------------------------
+class RunReader:
+    """時刻順に並んだファイル(ラン)をブロック単位で読み、行と時刻キーをバッファに持つ"""
+
+    def __init__(self, path, skip_header, time_columns, time_format, sep, block_rows):
+        self.f = open(path, "r", encoding="utf-8", newline="")
+        if skip_header:
+            self.f.readline()
+        self.parse = lambda lines: parse_times(lines, time_columns, time_format, sep)
+        self.block_rows = block_rows
+        self.keys = np.empty(0, dtype=np.int64)
+        self.lines = np.empty(0, dtype=object)
+        self.exhausted = False
+
+    def load(self):
+        """次のブロックをバッファの後ろに読み足す（パースできない行は除く）"""
+        lines = _read_lines(self.f, self.block_rows)
+        if not lines:
+            self.exhausted = True
+            self.f.close()
+            return
+        keys = self.parse(lines)
+        valid = keys != NAT
+        self.keys = np.concatenate([self.keys, keys[valid]])
+        self.lines = np.concatenate([self.lines, np.array(lines, dtype=object)[valid]])
+
+    def take_before(self, bound):
+        """バッファのうち時刻が bound より前の行を取り出す（bound=None なら全部）"""
+        n = len(self.keys) if bound is None else int(np.searchsorted(self.keys, bound, side="left"))
+        keys, lines = self.keys[:n], self.lines[:n]
+        self.keys, self.lines = self.keys[n:], self.lines[n:]
+        return keys, lines
+
+
+def merge_runs(run_paths, out, skip_header, time_columns=(0,), time_format=DEFAULT_TIME_FORMAT, sep=",",
+               block_rows=BLOCK_ROWS, keep="last"):
+    """
+    時刻順のラン(run_paths の順が優先順位)を k-way マージして out に書き出し、(書き出した行数, 重複で除いた行数) を返す。
+    各ランのバッファ末尾の時刻のうち最小のもの(bound)より前の行は、以降どのランからも現れないので確定として書き出す。
+    同じ時刻の行は keep="last" なら後ろのラン(ファイル)の行、"first" なら前のランの行を残す。
+    """
+    readers = [RunReader(path, skip_header[i], time_columns, time_format, sep, block_rows)
+               for i, path in enumerate(run_paths)]
+    for reader in readers:
+        reader.load()
+    written = duplicates = 0
+    while True:
+        for reader in readers:
+            # バッファが空になったランは、次のブロックを読むまで bound を決められない
+            while not reader.exhausted and len(reader.keys) == 0:
+                reader.load()
+        active = [r for r in readers if not r.exhausted]
+        if not active and not any(len(r.keys) for r in readers):
+            break
+        bound = min(r.keys[-1] for r in active) if active else None
+        parts = [r.take_before(bound) for r in readers]
+        keys = np.concatenate([k for k, _ in parts])
+        if len(keys):
+            lines = np.concatenate([l for _, l in parts])
+            # ラン順に連結してから安定ソートするので、同じ時刻の中ではラン順・行順が保たれる
+            order = np.argsort(keys, kind="stable")
+            keys, lines = keys[order], lines[order]
+            if keep == "last":
+                unique = np.append(keys[1:] != keys[:-1], True)
+            else:
+                unique = np.insert(keys[1:] != keys[:-1], 0, True)
+            duplicates += int(len(keys) - unique.sum())
+            out.write("\n".join(lines[unique]) + "\n")
+            written += int(unique.sum())
+        if bound is not None:
+            # bound を決めたランは、同じ時刻の行が次のブロックに続いている可能性があるので読み足す
+            for reader in active:
+                if len(reader.keys) and reader.keys[-1] == bound:
+                    reader.load()
+    return written, duplicates
+
+
+def reduce_runs(run_paths, skip_header, run_dir, time_columns=(0,), time_format=DEFAULT_TIME_FORMAT, sep=",",
+                block_rows=BLOCK_ROWS, keep="last", max_fan_in=MAX_FAN_IN):
+    """
+    ラン数が max_fan_in 以下になるまで、連続した max_fan_in 個ずつのランを run_dir の中間ランにマージする。
+    連続した区間ごとにまとめるのでランの優先順位(keep の判定に使う順)は変わらない。
+    マージし終えた run_dir 内のランは消す（元のファイルは消さない）。
+    (ランのパスのリスト, 各ランのヘッダーを飛ばすか, 重複で除いた行数, マージの回数) を返す。
+    """
+    max_fan_in = max(2, max_fan_in)
+    duplicates = passes = 0
+    while len(run_paths) > max_fan_in:
+        merged_paths, merged_skip = [], []
+        for group_id, start in enumerate(range(0, len(run_paths), max_fan_in)):
+            group = run_paths[start:start + max_fan_in]
+            group_skip = skip_header[start:start + max_fan_in]
+            if len(group) == 1:
+                merged_paths += group
+                merged_skip += group_skip
+                continue
+            merged_path = os.path.join(run_dir, f"merge-{passes:02d}-{group_id:06d}.csv")
+            with open(merged_path, "w", encoding="utf-8", newline="") as out:
+                _, removed = merge_runs(group, out, group_skip, time_columns, time_format, sep, block_rows, keep)
+            duplicates += removed
+            for run in group:
+                if os.path.dirname(run) == run_dir:
+                    os.remove(run)
+            merged_paths.append(merged_path)
+            merged_skip.append(False)
+        run_paths, skip_header = merged_paths, merged_skip
+        passes += 1
+    return run_paths, skip_header, duplicates, passes
+
+
+def merge_csv_files(paths, output_file, time_columns=(0,), time_format=DEFAULT_TIME_FORMAT, sep=",",
+                    header=False, keep="last", chunk_rows=CHUNK_ROWS, block_rows=BLOCK_ROWS, max_workers=None,
+                    max_fan_in=MAX_FAN_IN):
+    """
+    複数のCSVを時刻順に結合して output_file に書き出し、件数の集計を dict で返す。
+    paths はファイル名順に並べ、重複した時刻は keep に従って後(last)または先(first)のファイルの行を残す。
+    header=True の場合は各ファイルの1行目をヘッダーとして除き、最初のファイルのヘッダーを出力する。
+    """
+    paths = sorted(paths)
+    if not paths:
+        raise ValueError("結合するファイルがありません。")
+    with tempfile.TemporaryDirectory(prefix="csv_merge_") as run_dir:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(prepare_runs, path, run_dir, i, tuple(time_columns), time_format, sep,
+                                   header, chunk_rows) for i, path in enumerate(paths)]
+            prepared = [future.result() for future in futures]
+        run_paths = [run for runs, _, _ in prepared for run in runs]
+        # 元のファイルをそのまま使うランだけヘッダー行を飛ばす（書き出したランにはヘッダーが無い）
+        skip_header = [header and run in paths for run in run_paths]
+        rows = sum(r for _, r, _ in prepared)
+        skipped = sum(s for _, _, s in prepared)
+        sorted_files = sum(1 for runs, _, _ in prepared if runs[0] in paths)
+        n_runs = len(run_paths)
+        run_paths, skip_header, reduced, passes = reduce_runs(run_paths, skip_header, run_dir, tuple(time_columns),
+                                                              time_format, sep, block_rows, keep, max_fan_in)
+        with open(output_file, "w", encoding="utf-8", newline="") as out:
+            if header:
+                with open(paths[0], "r", encoding="utf-8", newline="") as f:
+                    out.write(f.readline().rstrip("\r\n") + "\n")
+            written, duplicates = merge_runs(run_paths, out, skip_header, tuple(time_columns), time_format, sep,
+                                             block_rows, keep)
+    return {
+        "files": len(paths),
+        "files_sorted_in_place": sorted_files,
+        "runs": n_runs,
+        "intermediate_passes": passes,
+        "rows_read": rows,
+        "rows_written": written,
+        "duplicates_removed": reduced + duplicates,
+        "unparsed_rows_removed": skipped,
+    }
+
+
+def main(pattern="BTCUSDT_60_*.csv", output_file="merged.csv", time_format=DEFAULT_TIME_FORMAT, header=False,
+         keep="last", max_workers=None):
+    paths = glob.glob(pattern)
+    if not paths:
+        print(f"'{pattern}' に一致するファイルがありません。")
+        return None
+    stats = merge_csv_files(paths, output_file, time_format=time_format, header=header, keep=keep,
+                            max_workers=max_workers)
+    print(f"{stats['files']} ファイル（{stats['rows_read']} 行）を結合し、{output_file} に {stats['rows_written']} 行を保存しました。"
+          f"（重複 {stats['duplicates_removed']} 行・時刻を読めない {stats['unparsed_rows_removed']} 行を除外）")
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CSVファイルを時刻順に結合する（重複する時刻は1行にまとめる）")
+    parser.add_argument("pattern", nargs="?", default="BTCUSDT_60_*.csv", help="結合するファイルのパターン")
+    parser.add_argument("-o", "--output", default="merged.csv")
+    parser.add_argument("--time-format", default=DEFAULT_TIME_FORMAT, help="1列目の日時のフォーマット")
+    parser.add_argument("--header", action="store_true", help="各ファイルの1行目がヘッダーの場合に指定")
+    parser.add_argument("--keep", choices=["first", "last"], default="last", help="重複した時刻で残す行")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    main(args.pattern, args.output, args.time_format, args.header, args.keep, args.workers)
@@ -1,81 +1,202 @@
+import json
+
+import numpy as np
 import pandas as pd
+from dataset_io import dataset_path, iter_dataset, keeps_dtypes
+from schema import COLUMN_DTYPES
 
-def check_missing_values(df):
-    """各列の欠損値件数をチェックする"""
-    missing = df.isnull().sum()
-    issues = []
-    for col, cnt in missing.items():
-        if cnt > 0:
-            issues.append(f"列 '{col}' に欠損値が {cnt} 件存在します。")
-    return issues
+# 統合データの品質チェック
+# ファイルをチャンク単位で1回だけ読み、欠損値・負の値・時刻の重複/順序/欠け・値の張り付き・
+# OHLCの整合性・dtype をまとめて集計する。メモリに載らない大きさのファイルも扱える。
+# 結果はテキスト(preprocessing_issues.txt)とJSON(preprocessing_report.json)で出力する
+
+HOUR_NS = 60 * 60 * 1_000_000_000
+# 通常は非負であるべき列
+# ※ fundingRateは場合によってはゼロや正負がある可能性もあるので、必要に応じて調整
+NON_NEGATIVE_COLUMNS = ["volume", "turnover", "ATR", "openInterest", "fundingRate"]
+# 同じ値がSTALE_RUN_LENGTH本以上続いたら「張り付き」とみなす列
+STALE_COLUMNS = ["open", "high", "low", "close", "volume", "turnover", "openInterest"]
+STALE_RUN_LENGTH = 6
+# schema で型を決めている列（作成時に apply_schema を通していれば一致する）
+# CSVは読み込み時に数値列がすべて float64 になるため、型を保存する形式(Parquet・Feather)だけで確認する
+EXPECTED_DTYPES = {col: COLUMN_DTYPES[col] for col in ["open", "high", "low", "close", "volume", "turnover",
+                                                         "ATR", "fundingRate", "openInterest"]}
+MAX_EXAMPLES = 10  # レポートに載せる該当時刻の例の件数
 
-def check_negative_values(df, cols):
+
+class DatasetValidator:
     """
-    指定した数値列について、マイナス値が含まれている場合に問題として報告する。
-    例：volume, turnover, ATR, openInterestなど、通常は非負であるべき値。
+    チャンク(DataFrame)を update() で順に受け取り、全チェックの集計値を状態として持つ。
+    チャンク境界をまたぐ時刻の順序や値の張り付きは、前チャンク末尾の値を引き継いで判定する。
+    時刻の重複と欠けは、全行の時刻(int64、1行8バイト)を保持して最後に判定する。
     """
-    issues = []
-    for col in cols:
-        if col in df.columns:
-            negatives = (df[col] < 0).sum()
-            if negatives > 0:
-                issues.append(f"列 '{col}' に負の値が {negatives} 件あります。")
-    return issues
-
-def check_time_duplicates_and_order(df, time_col="time"):
-    """時刻列の重複と昇順になっているかをチェックする"""
-    issues = []
-    if df[time_col].duplicated().any():
-        dup_count = df[time_col].duplicated().sum()
-        issues.append(f"時刻列 '{time_col}' に重複が {dup_count} 件あります。")
-    if not df[time_col].is_monotonic_increasing:
-        issues.append(f"時刻列 '{time_col}' が昇順になっていません。")
-    return issues
-
-def check_dtypes(df, expected_dtypes):
+
+    def __init__(self, time_col="time", non_negative=NON_NEGATIVE_COLUMNS, stale_columns=STALE_COLUMNS,
+                 stale_run_length=STALE_RUN_LENGTH, expected_dtypes=EXPECTED_DTYPES):
+        self.time_col = time_col
+        self.non_negative = non_negative
+        self.stale_columns = stale_columns
+        self.stale_run_length = stale_run_length
+        self.expected_dtypes = expected_dtypes
+        self.rows = 0
+        self.missing = {}
+        self.negative = {}
+        self.dtypes = {}
+        self.times = []
+        self.last_time = None
+        self.order_violations = 0
+        self.stale = {}  # 列 -> {"last": 直前の値, "run": 直前の値が続いている本数, "runs": 件数, "max_run": 最長}
+        self.ohlc = {"high_below_low": 0, "open_out_of_range": 0, "close_out_of_range": 0}
+        self.ohlc_examples = []
+
+    # -------------------------------
+    # チャンクごとの集計
+    # -------------------------------
+    def update(self, chunk):
+        self.rows += len(chunk)
+        for col, cnt in chunk.isnull().sum().items():
+            self.missing[col] = self.missing.get(col, 0) + int(cnt)
+        for col, dtype in chunk.dtypes.items():
+            self.dtypes.setdefault(col, set()).add(str(dtype))
+        for col in self.non_negative:
+            if col in chunk.columns and pd.api.types.is_numeric_dtype(chunk[col]):
+                self.negative[col] = self.negative.get(col, 0) + int((chunk[col].to_numpy() < 0).sum())
+        times = chunk[self.time_col].to_numpy(dtype="datetime64[ns]").astype(np.int64)
+        self._update_time(times)
+        for col in self.stale_columns:
+            if col in chunk.columns and pd.api.types.is_numeric_dtype(chunk[col]):
+                self._update_stale(col, chunk[col].to_numpy(dtype=np.float64))
+        if all(col in chunk.columns for col in ("open", "high", "low", "close")):
+            self._update_ohlc(chunk, times)
+
+    def _update_time(self, times):
+        self.times.append(times)
+        if len(times) == 0:
+            return
+        previous = times if self.last_time is None else np.concatenate([[self.last_time], times])
+        self.order_violations += int((np.diff(previous) < 0).sum())
+        self.last_time = times[-1]
+
+    def _update_stale(self, col, values):
+        state = self.stale.setdefault(col, {"last": np.nan, "run": 0, "runs": 0, "max_run": 0})
+        if len(values) == 0:
+            return
+        # 値が変わる位置で区切り、各区間(同じ値が続く区間)の長さを求める
+        starts = np.flatnonzero(np.concatenate([[True], values[1:] != values[:-1]]))
+        lengths = np.diff(np.append(starts, len(values)))
+        if values[0] == state["last"]:
+            lengths[0] += state["run"]
+        elif state["run"] >= self.stale_run_length:
+            # 前チャンクから続いていた区間はここで確定する
+            state["runs"] += 1
+        # 最後の区間は次のチャンクに続く可能性があるので、確定した区間だけを数える
+        closed = lengths[:-1]
+        state["runs"] += int((closed >= self.stale_run_length).sum())
+        state["max_run"] = max(state["max_run"], int(lengths.max()))
+        state["last"], state["run"] = values[-1], int(lengths[-1])
+
+    def _update_ohlc(self, chunk, times):
+        o, h, l, c = (chunk[col].to_numpy(dtype=np.float64) for col in ("open", "high", "low", "close"))
+        high_below_low = h < l
+        open_out = (o > h) | (o < l)
+        close_out = (c > h) | (c < l)
+        self.ohlc["high_below_low"] += int(high_below_low.sum())
+        self.ohlc["open_out_of_range"] += int(open_out.sum())
+        self.ohlc["close_out_of_range"] += int(close_out.sum())
+        bad = np.flatnonzero(high_below_low | open_out | close_out)
+        for i in bad[:MAX_EXAMPLES - len(self.ohlc_examples)]:
+            self.ohlc_examples.append(str(pd.Timestamp(times[i])))
+
+    # -------------------------------
+    # 集計結果
+    # -------------------------------
+    def _time_report(self):
+        times = np.concatenate(self.times) if self.times else np.empty(0, dtype=np.int64)
+        unique = np.unique(times)
+        diffs = np.diff(unique)
+        gap_idx = np.flatnonzero(diffs > HOUR_NS)
+        return {
+            "duplicates": int(len(times) - len(unique)),
+            "monotonic_increasing": self.order_violations == 0,
+            "order_violations": self.order_violations,
+            "first": str(pd.Timestamp(unique[0])) if len(unique) else None,
+            "last": str(pd.Timestamp(unique[-1])) if len(unique) else None,
+            "gaps": int(len(gap_idx)),
+            "missing_hours": int((diffs[gap_idx] // HOUR_NS - 1).sum()),
+            "gap_examples": [[str(pd.Timestamp(unique[i])), str(pd.Timestamp(unique[i + 1]))]
+                             for i in gap_idx[:MAX_EXAMPLES]],
+        }
+
+    def _stale_report(self):
+        report = {}
+        for col, state in self.stale.items():
+            runs = state["runs"] + int(state["run"] >= self.stale_run_length)
+            report[col] = {"runs": runs, "max_run": state["max_run"]}
+        return report
+
+    def report(self):
+        """全チェックの結果をJSONに変換できるdictで返す（issues に問題点の文章を入れる）"""
+        time_report = self._time_report()
+        stale_report = self._stale_report()
+        report = {
+            "rows": self.rows,
+            "missing": {col: cnt for col, cnt in self.missing.items() if cnt > 0},
+            "negative": {col: cnt for col, cnt in self.negative.items() if cnt > 0},
+            "time": time_report,
+            "stale": {col: s for col, s in stale_report.items() if s["runs"] > 0},
+            "ohlc": dict(self.ohlc, examples=self.ohlc_examples),
+            "dtypes": {col: sorted(dtypes) for col, dtypes in self.dtypes.items()},
+        }
+
+        issues = []
+        for col, cnt in report["missing"].items():
+            issues.append(f"列 '{col}' に欠損値が {cnt} 件存在します。")
+        for col, cnt in report["negative"].items():
+            issues.append(f"列 '{col}' に負の値が {cnt} 件あります。")
+        if time_report["duplicates"]:
+            issues.append(f"時刻列 '{self.time_col}' に重複が {time_report['duplicates']} 件あります。")
+        if not time_report["monotonic_increasing"]:
+            issues.append(f"時刻列 '{self.time_col}' が昇順になっていません。")
+        if time_report["gaps"]:
+            issues.append(f"時刻列 '{self.time_col}' に1時間足の欠けが {time_report['gaps']} 箇所"
+                          f"（計 {time_report['missing_hours']} 時間分）あります。")
+        for col, s in report["stale"].items():
+            issues.append(f"列 '{col}' で同じ値が {self.stale_run_length} 本以上続く箇所が {s['runs']} 件あります"
+                          f"（最長 {s['max_run']} 本）。")
+        ohlc_labels = {"high_below_low": "high < low", "open_out_of_range": "open が high～low の範囲外",
+                       "close_out_of_range": "close が high～low の範囲外"}
+        for key, label in ohlc_labels.items():
+            if self.ohlc[key]:
+                issues.append(f"{label}の行が {self.ohlc[key]} 件あります。")
+        for col, dtype in self.expected_dtypes.items():
+            seen = report["dtypes"].get(col)
+            if seen and any(not pd.api.types.is_dtype_equal(d, dtype) for d in seen):
+                issues.append(f"列 '{col}' のdtypeが {', '.join(seen)} ですが、期待は {dtype} です。")
+        report["issues"] = issues
+        return report
+
+
+def validate_dataset(path, chunk_rows=500_000, **kwargs):
     """
-    expected_dtypes: dict形式で {列名: dtype} を指定
-    期待する型と異なる場合に問題として報告する。
+    データセットをチャンク単位で1回読み、DatasetValidator.report() の結果を返す。
+    CSVは列の型を保存しないので、expected_dtypes を指定しない限り dtype の確認は行わない。
     """
-    issues = []
-    for col, dtype in expected_dtypes.items():
-        if col in df.columns:
-            if not pd.api.types.is_dtype_equal(df[col].dtype, dtype):
-                issues.append(f"列 '{col}' のdtypeが {df[col].dtype} ですが、期待は {dtype} です。")
-    return issues
+    if not keeps_dtypes(path):
+        kwargs.setdefault("expected_dtypes", {})
+    validator = DatasetValidator(**kwargs)
+    for chunk in iter_dataset(path, chunk_rows=chunk_rows):
+        validator.update(chunk)
+    report = validator.report()
+    report["file"] = path
+    return report
+
 
 def main():
-    # CSVファイル読み込み（time列は日付型として読み込む）
-    input_file = "merged_dataset.csv"
-    df = pd.read_csv(input_file, parse_dates=["time"])
-    
-    issues = []
-    
-    # 1. 欠損値チェック
-    issues.extend(check_missing_values(df))
-    
-    # 2. 数値が非負であるべき列のチェック
-    numeric_cols = ["volume", "turnover", "ATR", "openInterest", "fundingRate"]
-    # ※ fundingRateは場合によってはゼロや正負がある可能性もあるので、必要に応じて調整
-    issues.extend(check_negative_values(df, numeric_cols))
-    
-    # 3. 時刻の重複と順序チェック
-    issues.extend(check_time_duplicates_and_order(df, time_col="time"))
-    
-    # 4. 各列のdtypeチェック（例として、open, high, low, close, volume, turnover, ATR, fundingRate, openInterestは数値型）
-    expected = {
-        "open": "float64",
-        "high": "float64",
-        "low": "float64",
-        "close": "float64",
-        "volume": "float64",
-        "turnover": "float64",
-        "ATR": "float64",
-        "fundingRate": "float64",
-        "openInterest": "float64"
-    }
-    issues.extend(check_dtypes(df, expected))
-    
+    # 統合データをチャンク単位で読み込んで検証（CSVの場合はtime列を日付型として読み込む）
+    input_file = dataset_path("merged_dataset")
+    report = validate_dataset(input_file)
+    issues = report["issues"]
+
     # まとめてテキストファイルに出力
     output_file = "preprocessing_issues.txt"
     with open(output_file, "w", encoding="utf-8") as f:
@@ -85,8 +206,13 @@ def main():
                 f.write(issue + "\n")
         else:
             f.write("問題は検出されませんでした。")
-    
-    print(f"検証結果が '{output_file}' に保存されました。")
+
+    # 集計値を含む全結果をJSONでも出力
+    report_file = "preprocessing_report.json"
+    with open(report_file, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(f"検証結果が '{output_file}' と '{report_file}' に保存されました。")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,144 @@
+import os
+
+import pandas as pd
+
+# 統合データセットの読み書き
+# 拡張子で形式を判定し、CSV / Parquet / Feather(Arrow IPC) を同じ関数で扱う。
+# Parquet・Featherは列の型をそのまま保存するため、読み込み時の文字列パースや浮動小数点の丸めが発生しない。
+# 既定は従来どおりCSVで、環境変数 DATASET_FORMAT（csv / parquet / feather）を指定したときだけ切り替える
+
+DATASET_FORMAT = os.environ.get("DATASET_FORMAT", "csv")
+FORMAT_EXTENSIONS = {"csv": ".csv", "parquet": ".parquet", "feather": ".feather"}
+
+
+def dataset_path(stem, fmt=None):
+    """拡張子なしのファイル名に、指定形式（省略時は DATASET_FORMAT）の拡張子を付けて返す"""
+    return stem + FORMAT_EXTENSIONS[fmt or DATASET_FORMAT]
+
+
+def _format_of(path):
+    ext = os.path.splitext(path)[1].lower()
+    for fmt, fmt_ext in FORMAT_EXTENSIONS.items():
+        if ext == fmt_ext:
+            return fmt
+    raise ValueError(f"未対応のファイル形式です: {path}")
+
+
+def keeps_dtypes(path):
+    """列の型をそのまま保存する形式(Parquet・Feather)なら True。CSVは読み込み時に型が決まるので False"""
+    return _format_of(path) != "csv"
+
+
+# -------------------------------
+# 一括読み書き
+# -------------------------------
+def write_dataset(df, path):
+    """DataFrameを拡張子に応じた形式で保存する（indexは保存しない）"""
+    fmt = _format_of(path)
+    if fmt == "csv":
+        df.to_csv(path, index=False)
+    elif fmt == "parquet":
+        df.to_parquet(path, index=False)
+    else:
+        # Featherは非圧縮で保存し、読み込み時にメモリマップできるようにする
+        df.reset_index(drop=True).to_feather(path, compression="uncompressed")
+
+
+def read_dataset(path, columns=None):
+    """拡張子に応じた形式でデータセットを読み込む。CSVの場合はtime列を日付型に変換する"""
+    fmt = _format_of(path)
+    if fmt == "csv":
+        header = pd.read_csv(path, nrows=0).columns
+        parse_dates = ["time"] if "time" in header and (columns is None or "time" in columns) else False
+        return pd.read_csv(path, usecols=columns, parse_dates=parse_dates)
+    if fmt == "parquet":
+        return pd.read_parquet(path, columns=columns)
+    import pyarrow as pa
+    import pyarrow.ipc
+    with pa.memory_map(path, "r") as source:
+        table = pa.ipc.open_file(source).read_all()
+    if columns is not None:
+        table = table.select(columns)
+    return table.to_pandas()
+
+
+def iter_dataset(path, chunk_rows=500_000, columns=None):
+    """
+    データセットを最大chunk_rows行ずつのDataFrameとして順に返すジェネレータ。
+    ファイル全体をメモリに載せないため、メモリより大きいファイルも扱える（Featherはメモリマップで読む）。
+    """
+    fmt = _format_of(path)
+    if fmt == "csv":
+        header = pd.read_csv(path, nrows=0).columns
+        parse_dates = ["time"] if "time" in header and (columns is None or "time" in columns) else False
+        yield from pd.read_csv(path, usecols=columns, parse_dates=parse_dates, chunksize=chunk_rows)
+        return
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas()
+        return
+    import pyarrow as pa
+    import pyarrow.ipc
+    with pa.memory_map(path, "r") as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            if columns is not None:
+                batch = batch.select(columns)
+            for offset in range(0, batch.num_rows, chunk_rows):
+                yield batch.slice(offset, chunk_rows).to_pandas()
+
+
+# -------------------------------
+# 逐次書き込み
+# -------------------------------
+class DatasetWriter:
+    """
+    DataFrameのチャンクを1ファイルへ順に書き足すライター（stream_pipeline 用）。
+    Parquet・Featherは最初のチャンクの列型をスキーマとして固定し、以降のチャンクをその型に揃える。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fmt = _format_of(path)
+        self.writer = None
+        self.schema = None
+        self.rows = 0
+        if os.path.exists(path):
+            os.remove(path)
+
+    def write(self, df):
+        if self.fmt == "csv":
+            df.to_csv(self.path, mode="a", header=(self.rows == 0), index=False)
+            self.rows += len(df)
+            return
+        import pyarrow as pa
+        if self.writer is None:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            # Arrow IPCファイルはバッチごとに辞書を変えられないため、category列は値の型(文字列)で保存する
+            # （読み込み時に schema.apply_schema で category に戻す）
+            self.schema = pa.schema([field.with_type(field.type.value_type) if pa.types.is_dictionary(field.type)
+                                     else field for field in table.schema], metadata=table.schema.metadata)
+            table = table.cast(self.schema)
+            if self.fmt == "parquet":
+                import pyarrow.parquet as pq
+                self.writer = pq.ParquetWriter(self.path, self.schema)
+            else:
+                import pyarrow.ipc
+                self.writer = pa.ipc.new_file(self.path, self.schema)
+        else:
+            table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+        self.writer.write_table(table)
+        self.rows += len(df)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
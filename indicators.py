@@ -0,0 +1,319 @@
+import json
+import math
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+# テクニカル指標の計算
+# ・compute_indicator_arrays: 全期間をNumPy配列上でまとめて計算する一括版（main.calculate_indicators が使用）
+# ・OnlineIndicators: 新しい足が1本届くたびにO(1)で更新する逐次版
+
+ATR_PERIOD = 14
+BB_PERIOD = 20
+RSI_PERIOD = 14
+EMA_PERIOD = 20
+MA_PERIODS = (5, 10, 20)
+
+INDICATOR_COLUMNS = ["ATR", "MA20", "BB_upper", "BB_lower", "MA5", "MA10", "MA20_calc",
+                     "RSI", "avg_gain", "avg_loss", "EMA"]
+
+
+# -------------------------------
+# 一括計算カーネル
+# -------------------------------
+def _window_diff(csum, window):
+    """累積和から長さwindowの区間和を取り出す（戻り値の長さは len(csum) - window + 1）"""
+    out = np.empty(len(csum) - window + 1)
+    out[0] = csum[window - 1]
+    np.subtract(csum[window:], csum[:-window], out=out[1:])
+    return out
+
+
+def _rolling_sums(x, windows, center=0.0):
+    """
+    累積和1回から複数のウィンドウ幅のローリング合計を計算し、{window: ndarray} で返す。
+    NaNを含むウィンドウや本数不足の位置はNaNにする（pandasの rolling(window, min_periods=window).sum() と同じ扱い）。
+    centerを引いてから累積することで、価格のような大きな値でも桁落ちを抑える。
+    """
+    n = len(x)
+    nan_mask = np.isnan(x)
+    has_nan = bool(nan_mask.any())
+    csum = np.cumsum(np.where(nan_mask, 0.0, x - center) if has_nan else x - center)
+    ccount = np.cumsum(~nan_mask) if has_nan else None
+    result = {}
+    for window in windows:
+        out = np.full(n, np.nan)
+        if n >= window:
+            sums = _window_diff(csum, window)
+            sums += center * window
+            if has_nan:
+                sums[_window_diff(ccount, window) != window] = np.nan
+            out[window - 1:] = sums
+        result[window] = out
+    return result
+
+
+def _rolling_sum(x, window, center=0.0):
+    """ローリング合計（_rolling_sums のウィンドウ1つ版）"""
+    return _rolling_sums(x, (window,), center)[window]
+
+
+def _rolling_mean_nonneg(x, window):
+    """非負の系列のローリング平均。ウィンドウ内がすべて0なら累積誤差を残さず厳密に0を返す"""
+    mean = _rolling_sum(x, window) / window
+    nonzero = _rolling_sum((x > 0).astype(np.float64), window)
+    return np.where(nonzero == 0, 0.0, mean)
+
+
+def compute_indicator_arrays(high, low, close):
+    """
+    高値・安値・終値のfloat64配列から INDICATOR_COLUMNS の各指標を計算し、dict of ndarray で返す。
+    移動平均系は累積和1回ずつ、ボリンジャーバンドの分散はMA20との差の二乗をウィンドウ幅分ずらして足し合わせ、
+    中間列を作らずに計算する。定義は従来の pandas rolling 版と同じ。
+    """
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    close = np.asarray(close, dtype=np.float64)
+    n = len(close)
+    center = float(close[0]) if n else 0.0
+
+    # ATR (14期間)：初回は前日終値が無いので high - low
+    prev_close = np.empty(n)
+    prev_close[:1] = np.nan
+    prev_close[1:] = close[:-1]
+    tr = np.fmax(high - low, np.fmax(np.abs(high - prev_close), np.abs(low - prev_close)))
+    atr = _rolling_sum(tr, ATR_PERIOD) / ATR_PERIOD
+
+    # 移動平均線
+    ma = {period: sums / period for period, sums in _rolling_sums(close, MA_PERIODS, center).items()}
+
+    # ボリンジャーバンド（20期間、標準偏差倍率2、不偏分散）
+    ma20 = ma[BB_PERIOD]
+    std20 = np.full(n, np.nan)
+    if n >= BB_PERIOD:
+        m = ma20[BB_PERIOD - 1:]
+        sq = np.zeros(len(m))
+        diff = np.empty(len(m))
+        for lag in range(BB_PERIOD):
+            np.subtract(close[BB_PERIOD - 1 - lag:n - lag], m, out=diff)
+            np.multiply(diff, diff, out=diff)
+            sq += diff
+        sq /= BB_PERIOD - 1
+        std20[BB_PERIOD - 1:] = np.sqrt(sq)
+
+    # RSI (14期間、単純移動平均)：差分の無い先頭1本はNaN
+    avg_gain = np.full(n, np.nan)
+    avg_loss = np.full(n, np.nan)
+    if n > 1:
+        delta = np.diff(close)
+        avg_gain[1:] = _rolling_mean_nonneg(np.maximum(delta, 0.0), RSI_PERIOD)
+        avg_loss[1:] = _rolling_mean_nonneg(np.maximum(-delta, 0.0), RSI_PERIOD)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rs = avg_gain / avg_loss
+        rsi = 100 - (100 / (1 + rs))
+
+    # EMA (20期間、adjust=False) は漸化式なのでpandasのewmで計算する
+    ema = pd.Series(close).ewm(span=EMA_PERIOD, adjust=False).mean().to_numpy()
+
+    return {
+        "ATR": atr,
+        "MA20": ma20,
+        "BB_upper": ma20 + 2 * std20,
+        "BB_lower": ma20 - 2 * std20,
+        "MA5": ma[5],
+        "MA10": ma[10],
+        "MA20_calc": ma20.copy(),
+        "RSI": rsi,
+        "avg_gain": avg_gain,
+        "avg_loss": avg_loss,
+        "EMA": ema,
+    }
+
+
+# -------------------------------
+# オンライン指標エンジン
+# -------------------------------
+# pandas の ewm(span=EMA_PERIOD, adjust=False) と同じ係数（com=(span-1)/2, alpha=1/(1+com)）
+EMA_ALPHA = 1.0 / (1.0 + (EMA_PERIOD - 1) / 2)
+EMA_DECAY = 1.0 - EMA_ALPHA
+
+
+class _CumulativeWindow:
+    """
+    compute_indicator_arrays の _rolling_sums と同じく「先頭からの累積和の差」でローリング合計を求めるための状態。
+    累積和は先頭から同じ順に足していくので、一括計算と同じ値(ビット単位で一致)になる。
+    直近 max_window + 1 本分の累積和だけを持つので、1本あたりの更新は O(1)。
+    """
+
+    def __init__(self, max_window, center=0.0):
+        self.center = center
+        self.count = 0
+        self.csum = 0.0
+        self.history = deque(maxlen=max_window + 1)
+
+    def append(self, x):
+        self.csum += x - self.center
+        self.history.append(self.csum)
+        self.count += 1
+
+    def window_sum(self, window):
+        """直近 window 本の合計（本数が足りなければNaN）"""
+        if self.count < window:
+            return float("nan")
+        if self.count == window:
+            total = self.history[-1]
+        else:
+            total = self.history[-1] - self.history[-1 - window]
+        return total + self.center * window
+
+    def to_dict(self):
+        return {"center": self.center, "count": self.count, "csum": self.csum, "history": list(self.history)}
+
+    @classmethod
+    def from_dict(cls, state, max_window):
+        window = cls(max_window, state["center"])
+        window.count = state["count"]
+        window.csum = state["csum"]
+        window.history.extend(state["history"])
+        return window
+
+
+class OnlineIndicators:
+    """
+    ATR・ボリンジャーバンド・MA5/10/20・RSI・EMAを1本ずつ更新するクラス。
+    ローリング合計は一括計算(compute_indicator_arrays)と同じ累積和の差、ボリンジャーバンドの分散は
+    同じ順の二乗和、EMAは pandas の ewm(adjust=False) と同じ漸化式で求めるため、
+    calculate_indicators と同じ値になる（入力に欠損が無い場合）。to_dict()/from_dict() でJSONに保存・復元できる。
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.prev_close = None
+        self.ema = None
+        self.closes = deque(maxlen=BB_PERIOD)
+        self.gains = deque(maxlen=RSI_PERIOD)
+        self.losses = deque(maxlen=RSI_PERIOD)
+        # 終値の累積和は、一括計算と同じく最初の終値を引いてから累積する（center は最初の update で決める）
+        self.close_window = _CumulativeWindow(max(MA_PERIODS))
+        self.tr_window = _CumulativeWindow(ATR_PERIOD)
+        self.gain_window = _CumulativeWindow(RSI_PERIOD)
+        self.loss_window = _CumulativeWindow(RSI_PERIOD)
+
+    def update(self, high, low, close):
+        """新しい足の高値・安値・終値で状態を更新し、その足の指標値をdictで返す"""
+        high, low, close = float(high), float(low), float(close)
+        if self.count == 0:
+            self.close_window.center = close
+
+        # ATR用のトゥルーレンジ（初回は前日終値が無いので high - low）
+        if self.prev_close is None:
+            tr = high - low
+        else:
+            tr = max(high - low, abs(high - self.prev_close), abs(low - self.prev_close))
+        self.tr_window.append(tr)
+
+        # 移動平均・ボリンジャーバンド用の終値
+        self.close_window.append(close)
+        self.closes.append(close)
+
+        # RSI用の値上がり幅・値下がり幅（初回は差分が無いので追加しない）
+        if self.prev_close is not None:
+            delta = close - self.prev_close
+            gain, loss = max(delta, 0.0), max(-delta, 0.0)
+            self.gains.append(gain)
+            self.losses.append(loss)
+            self.gain_window.append(gain)
+            self.loss_window.append(loss)
+
+        # EMA（pandas の ewm(adjust=False) と同じ式。値が変わらない足では更新しない）
+        if self.ema is None:
+            self.ema = close
+        elif self.ema != close:
+            self.ema = (EMA_DECAY * self.ema + EMA_ALPHA * close) / (EMA_DECAY + EMA_ALPHA)
+
+        self.prev_close = close
+        self.count += 1
+        return self.current()
+
+    def current(self):
+        """直近の足に対する指標値をdictで返す（期間に満たない指標はNaN）"""
+        nan = float("nan")
+        values = dict.fromkeys(INDICATOR_COLUMNS, nan)
+        values["ATR"] = self.tr_window.window_sum(ATR_PERIOD) / ATR_PERIOD
+        for period in (5, 10):
+            values[f"MA{period}"] = self.close_window.window_sum(period) / period
+        if len(self.closes) == BB_PERIOD:
+            ma20 = self.close_window.window_sum(BB_PERIOD) / BB_PERIOD
+            # 一括計算と同じく、新しい足から順に MA20 との差の二乗を足す
+            sq = 0.0
+            for lag in range(BB_PERIOD):
+                diff = self.closes[-1 - lag] - ma20
+                sq += diff * diff
+            std20 = math.sqrt(sq / (BB_PERIOD - 1))
+            values["MA20"] = values["MA20_calc"] = ma20
+            values["BB_upper"] = ma20 + 2 * std20
+            values["BB_lower"] = ma20 - 2 * std20
+        if len(self.gains) == RSI_PERIOD:
+            # ウィンドウ内がすべて0なら合計も厳密に0として扱う（_rolling_mean_nonneg と同じ）
+            avg_gain = self.gain_window.window_sum(RSI_PERIOD) / RSI_PERIOD if any(self.gains) else 0.0
+            avg_loss = self.loss_window.window_sum(RSI_PERIOD) / RSI_PERIOD if any(self.losses) else 0.0
+            if avg_loss == 0:
+                rs = math.inf if avg_gain > 0 else nan
+            else:
+                rs = avg_gain / avg_loss
+            values["RSI"] = 100 - (100 / (1 + rs))
+            values["avg_gain"] = avg_gain
+            values["avg_loss"] = avg_loss
+        if self.ema is not None:
+            values["EMA"] = self.ema
+        return values
+
+    def update_frame(self, df):
+        """high/low/close 列を持つDataFrameの各行を順に反映し、指標値の配列(dict of ndarray)を返す"""
+        rows = [self.update(h, l, c) for h, l, c in
+                zip(df["high"].to_numpy(), df["low"].to_numpy(), df["close"].to_numpy())]
+        return {col: np.array([row[col] for row in rows], dtype=np.float64) for col in INDICATOR_COLUMNS}
+
+    # -------------------------------
+    # 状態の保存・復元
+    # -------------------------------
+    def to_dict(self):
+        """状態をJSONにできるdictで返す"""
+        return {
+            "count": self.count,
+            "prev_close": self.prev_close,
+            "ema": self.ema,
+            "closes": list(self.closes),
+            "gains": list(self.gains),
+            "losses": list(self.losses),
+            "close_window": self.close_window.to_dict(),
+            "tr_window": self.tr_window.to_dict(),
+            "gain_window": self.gain_window.to_dict(),
+            "loss_window": self.loss_window.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        """to_dict() で保存した状態から復元する"""
+        engine = cls()
+        engine.count = state["count"]
+        engine.prev_close = state["prev_close"]
+        engine.ema = state["ema"]
+        engine.closes.extend(state["closes"])
+        engine.gains.extend(state["gains"])
+        engine.losses.extend(state["losses"])
+        engine.close_window = _CumulativeWindow.from_dict(state["close_window"], max(MA_PERIODS))
+        engine.tr_window = _CumulativeWindow.from_dict(state["tr_window"], ATR_PERIOD)
+        engine.gain_window = _CumulativeWindow.from_dict(state["gain_window"], RSI_PERIOD)
+        engine.loss_window = _CumulativeWindow.from_dict(state["loss_window"], RSI_PERIOD)
+        return engine
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
@@ -0,0 +1,133 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+# ローソク足のローカル保存領域
+# (category, symbol, interval) ごとに1ファイルの固定長バイナリ(構造化配列)として追記保存し、
+# 読み込みは np.memmap で行うため、全件をパースし直す必要がない
+
+KLINE_COLUMNS = ["time", "open", "high", "low", "close", "volume", "turnover"]
+KLINE_DTYPE = np.dtype([("time", "<i8")] + [(col, "<f8") for col in KLINE_COLUMNS[1:]])
+
+# Bybitのinterval表記ごとの足の長さ(ミリ秒)
+KLINE_INTERVAL_MS = {
+    "1": 60 * 1000,
+    "3": 3 * 60 * 1000,
+    "5": 5 * 60 * 1000,
+    "15": 15 * 60 * 1000,
+    "30": 30 * 60 * 1000,
+    "60": 60 * 60 * 1000,
+    "120": 2 * 60 * 60 * 1000,
+    "240": 4 * 60 * 60 * 1000,
+    "360": 6 * 60 * 60 * 1000,
+    "720": 12 * 60 * 60 * 1000,
+    "D": 24 * 60 * 60 * 1000,
+    "W": 7 * 24 * 60 * 60 * 1000,
+}
+
+
+def parse_kline_page(data_list):
+    """APIから取得したローソク足(文字列のリスト)を時刻昇順の構造化配列に変換する"""
+    if not data_list:
+        return np.empty(0, dtype=KLINE_DTYPE)
+    values = np.asarray(data_list, dtype=np.float64)[:, :len(KLINE_COLUMNS)]
+    records = np.empty(len(values), dtype=KLINE_DTYPE)
+    records["time"] = values[:, 0].astype(np.int64)
+    for i, col in enumerate(KLINE_COLUMNS[1:], start=1):
+        records[col] = values[:, i]
+    return np.sort(records, order="time")
+
+
+def records_to_frame(records):
+    """構造化配列を calculate_indicators に渡せる DataFrame に変換する"""
+    return pd.DataFrame({col: np.asarray(records[col]) for col in KLINE_COLUMNS})
+
+
+# -------------------------------
+# ローソク足ストア
+# -------------------------------
+class KlineStore:
+    """
+    確定済みのローソク足を (symbol, category, interval) 単位で保存するストア。
+    ファイルは root/category/symbol/interval.bin に KLINE_DTYPE の配列として置かれる。
+    """
+
+    def __init__(self, root="kline_store"):
+        self.root = root
+
+    def path(self, symbol, category, interval):
+        return os.path.join(self.root, category, symbol, f"{interval}.bin")
+
+    def read(self, symbol, category, interval):
+        """保存済みの全ローソク足をメモリマップで返す（未保存なら空配列）"""
+        path = self.path(symbol, category, interval)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return np.empty(0, dtype=KLINE_DTYPE)
+        return np.memmap(path, dtype=KLINE_DTYPE, mode="r")
+
+    def last_timestamp(self, symbol, category, interval):
+        """保存済みの最新ローソク足の開始時刻(ミリ秒)を返す（未保存ならNone）"""
+        path = self.path(symbol, category, interval)
+        if not os.path.exists(path) or os.path.getsize(path) < KLINE_DTYPE.itemsize:
+            return None
+        with open(path, "rb") as f:
+            f.seek(-KLINE_DTYPE.itemsize, os.SEEK_END)
+            last = np.frombuffer(f.read(KLINE_DTYPE.itemsize), dtype=KLINE_DTYPE)
+        return int(last["time"][0])
+
+    def append(self, symbol, category, interval, records):
+        """
+        ローソク足を保存する。既存の最新時刻より新しいものだけなら末尾に追記し、
+        過去分が混ざっている場合は既存データとマージして書き直す。
+        """
+        if len(records) == 0:
+            return
+        path = self.path(symbol, category, interval)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        last_ts = self.last_timestamp(symbol, category, interval)
+        records = np.sort(records, order="time")
+        if last_ts is None or records["time"][0] > last_ts:
+            _, idx = np.unique(records["time"], return_index=True)
+            with open(path, "ab") as f:
+                f.write(records[idx].tobytes())
+            return
+        merged = np.concatenate([np.array(self.read(symbol, category, interval)), records])
+        # 同じ時刻は後から来たデータを優先する
+        _, idx = np.unique(merged["time"][::-1], return_index=True)
+        merged = merged[::-1][idx]
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(merged.tobytes())
+        os.replace(tmp_path, path)
+
+
+def sync_klines(store, fetch, symbol="BTCUSDT", category="linear", interval="60", total_days=60):
+    """
+    ストアに無い期間だけを fetch(symbol=, category=, interval=, start_ts=, end_ts=) で取得して追記し、
+    直近total_days分のローソク足を DataFrame で返す。
+    確定済みの足だけを保存し、形成中の最新足は保存せず戻り値にだけ含める。
+    """
+    interval_ms = KLINE_INTERVAL_MS[interval]
+    end_ts = int(time.time() * 1000)
+    start_ts = end_ts - total_days * 24 * 60 * 60 * 1000
+    last_ts = store.last_timestamp(symbol, category, interval)
+    stored = store.read(symbol, category, interval)
+    if last_ts is None or len(stored) == 0 or stored["time"][0] >= start_ts + interval_ms:
+        # 未保存、または保存済みより古い期間が必要なときは全期間を取得する
+        fetch_start = start_ts
+    else:
+        fetch_start = last_ts + interval_ms
+    fetched = parse_kline_page(fetch(symbol=symbol, category=category, interval=interval,
+                                     start_ts=fetch_start, end_ts=end_ts))
+    closed = fetched[fetched["time"] + interval_ms <= end_ts]
+    store.append(symbol, category, interval, closed)
+    print(f"[KLINE STORE] {symbol} {category} {interval}: {len(closed)} 件追記（取得開始: {fetch_start}）")
+
+    stored = store.read(symbol, category, interval)
+    stored = stored[stored["time"] >= start_ts]
+    open_bars = fetched[fetched["time"] + interval_ms > end_ts]
+    if len(stored):
+        open_bars = open_bars[open_bars["time"] > stored["time"][-1]]
+    return records_to_frame(np.concatenate([np.array(stored), open_bars]))
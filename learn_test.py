@@ -4,9 +4,11 @@ import lightgbm as lgb
 from sklearn.metrics import mean_squared_error, r2_score
 import matplotlib.pyplot as plt
 import seaborn as sns
+from dataset_io import dataset_path
+from targets import read_with_targets
 
-# CSVファイルを読み込み、time列は日付型に変換
-df = pd.read_csv('merged_dataset_with_return.csv', parse_dates=['time'])
+# 統合データとターゲット(test.py で作成)を time で結合して読み込み（CSVの場合はtime列を日付型に変換）
+df = read_with_targets(dataset_path('merged_dataset'))
 
 # ターゲット変数(return_pct)がNaNの行を削除
 df = df.dropna(subset=['return_pct'])
@@ -2,23 +2,29 @@ import pandas as pd
 import numpy as np
 import math
 import itertools
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from sklearn.metrics import mean_squared_error, r2_score
 import tensorflow as tf
 from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import Dense, Dropout
+from tensorflow.keras.layers import Dense, Dropout, Flatten, Input
 from tensorflow.keras.optimizers import Adam
 from tensorflow.keras.callbacks import EarlyStopping
+from dataset_io import dataset_path
+from targets import read_with_targets
 
 
 # -------------------------------
 # データ読み込みと前処理
 # -------------------------------
-def load_and_preprocess_data(csv_file):
+def load_and_preprocess_data(data_file):
     """
-    CSVファイルからデータを読み込み、'time'列を日付型に変換し、
+    データファイル(CSV/Parquet/Feather)とターゲットのサイドカー(test.py で作成)を読み込み、
     ターゲット(return_pct)の欠損値を削除、特徴量とターゲットを抽出して返す関数
     """
-    df = pd.read_csv(csv_file, parse_dates=['time'])
+    df = read_with_targets(data_file)
     df = df.dropna(subset=['return_pct'])
     feature_cols = ["open", "high", "low", "close", "volume", "ATR", "MA20", "RSI", "EMA", "openInterest"]
     X = df[feature_cols].values
@@ -37,16 +43,86 @@ def split_data(X, y, split_ratio=0.8):
     y_train, y_test = y[:split_index], y[split_index:]
     return X_train, X_test, y_train, y_test
 
+# -------------------------------
+# 共通のデータ準備（標準化・float32化・tf.data）
+# -------------------------------
+def prepare_data(X, y, split_ratio=0.8, val_ratio=0.1, window=None):
+    """
+    全試行で共有する学習データを1回だけ作る関数。
+    時系列順に train / val(学習期間の末尾 val_ratio) / test に分け、学習部分の平均・標準偏差で
+    特徴量を標準化して float32 に変換する（val・test の統計量は使わない）。
+    window を指定すると、直近 window 本の特徴量を1サンプルとする系列データとして扱う。
+    """
+    X_train, X_test, y_train, y_test = split_data(np.asarray(X, dtype=np.float64), np.asarray(y, dtype=np.float64),
+                                                  split_ratio=split_ratio)
+    n_val = int(len(X_train) * val_ratio)
+    X_train, X_val = X_train[:len(X_train) - n_val], X_train[len(X_train) - n_val:]
+    y_train, y_val = y_train[:len(y_train) - n_val], y_train[len(y_train) - n_val:]
+    if window:
+        # window 本に満たない区間は系列が1つも作れず、val_loss 等が記録されないまま学習が進んでしまう
+        for name, part in (('train', X_train), ('val', X_val), ('test', X_test)):
+            if len(part) < window:
+                raise ValueError(f"{name} の行数({len(part)})が window({window}) より少ないため系列を作れません。"
+                                 f"データ期間を延ばすか window・split_ratio・val_ratio を見直してください")
+    mean =np.nanmean(X_train, axis=0)
+    std = np.nanstd(X_train, axis=0)
+    std[~(std > 0)] = 1.0
+
+    def scale(values):
+        return ((values - mean) / std).astype(np.float32)
+
+    data = {
+        'X_train': scale(X_train), 'y_train': y_train.astype(np.float32),
+        'X_val': scale(X_val), 'y_val': y_val.astype(np.float32),
+        'X_test': scale(X_test), 'y_test': y_test.astype(np.float32),
+        'mean': mean, 'std': std, 'window': window,
+    }
+    # 系列データでは各区間の先頭 window-1 行は入力が揃わないため、評価対象のターゲットはその分短くなる
+    data['y_test_eval'] = y_test[window - 1:] if window else y_test
+    return data
+
+
+def make_dataset(X, y, batch_size, window=None, shuffle=False):
+    """
+    float32配列からキャッシュ・プリフェッチ付きの tf.data パイプラインを作る関数。
+    window を指定すると (window, 特徴量数) の系列と、その最後の行のターゲットの組にする。
+    """
+    if window:
+        ds = tf.keras.utils.timeseries_dataset_from_array(X, y[window - 1:], sequence_length=window,
+                                                          batch_size=None)
+    else:
+        ds = tf.data.Dataset.from_tensor_slices((X, y))
+    ds = ds.cache()
+    if shuffle:
+        ds = ds.shuffle(len(X), reshuffle_each_iteration=True)
+    return ds.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+
+def make_datasets(data, batch_size):
+    """train / val / test の tf.data パイプラインを作る（train だけエポックごとにシャッフルする）"""
+    window = data['window']
+    return {
+        'train': make_dataset(data['X_train'], data['y_train'], batch_size, window, shuffle=True),
+        'val': make_dataset(data['X_val'], data['y_val'], batch_size, window),
+        'test': make_dataset(data['X_test'], data['y_test'], batch_size, window),
+    }
+
 # -------------------------------
 # モデル構築
 # -------------------------------
-def build_model(input_dim, hidden_layers, neurons, dropout_rate):
+def build_model(input_dim, hidden_layers, neurons, dropout_rate, window=None):
     """
     入力次元、隠れ層数、各層のユニット数、ドロップアウト率を指定してKerasモデルを構築する関数
+    window を指定した場合は (window, input_dim) の系列を平坦化してから全結合層に入れる
     """
     model = Sequential()
     # 入力層＋第1隠れ層
-    model.add(Dense(neurons, activation='relu', input_dim=input_dim))
+    if window:
+        model.add(Input(shape=(window, input_dim)))
+        model.add(Flatten())
+    else:
+        model.add(Input(shape=(input_dim,)))
+    model.add(Dense(neurons, activation='relu'))
     if dropout_rate > 0:
         model.add(Dropout(dropout_rate))
     # 指定された隠れ層数-1分の隠れ層追加
@@ -61,60 +137,149 @@ def build_model(input_dim, hidden_layers, neurons, dropout_rate):
 # -------------------------------
 # ハイパーパラメータ探索と評価
 # -------------------------------
-def hyperparameter_search(X_train, X_test, y_train, y_test, input_dim):
+# 探索するハイパーパラメータ。エポック数はEarlyStoppingで打ち切られるため軸にせず、
+# 最大エポック数(MAX_EPOCHS)を共通の予算として Successive Halving で配分する
+PARAM_GRID = {
+    'hidden_layers': [1, 2],
+    'neurons': [32, 64],
+    'dropout_rate': [0.0, 0.2],
+    'learning_rate': [0.001, 0.01],
+    'batch_size': [32]
+}
+MAX_EPOCHS = 100
+# 直近何本の足を1サンプルにするか（None なら1行1サンプル。例: 24 で直近24時間の系列）
+SEQUENCE_WINDOW = None
+
+# ワーカープロセス内で使う学習データ（_init_worker で1回だけ受け取る）と、バッチサイズごとの tf.data パイプライン
+_worker_data = {}
+_worker_datasets = {}
+
+
+def _init_worker(core_queue, threads_per_worker, data):
     """
-    複数のハイパーパラメータの組み合わせでモデルを学習し、RMSEとR²の結果をリストとして返す関数
+    ワーカープロセスの初期化処理。割り当てられたCPUコアに固定し、
+    TensorFlowのスレッド数をコア数に合わせてから、prepare_data で作った学習データを保持する。
     """
-    results = []
-    param_grid = {
-        'hidden_layers': [1, 2],
-        'neurons': [32, 64],
-        'dropout_rate': [0.0, 0.2],
-        'learning_rate': [0.001, 0.01],
-        'epochs': [50, 100],
-        'batch_size': [32]
-    }
-    
-    # 全組み合わせでループ
-    for hidden_layers, neurons, dropout_rate, learning_rate, epochs, batch_size in itertools.product(
-            param_grid['hidden_layers'],
-            param_grid['neurons'],
-            param_grid['dropout_rate'],
-            param_grid['learning_rate'],
-            param_grid['epochs'],
-            param_grid['batch_size']):
-        
-        print(f"Training DL model with layers={hidden_layers}, neurons={neurons}, dropout={dropout_rate}, lr={learning_rate}, epochs={epochs}, batch_size={batch_size}")
-        
-        model = build_model(input_dim, hidden_layers, neurons, dropout_rate)
-        optimizer = Adam(learning_rate=learning_rate)
+    cores = core_queue.get()
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    tf.config.threading.set_intra_op_parallelism_threads(threads_per_worker)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    _worker_data.update(data)
+
+
+def _worker_dataset(batch_size):
+    """ワーカー内で tf.data パイプラインをバッチサイズごとに1回だけ作り、以降の試行で使い回す"""
+    if batch_size not in _worker_datasets:
+        _worker_datasets[batch_size] = make_datasets(_worker_data, batch_size)
+    return _worker_datasets[batch_size]
+
+
+def _train_trial(config, epochs_done, budget, checkpoint_path):
+    """
+    (ワーカープロセスで実行) 1つの設定を budget エポック目まで学習して評価値を返す。
+    チェックポイントがあればそこから学習を再開する。
+    """
+    datasets = _worker_dataset(config['batch_size'])
+    y_test = _worker_data['y_test_eval']
+    if epochs_done > 0 and os.path.exists(checkpoint_path):
+        model = tf.keras.models.load_model(checkpoint_path)
+    else:
+        model = build_model(_worker_data['X_train'].shape[1], config['hidden_layers'], config['neurons'],
+                            config['dropout_rate'], window=_worker_data['window'])
+        optimizer = Adam(learning_rate=config['learning_rate'])
         model.compile(optimizer=optimizer, loss='mse')
-        
-        # EarlyStoppingで過学習対策
-        early_stop = EarlyStopping(monitor='val_loss', patience=5, restore_best_weights=True, verbose=0)
-        
-        history = model.fit(X_train, y_train,
-                            validation_split=0.1,
-                            epochs=epochs,
-                            batch_size=batch_size,
-                            verbose=0,
-                            callbacks=[early_stop])
-        
-        y_pred = model.predict(X_test).flatten()
-        mse_val = mean_squared_error(y_test, y_pred)
-        rmse_val = math.sqrt(mse_val)
-        r2_val = r2_score(y_test, y_pred)
-        
-        print(f"Result: RMSE={rmse_val:.4f}, R²={r2_val:.4f}\n")
+
+    # EarlyStoppingで過学習対策
+    early_stop = EarlyStopping(monitor='val_loss', patience=5, restore_best_weights=True, verbose=0)
+    history = model.fit(datasets['train'],
+                        validation_data=datasets['val'],
+                        shuffle=False,  # シャッフルは tf.data パイプライン側で行う
+                        initial_epoch=epochs_done,
+                        epochs=budget,
+                        verbose=0,
+                        callbacks=[early_stop])
+    model.save(checkpoint_path)
+    trained = len(history.history['loss'])
+
+    y_pred = model.predict(datasets['test'], verbose=0).flatten()
+    mse_val = mean_squared_error(y_test, y_pred)
+    return {
+        'epochs_done': epochs_done + trained,
+        # EarlyStoppingで予算より前に止まった設定はこれ以上学習しても改善しない
+        'converged': epochs_done + trained < budget,
+        'val_loss': float(min(history.history['val_loss'])),
+        'RMSE': math.sqrt(mse_val),
+        'R2': r2_score(y_test, y_pred),
+    }
+
+
+def rung_budgets(max_epochs=MAX_EPOCHS, min_epochs=11, eta=3):
+    """Successive Halving の各段階で学習させるエポック数（例：11, 33, 100）を返す"""
+    budgets = []
+    budget = min_epochs
+    while budget < max_epochs:
+        budgets.append(budget)
+        budget *= eta
+    budgets.append(max_epochs)
+    return budgets
+
+
+def hyperparameter_search(data, max_epochs=MAX_EPOCHS, min_epochs=11, eta=3,
+                          n_workers=None, threads_per_worker=1):
+    """
+    ハイパーパラメータの組み合わせを Successive Halving で探索し、RMSEとR²の結果をリストとして返す関数。
+    全設定を min_epochs だけ学習→検証損失(val_loss)の上位 1/eta を残して予算を eta 倍、を max_epochs まで繰り返す。
+    各段階の学習はCPUコアを固定したワーカープロセスで並列に行う。data は prepare_data の戻り値で、
+    各ワーカーへは初期化時に1回だけ渡し、ワーカー内で作った tf.data パイプラインを全試行で使い回す。
+    """
+    configs = [dict(zip(PARAM_GRID.keys(), values)) for values in itertools.product(*PARAM_GRID.values())]
+    n_cores = os.cpu_count() or 1
+    n_workers = n_workers or max(1, n_cores // threads_per_worker)
+    budgets = rung_budgets(max_epochs, min_epochs, eta)
+    print(f"{len(configs)} 設定を {n_workers} プロセスで探索します（エポック予算: {budgets}）")
+
+    ctx = multiprocessing.get_context("spawn")
+    core_queue = ctx.Queue()
+    for i in range(n_workers):
+        start = (i * threads_per_worker) % n_cores
+        core_queue.put({(start + j) % n_cores for j in range(threads_per_worker)})
+
+    with tempfile.TemporaryDirectory() as checkpoint_dir:
+        trials = [{'config': config, 'epochs_done': 0, 'converged': False, 'pruned_at': None,
+                   'checkpoint': os.path.join(checkpoint_dir, f"trial_{i}.keras")}
+                  for i, config in enumerate(configs)]
+        alive = trials
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=ctx, initializer=_init_worker,
+                                 initargs=(core_queue, threads_per_worker, data)) as pool:
+            for rung, budget in enumerate(budgets):
+                futures = {pool.submit(_train_trial, t['config'], t['epochs_done'], budget, t['checkpoint']): t
+                           for t in alive if not t['converged']}
+                for future in as_completed(futures):
+                    trial = futures[future]
+                    trial.update(future.result())
+                    c = trial['config']
+                    print(f"[rung {rung}] layers={c['hidden_layers']}, neurons={c['neurons']}, "
+                          f"dropout={c['dropout_rate']}, lr={c['learning_rate']}, epochs={trial['epochs_done']}: "
+                          f"val_loss={trial['val_loss']:.6f}, RMSE={trial['RMSE']:.4f}, R²={trial['R2']:.4f}")
+                if rung == len(budgets) - 1:
+                    break
+                # 検証損失の小さい上位 1/eta だけを次の段階へ進める
+                alive = sorted(alive, key=lambda t: t['val_loss'])
+                keep = max(1, len(alive) // eta)
+                for trial in alive[keep:]:
+                    trial['pruned_at'] = budget
+                alive = alive[:keep]
+
+    results = []
+    for trial in trials:
         results.append({
-            'hidden_layers': hidden_layers,
-            'neurons': neurons,
-            'dropout_rate': dropout_rate,
-            'learning_rate': learning_rate,
-            'epochs': epochs,
-            'batch_size': batch_size,
-            'RMSE': rmse_val,
-            'R2': r2_val
+            **trial['config'],
+            'epochs': trial['epochs_done'],
+            'pruned_at_epoch': trial['pruned_at'],
+            'val_loss': trial['val_loss'],
+            'RMSE': trial['RMSE'],
+            'R2': trial['R2']
         })
     return results
 
@@ -123,17 +288,17 @@ def hyperparameter_search(X_train, X_test, y_train, y_test, input_dim):
 # -------------------------------
 def main():
     """
-    CSVファイルからデータを読み込み、深層学習モデルを複数のハイパーパラメータ設定で学習し、
+    統合データを読み込み、深層学習モデルを複数のハイパーパラメータ設定で学習し、
     各設定の結果（RMSE、R²）をCSVに書き出す。
     """
     # データ読み込みと前処理
-    csv_file = 'merged_dataset_with_return.csv'
-    X, y, feature_cols = load_and_preprocess_data(csv_file)
-    X_train, X_test, y_train, y_test = split_data(X, y, split_ratio=0.8)
-    input_dim = X_train.shape[1]
+    data_file = dataset_path('merged_dataset')
+    X, y, feature_cols = load_and_preprocess_data(data_file)
+    # 標準化・float32化は全試行の前に1回だけ行う
+    data = prepare_data(X, y, split_ratio=0.8, val_ratio=0.1, window=SEQUENCE_WINDOW)
     
     # ハイパーパラメータ探索と評価
-    results = hyperparameter_search(X_train, X_test, y_train, y_test, input_dim)
+    results = hyperparameter_search(data)
     results_df = pd.DataFrame(results)
     results_df = results_df.sort_values(by='RMSE')
     output_results = "dl_hyperparameter_results.csv"
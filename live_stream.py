@@ -0,0 +1,286 @@
+import argparse
+import json
+import os
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+import websocket  # websocket-client（pybit の依存パッケージ）
+
+from asof_join import AsofSide, asof_join
+from bybit_api import BASE_URL
+from kline_store import KLINE_COLUMNS, KLINE_DTYPE, KLINE_INTERVAL_MS, KlineStore, sync_klines
+from main import fetch_klines
+from metrics import METRICS, span
+from schema import apply_schema
+from stream_pipeline import ChunkIndicatorCalculator
+from timeframes import DEFAULT_TIMEFRAMES, history_days, timeframe_sides
+
+# WebSocketによるリアルタイム取り込み
+# Bybitの公開WebSocketで kline(足) と tickers(資金調達率・オープンインタレスト) を購読し、
+# 足が確定するたびに KlineStore に保存し、main.py と同じ列の特徴量行を計算してデータセット(CSV)に追記する。
+# 切断時は再接続し、切断中に確定した足はRESTで取得して埋める（足の時刻が飛んだ場合も同様）。
+# ローカルでの動作確認には replay_server.py を使う
+
+WS_BASE_URL = "wss://stream.bybit.com/v5/public"
+LIVE_DATASET_FILE = "live_dataset.csv"  # 1行ずつ追記するため、追記できるCSVで保存する
+WARMUP_BARS = 500  # 起動時に指標(EMAなど)を温めるために使う保存済みの足の本数
+HTF_DAYS = history_days(60)  # 上位足の指標計算に使う1時間足の日数（main.py が取得する日数と同じ）
+OBSERVATION_HISTORY = 10000  # 保持する資金調達率・OIの観測値の数
+PING_SECONDS = 20  # Bybitは20秒ごとの ping を推奨している
+# 再接続までの待ち時間(秒)。正常に切断された場合も RECONNECT_DELAYS[0] は待ち、
+# 何も受信しないまま切断・失敗する接続が続くほど長くする
+RECONNECT_DELAYS = (1, 2, 5, 10, 30)
+
+
+class LiveIngestor:
+    """
+    1銘柄・1つの足の長さ(interval)のリアルタイム取り込み。
+    上位足の指標は KlineStore の1時間足から作るため、interval が1時間足以外のときは1時間足も購読して保存する。
+    資金調達率・OIは tickers の観測値を時刻付きで保持し、足の確定時刻時点で最新の値を as-of 結合する。
+    """
+
+    def __init__(self, symbol="BTCUSDT", category="linear", interval="60", store=None,
+                 output_file=LIVE_DATASET_FILE, ws_url=None, base_url=BASE_URL, total_days=HTF_DAYS):
+        self.symbol = symbol
+        self.category = category
+        self.interval = interval
+        self.interval_ms = KLINE_INTERVAL_MS[interval]
+        self.intervals = [interval] if interval == "60" else [interval, "60"]
+        self.store = store or KlineStore()
+        self.output_file = output_file
+        self.ws_url = ws_url or f"{WS_BASE_URL}/{category}"
+        self.base_url = base_url
+        self.total_days = total_days
+        self.calculator = ChunkIndicatorCalculator()
+        self.last_times = {}  # interval -> 保存済みの最新の足の時刻(ms)
+        self.last_written = None  # データセットに書き込んだ最新の足の時刻(ms)
+        self.funding = deque(maxlen=OBSERVATION_HISTORY)  # (観測時刻ms, fundingRate, nextFundingTime)
+        self.open_interest = deque(maxlen=OBSERVATION_HISTORY)  # (観測時刻ms, openInterest)
+        self.htf_cache = (None, [])  # (作成に使った1時間足の最新時刻, 上位足の AsofSide)
+        self.rows_written = 0
+        self.source_finished = False  # replay_server.py が再生の終了を知らせたら True
+
+    # -------------------------------
+    # 起動時の準備と欠損補完
+    # -------------------------------
+    def _fetch(self, **kwargs):
+        return fetch_klines(base_url=self.base_url, **kwargs)
+
+    def start(self):
+        """保存済みの足を最新まで補完し、指標を温め、データセットの続きから書き込めるようにする"""
+        for interval in self.intervals:
+            sync_klines(self.store, self._fetch, symbol=self.symbol, category=self.category,
+                        interval=interval, total_days=self.total_days)
+            self.last_times[interval] = self.store.last_timestamp(self.symbol, self.category, interval)
+        stored = np.array(self.store.read(self.symbol, self.category, self.interval))
+        if os.path.exists(self.output_file) and os.path.getsize(self.output_file) > 0:
+            times = pd.read_csv(self.output_file, usecols=["time"], parse_dates=["time"])["time"]
+            if len(times):
+                self.last_written = int(times.iloc[-1].value // 1_000_000)
+        if self.last_written is None and len(stored):
+            # 新規のデータセットは起動後に確定した足から書き始める（過去分は main.py で作る）
+            self.last_written = int(stored["time"][-1])
+        # 書き込み済みの足までで指標を温め、それ以降の保存済みの足はデータセットに追記する
+        done = stored[stored["time"] <= (self.last_written or 0)]
+        if len(done):
+            self.calculator.process(done[-WARMUP_BARS:])
+        self._write(stored[stored["time"] > (self.last_written or 0)])
+
+    def gap_fill(self, interval, until_ts=None):
+        """保存済みの最新の足から until_ts(省略時は現在時刻)までに確定した足をRESTで取得して取り込む"""
+        interval_ms = KLINE_INTERVAL_MS[interval]
+        last_ts = self.last_times.get(interval)
+        end_ts = until_ts if until_ts is not None else int(time.time() * 1000)
+        if last_ts is None or last_ts + 2 * interval_ms > end_ts:
+            return
+        rows = self._fetch(symbol=self.symbol, category=self.category, interval=interval,
+                           start_ts=last_ts + interval_ms, end_ts=end_ts)
+        records = np.array([tuple(float(v) for v in row[:len(KLINE_COLUMNS)]) for row in rows], dtype=KLINE_DTYPE)
+        records = records[records["time"] + interval_ms <= end_ts]
+        if len(records):
+            METRICS.inc("ws_gap_filled_bars_total", len(records), interval=interval)
+            print(f"[LIVE] {interval}: 欠損していた {len(records)} 本をRESTで補完しました。")
+        self.on_closed_bars(interval, records)
+
+    # -------------------------------
+    # 確定足の取り込み
+    # -------------------------------
+    def on_closed_bars(self, interval, records):
+        """確定した足(時刻昇順の構造化配列)を保存し、基準の足ならデータセットに追記する"""
+        last_ts = self.last_times.get(interval)
+        if last_ts is not None:
+            records = records[records["time"] > last_ts]
+        if len(records) == 0:
+            return
+        self.store.append(self.symbol, self.category, interval, records)
+        self.last_times[interval] = int(records["time"][-1])
+        if interval == self.interval:
+            self._write(records)
+
+    def _htf_sides(self):
+        """上位足の AsofSide（1時間足が増えたときだけ作り直す）"""
+        last_hour = self.last_times.get("60")
+        if self.htf_cache[0] != last_hour:
+            hourly = np.array(self.store.read(self.symbol, self.category, "60"))
+            if len(hourly):
+                hourly = hourly[hourly["time"] >= hourly["time"][-1] - self.total_days * 24 * 60 * 60 * 1000]
+            df_hourly = pd.DataFrame({col: hourly[col] for col in KLINE_COLUMNS})
+            self.htf_cache = (last_hour, timeframe_sides(df_hourly, DEFAULT_TIMEFRAMES, base_interval_ms=self.interval_ms))
+        return self.htf_cache[1]
+
+    def _observation_sides(self):
+        """
+        tickers の観測値を as-of 結合用の AsofSide にする。
+        足は確定時刻までの観測値を参照できるよう、観測時刻を足の長さ分前にずらして結合する（上位足と同じ扱い）。
+        ※ fundingRate は tickers の値（次回精算の予想資金調達率）で、main.py の学習データの値とは異なる。
+          学習データは精算済みの資金調達率を1時間足に線形補間しており、精算の間の足には次の精算の確定値が混ざる。
+          その値は足の確定時点ではまだ分からないため、リアルタイムでは最も近い予想値を使っている
+        """
+        funding = np.array(self.funding, dtype=np.float64).reshape(-1, 3)
+        open_interest = np.array(self.open_interest, dtype=np.float64).reshape(-1, 2)
+        df_funding = pd.DataFrame({
+            "time": funding[:, 0].astype(np.int64) - self.interval_ms,
+            "symbol": self.symbol,
+            "fundingRate": funding[:, 1],
+            "fundingRateTimestamp": funding[:, 2],  # その資金調達率が適用される次回の精算時刻
+        })
+        df_oi = pd.DataFrame({"time": open_interest[:, 0].astype(np.int64) - self.interval_ms,
+                              "openInterest": open_interest[:, 1]})
+        return [AsofSide(df_funding), AsofSide(df_oi)]
+
+    def _write(self, records):
+        """確定足の特徴量行を計算してデータセットに追記する"""
+        if len(records) == 0:
+            return
+        with span("live_features", interval=self.interval):
+            df = self.calculator.process(records)
+            df = apply_schema(asof_join(df, [*self._htf_sides(), *self._observation_sides()]))
+            if self.last_written is not None:
+                df = df[df["time"] > pd.Timestamp(self.last_written, unit="ms")]
+            if len(df) == 0:
+                return
+            df.to_csv(self.output_file, mode="a", index=False,
+                      header=not os.path.exists(self.output_file) or os.path.getsize(self.output_file) == 0)
+        self.last_written = int(records["time"][-1])
+        self.rows_written += len(df)
+        # 足の確定からデータセットに書き込むまでの遅れ
+        METRICS.observe("live_bar_latency_seconds",
+                        time.time() - (self.last_written + self.interval_ms) / 1000, interval=self.interval)
+        print(f"[LIVE] {self.symbol} {self.interval}: {df['time'].iloc[-1]} の足を追記（累計 {self.rows_written} 行）")
+
+    # -------------------------------
+    # WebSocketメッセージ
+    # -------------------------------
+    def topics(self):
+        return [f"kline.{interval}.{self.symbol}" for interval in self.intervals] + [f"tickers.{self.symbol}"]
+
+    def on_message(self, message):
+        topic = message.get("topic", "")
+        if not topic:
+            return
+        METRICS.inc("ws_messages_total", topic=topic.split(".")[0])
+        if topic.startswith("kline."):
+            interval = topic.split(".")[1]
+            interval_ms = KLINE_INTERVAL_MS[interval]
+            for bar in message.get("data", []):
+                if not bar.get("confirm"):
+                    continue
+                bar_time = int(bar["start"])
+                # 足の時刻が飛んでいれば、間の足をRESTで先に埋める
+                if self.last_times.get(interval) is not None and bar_time > self.last_times[interval] + interval_ms:
+                    self.gap_fill(interval, until_ts=bar_time)
+                record = np.array([(bar_time, *(float(bar[col]) for col in KLINE_COLUMNS[1:]))], dtype=KLINE_DTYPE)
+                self.on_closed_bars(interval, record)
+        elif topic.startswith("tickers."):
+            data = message.get("data", {})
+            ts = int(message.get("ts", time.time() * 1000))
+            # delta メッセージは変化した項目だけを含むので、含まれている項目だけを記録する
+            if "fundingRate" in data:
+                self.funding.append((ts, float(data["fundingRate"]), float(data.get("nextFundingTime") or "nan")))
+            if "openInterest" in data:
+                self.open_interest.append((ts, float(data["openInterest"])))
+
+    def run_connection(self, stop=None):
+        """1回分の接続で購読・受信を行い、受信したトピックのメッセージ数を返す。切断またはエラーで戻る"""
+        ws = websocket.create_connection(self.ws_url, timeout=PING_SECONDS)
+        received = 0
+        try:
+            ws.send(json.dumps({"op": "subscribe", "args": self.topics()}))
+            # 接続するまでの間に確定した足を埋める
+            for interval in self.intervals:
+                self.gap_fill(interval)
+            while stop is None or not stop.is_set():
+                try:
+                    raw = ws.recv()
+                except websocket.WebSocketTimeoutException:
+                    ws.send(json.dumps({"op": "ping"}))
+                    continue
+                if not raw:
+                    return received
+                message = json.loads(raw)
+                if message.get("op") == "replay_finished":
+                    self.source_finished = True
+                    return received
+                received += bool(message.get("topic"))
+                self.on_message(message)
+            return received
+        finally:
+            ws.close()
+
+    def run_forever(self, stop=None):
+        """
+        切断されても再接続を続ける（stop は threading.Event などの停止フラグ）。
+        再生サーバーが再生の終了を知らせた場合は再接続せずに戻る。
+        """
+        self.start()
+        failures = 0  # 何も受信しないまま終わった接続の連続回数
+        while stop is None or not stop.is_set():
+            received = 0
+            try:
+                received = self.run_connection(stop)
+            except (OSError, websocket.WebSocketException) as e:
+                METRICS.inc("ws_errors_total")
+                print(f"[LIVE] WebSocket接続エラー: {e}")
+            if self.source_finished:
+                print("[LIVE] 再生が終了したため停止します。")
+                break
+            if stop is not None and stop.is_set():
+                break
+            failures = 0 if received else failures + 1
+            METRICS.inc("ws_reconnects_total")
+            delay = RECONNECT_DELAYS[min(max(failures - 1, 0), len(RECONNECT_DELAYS) - 1)]
+            print(f"[LIVE] 切断されました。{delay} 秒後に再接続します。")
+            if stop is not None:
+                stop.wait(delay)
+            else:
+                time.sleep(delay)
+
+
+def main(symbol="BTCUSDT", category="linear", interval="60", ws_url=None, base_url=BASE_URL,
+         output_file=LIVE_DATASET_FILE, store_root=None):
+    """store_root を指定するとその場所の KlineStore に保存する（replay_server.py での確認は、
+    main.py が使う既定の保存先とは別の場所を指定しないと、再生する足がすべて保存済みとして捨てられる）"""
+    store = KlineStore(root=store_root) if store_root else None
+    ingestor = LiveIngestor(symbol, category, interval, store=store, output_file=output_file, ws_url=ws_url,
+                            base_url=base_url)
+    try:
+        ingestor.run_forever()
+    except KeyboardInterrupt:
+        pass
+    print(METRICS.summary())
+    METRICS.export("live_metrics.prom")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="WebSocketによるリアルタイム取り込み")
+    parser.add_argument("--symbol", default="BTCUSDT")
+    parser.add_argument("--interval", default="60")
+    parser.add_argument("--ws-url", default=None, help="WebSocketのURL（replay_server.py を使う場合はそのURL）")
+    parser.add_argument("--base-url", default=BASE_URL, help="欠損補完に使うREST APIのURL")
+    parser.add_argument("--output", default=LIVE_DATASET_FILE)
+    parser.add_argument("--store-root", default=None, help="ローソク足の保存先（省略時は KlineStore の既定の場所）")
+    args = parser.parse_args()
+    main(args.symbol, interval=args.interval, ws_url=args.ws_url, base_url=args.base_url, output_file=args.output,
+         store_root=args.store_root)
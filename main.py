@@ -1,9 +1,15 @@
-import requests
 import pandas as pd
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-import time
-from pybit.unified_trading import HTTP  # 資金調達率、オープンインタレスト取得用
+from bybit_api import BASE_URL, INTERVAL_TIME_MS, get_json, split_windows, fetch_windows_concurrently
+from kline_store import KLINE_INTERVAL_MS, KlineStore, sync_klines
+from indicators import INDICATOR_COLUMNS, compute_indicator_arrays
+from dataset_io import dataset_path, write_dataset
+from asof_join import AsofSide, asof_join
+from timeframes import DEFAULT_TIMEFRAMES, history_days, timeframe_sides, trim_days
+from metrics import METRICS, span
+from schema import apply_schema, format_memory_report, memory_report
 
 # OI追加部分に関しては怪しいので明日レビューし直すこと
 # requestsライブラリとPythonのver3.10以上のバージョンは互換性がなかったような気がするので要確認
@@ -11,97 +17,67 @@ from pybit.unified_trading import HTTP  # 資金調達率、オープンイン
 
 # このスクリプトの場合、CSVの最初の数行一部が欠損するので注意すること
 # -------------------------------
-# 1. 1時間足ローソク足データ取得 (Klines)
+# 1. ローソク足データ取得 (Klines)
 # -------------------------------
-def fetch_klines(symbol="BTCUSDT", category="linear", interval="60",
-                 total_days=60, limit=1000,
-                 url="https://api.bybit.com/v5/market/kline"):
-    '''指定期間(total_days)分の1時間足ローソク足データをページング対応で取得する関数'''
-    # utcnowが非推奨になった理由と代替メソッドを調べておく
-    end_time = datetime.utcnow()
-    start_time = end_time - timedelta(days=total_days)
-    end_timestamp = int(end_time.timestamp() * 1000)
-    start_timestamp = int(start_time.timestamp() * 1000)
-    all_data = []
-    current_start = start_timestamp
-
-    while True:
+def iter_kline_pages(symbol="BTCUSDT", category="linear", interval="60",
+                     start_ts=None, end_ts=None, limit=1000, base_url=BASE_URL):
+    '''start_ts～end_ts(ミリ秒)のローソク足を、1リクエストでlimit本に収まるウィンドウ単位で古い順に取得し、
+    ページ(時刻昇順の [startTime, open, high, low, close, volume, turnover] のリスト)ごとにyieldするジェネレータ。
+    intervalは "1", "5", "15", "60", "240", "D", "W" などBybitのkline表記で指定する。'''
+    path = "/v5/market/kline"
+    window_ms = KLINE_INTERVAL_MS[interval] * limit
+    for current_start, current_end in split_windows(start_ts, end_ts + 1, window_ms, align=True):
         params = {
             "category": category,
             "symbol": symbol,
             "interval": interval,
             "start": current_start,
-            "end": end_timestamp,
+            "end": current_end,
             "limit": limit
         }
-        req_start_dt = datetime.fromtimestamp(current_start / 1000)
-        print(f"[HOURLY KLINE] リクエスト開始: {req_start_dt.strftime('%Y-%m-%d %H:%M:%S.%f')}")
-        response = requests.get(url, params=params)
-        result = response.json()
+        try:
+            result = get_json(path, params, base_url=base_url)
+        except Exception as e:
+            print(f"[KLINE {interval}] API呼び出し例外: {e}")
+            return
         if result.get("retCode") != 0:
-            print("APIエラー（HOURLY KLINE）:", result.get("retMsg"))
-            break
+            print(f"APIエラー（KLINE {interval}）:", result.get("retMsg"))
+            return
+        # リクエストごとのレイテンシ・件数は bybit_api が metrics に記録する
         data_list = result.get("result", {}).get("list", [])
-        print(f"[HOURLY KLINE] {req_start_dt.strftime('%Y-%m-%d %H:%M:%S.%f')}～: {len(data_list)} 件取得")
-        if not data_list:
-            break
-        all_data.extend(data_list)
-        last_time = int(data_list[-1][0])
-        if last_time >= end_timestamp:
-            break
-        new_start = last_time + 1
-        if new_start <= current_start:
-            print(f"[HOURLY KLINE] ページング更新できず (current_start={current_start}, new_start={new_start})。")
-            break
-        current_start = new_start
-        time.sleep(1)
+        # APIは新しい順で返すので時刻の昇順に並べ替え、境界揃えで含まれたstart_tsより前の足は除く
+        page = sorted((row for row in data_list if int(row[0]) >= start_ts), key=lambda row: int(row[0]))
+        if page:
+            yield page
+
+
+def fetch_klines(symbol="BTCUSDT", category="linear", interval="60",
+                 total_days=60, limit=1000, base_url=BASE_URL,
+                 start_ts=None, end_ts=None):
+    '''指定期間(total_days)分のローソク足データを iter_kline_pages で取得し、時刻昇順のリストで返す関数
+    start_ts/end_ts(ミリ秒)を指定した場合はtotal_daysより優先し、その期間だけを取得する'''
+    # utcnowが非推奨になった理由と代替メソッドを調べておく
+    end_time = datetime.utcnow()
+    start_time = end_time - timedelta(days=total_days)
+    end_timestamp = end_ts if end_ts is not None else int(end_time.timestamp() * 1000)
+    start_timestamp = start_ts if start_ts is not None else int(start_time.timestamp() * 1000)
+    all_data = []
+    for page in iter_kline_pages(symbol=symbol, category=category, interval=interval,
+                                 start_ts=start_timestamp, end_ts=end_timestamp,
+                                 limit=limit, base_url=base_url):
+        all_data.extend(page)
     return all_data
 
 # -------------------------------
 # 2. 日足ローソク足データ取得 (Daily Klines)
 # -------------------------------
 def fetch_daily_klines(symbol="BTCUSDT", category="linear", interval="D",
-                         total_days=60, limit=1000,
-                         url="https://api.bybit.com/v5/market/kline"):
-    '''指定期間(total_days)分の日足ローソク足データをページング対応で取得する関数'''
-    end_time = datetime.utcnow()
-    start_time = end_time - timedelta(days=total_days)
-    end_timestamp = int(end_time.timestamp() * 1000)
-    start_timestamp = int(start_time.timestamp() * 1000)
-    all_data = []
-    current_start = start_timestamp
-
-    while True:
-        params = {
-            "category": category,
-            "symbol": symbol,
-            "interval": interval,  # 日足なので "D"
-            "start": current_start,
-            "end": end_timestamp,
-            "limit": limit
-        }
-        req_start_dt = datetime.fromtimestamp(current_start / 1000)
-        print(f"[DAILY KLINE] リクエスト開始: {req_start_dt.strftime('%Y-%m-%d %H:%M:%S.%f')}")
-        response = requests.get(url, params=params)
-        result = response.json()
-        if result.get("retCode") != 0:
-            print("APIエラー（DAILY KLINE）:", result.get("retMsg"))
-            break
-        data_list = result.get("result", {}).get("list", [])
-        print(f"[DAILY KLINE] {req_start_dt.strftime('%Y-%m-%d %H:%M:%S.%f')}～: {len(data_list)} 件取得")
-        if not data_list:
-            break
-        all_data.extend(data_list)
-        last_time = int(data_list[-1][0])
-        if last_time >= end_timestamp:
-            break
-        new_start = last_time + 1
-        if new_start <= current_start:
-            print(f"[DAILY KLINE] ページング更新できず (current_start={current_start}, new_start={new_start})。")
-            break
-        current_start = new_start
-        time.sleep(1)
-    return all_data
+                       total_days=60, limit=1000, base_url=BASE_URL,
+                       start_ts=None, end_ts=None):
+    '''指定期間(total_days)分の日足ローソク足データを取得する関数（fetch_klinesのinterval="D"版）'''
+    return fetch_klines(symbol=symbol, category=category, interval=interval,
+                        total_days=total_days, limit=limit, base_url=base_url,
+                        start_ts=start_ts, end_ts=end_ts)
 
 # -------------------------------
 # 3. テクニカル指標計算
@@ -110,249 +86,303 @@ def calculate_indicators(df):
     '''DataFrameに対して、ATR、ボリンジャーバンド、移動平均、RSI、EMAなどのテクニカル指標を計算し追加する関数'''
     # 型変換、時刻整形・ソート
     df["time"] = pd.to_datetime(df["time"].astype(int), unit="ms")
-    df.sort_values("time", inplace=True)
+    if not df["time"].is_monotonic_increasing:
+        df.sort_values("time", inplace=True)
     df.reset_index(drop=True, inplace=True)
     
     # 数値型への変換
     num_cols = ["open", "high", "low", "close", "volume", "turnover"]
     df[num_cols] = df[num_cols].apply(pd.to_numeric)
     
-    # ATR (14期間)
-    df["prev_close"] = df["close"].shift(1)
-    tr1 = df["high"] - df["low"]
-    tr2 = (df["high"] - df["prev_close"]).abs()
-    tr3 = (df["low"] - df["prev_close"]).abs()
-    df["TR"] = pd.concat([tr1, tr2, tr3], axis=1).max(axis=1)
-    atr_period = 14
-    df["ATR"] = df["TR"].rolling(window=atr_period, min_periods=atr_period).mean()
-    
-    # ボリンジャーバンド（20期間、標準偏差倍率2）
-    bb_period = 20
-    df["MA20"] = df["close"].rolling(window=bb_period, min_periods=bb_period).mean()
-    df["std20"] = df["close"].rolling(window=bb_period, min_periods=bb_period).std()
-    df["BB_upper"] = df["MA20"] + 2 * df["std20"]
-    df["BB_lower"] = df["MA20"] - 2 * df["std20"]
-    
-    # 移動平均線
-    df["MA5"] = df["close"].rolling(window=5, min_periods=5).mean()
-    df["MA10"] = df["close"].rolling(window=10, min_periods=10).mean()
-    df["MA20_calc"] = df["MA20"]
-    
-    # RSI (14期間)
-    rsi_period = 14
-    delta = df["close"].diff()
-    gain = delta.clip(lower=0)
-    loss = -delta.clip(upper=0)
-    avg_gain = gain.rolling(window=rsi_period, min_periods=rsi_period).mean()
-    avg_loss = loss.rolling(window=rsi_period, min_periods=rsi_period).mean()
-    rs = avg_gain / avg_loss
-    df["RSI"] = 100 - (100 / (1 + rs))
-    df["avg_gain"] = avg_gain
-    df["avg_loss"] = avg_loss
-    
-    # EMA (20期間)
-    ema_period = 20
-    df["EMA"] = df["close"].ewm(span=ema_period, adjust=False).mean()
-    
-    # 不要な中間列を削除
-    df.drop(columns=["prev_close", "std20", "TR"], inplace=True)
+    # ATR、ボリンジャーバンド、移動平均線、RSI、EMA をNumPy配列上でまとめて計算して列に追加
+    values = compute_indicator_arrays(df["high"].to_numpy(dtype=np.float64),
+                                      df["low"].to_numpy(dtype=np.float64),
+                                      df["close"].to_numpy(dtype=np.float64))
+    for col in INDICATOR_COLUMNS:
+        df[col] = values[col]
     return df
 
 # -------------------------------
 # 4. 資金調達率データ取得＆線形補間（8時間ごと）
 # -------------------------------
-def fetch_funding_rate_history_custom(symbol="BTCUSDT", category="linear",
-                                      period="8h", total_days=60, limit=200):
-    '''指定期間(total_days)分の資金調達率データを、8時間ごとのウィンドウでページング対応で取得する関数。
-    取得後、1時間足に合わせるための補間は後続の処理で行う前提。'''
-    session = HTTP()  # pybitのセッション作成
-    end_time = datetime.utcnow()
-    start_time = end_time - timedelta(days=total_days)
-    end_ts = int(end_time.timestamp() * 1000)
-    start_ts = int(start_time.timestamp() * 1000)
-    
-    records_all = []
-    window_ms = 8 * 60 * 60 * 1000  # 8時間分のミリ秒
-    current_start = start_ts
+FUNDING_INTERVAL_MS = 8 * 60 * 60 * 1000  # 資金調達は通常8時間ごと
 
-    while current_start < end_ts:
-        current_end = min(current_start + window_ms, end_ts)
+
+def iter_funding_rate_pages(symbol="BTCUSDT", category="linear", start_ts=None, end_ts=None,
+                            limit=200, base_url=BASE_URL):
+    '''start_ts～end_ts(ミリ秒)の資金調達率を、1リクエストでlimit件(8時間ごとなら約66日分)を取り切る
+    大きさのウィンドウ単位で古い順に取得し、ページ(時刻昇順のレコードのリスト)ごとにyieldするジェネレータ。
+    資金調達間隔が8時間より短い銘柄でlimit件に達した場合は、同じウィンドウ内で古い側へ続けて取得する。'''
+    path = "/v5/market/funding/history"
+    window_ms = FUNDING_INTERVAL_MS * limit
+    for window_start, window_end in split_windows(start_ts, end_ts + 1, window_ms, align=True):
+        pages = []
+        current_end = window_end
         cursor = None
         while True:
             params = {
                 "category": category,
                 "symbol": symbol,
-                "period": period,
-                "startTime": current_start,
+                "startTime": window_start,
                 "endTime": current_end,
                 "limit": limit
             }
             if cursor:
                 params["cursor"] = cursor
-            req_start_dt = datetime.fromtimestamp(current_start / 1000)
-            req_end_dt = datetime.fromtimestamp(current_end / 1000)
-            print(f"[FUNDING] リクエスト: {req_start_dt.strftime('%Y-%m-%d %H:%M:%S')} ～ {req_end_dt.strftime('%Y-%m-%d %H:%M:%S')}")
             try:
-                response = session.get_funding_rate_history(**params)
+                response = get_json(path, params, base_url=base_url)
             except Exception as e:
                 print(f"[FUNDING] API呼び出し例外: {e}")
-                break
+                return
             if response.get("retCode") != 0:
                 print("[FUNDING] APIエラー:", response.get("retMsg"))
-                break
+                return
             result = response.get("result", {})
             records = result.get("list", [])
-            print(f"[FUNDING] {req_start_dt.strftime('%Y-%m-%d %H:%M:%S')} ～ {req_end_dt.strftime('%Y-%m-%d %H:%M:%S')} : {len(records)} 件取得")
-            records_all.extend(records)
+            if not records:
+                break
+            # APIは新しい順で返すので時刻の昇順に並べ替える
+            page = sorted(records, key=lambda record: int(record["fundingRateTimestamp"]))
+            pages.append(page)
             cursor = result.get("nextPageCursor")
-            if not cursor:
+            if cursor:
+                continue
+            # 8時間ごとならウィンドウはちょうどlimit件で埋まるので、それより前に取り残しがある場合だけ続ける
+            oldest = int(page[0]["fundingRateTimestamp"])
+            if len(records) < limit or oldest - FUNDING_INTERVAL_MS < window_start:
                 break
-            time.sleep(1)
-        current_start = current_end
-        time.sleep(1)
-    return records_all
+            current_end = oldest - 1
+        # ウィンドウ内では新しい側から取得しているので、古い順に並べ直してから返す
+        pages.sort(key=lambda page: int(page[0]["fundingRateTimestamp"]))
+        for page in pages:
+            # 境界揃えで含まれたstart_tsより前のレコードは除く
+            page = [record for record in page if int(record["fundingRateTimestamp"]) >= start_ts]
+            if page:
+                yield page
 
-# -------------------------------
-# 5. オープンインタレストデータ取得（1時間足）
-# -------------------------------
-def fetch_open_interest_data(symbol="BTCUSDT", category="linear", interval="1h",
-                             total_days=60, limit=200):
-    '''指定期間(total_days)分の1時間足のオープンインタレストデータをページング対応で取得する関数'''
-    session = HTTP(testnet=False)
+
+def fetch_funding_rate_history_custom(symbol="BTCUSDT", category="linear",
+                                      period="8h", total_days=60, limit=200, base_url=BASE_URL):
+    '''指定期間(total_days)分の資金調達率データを iter_funding_rate_pages で取得し、時刻昇順のリストで返す関数。
+    60日分なら1リクエストで取り切れる。periodは互換性のために残している（APIでは使われない）。
+    取得後、1時間足に合わせるための補間は後続の処理で行う前提。'''
     end_time = datetime.utcnow()
     start_time = end_time - timedelta(days=total_days)
     end_ts = int(end_time.timestamp() * 1000)
     start_ts = int(start_time.timestamp() * 1000)
     records_all = []
-    window_ms = 60 * 60 * 1000  # 1時間分のミリ秒
-    current_start = start_ts
+    for page in iter_funding_rate_pages(symbol=symbol, category=category, start_ts=start_ts,
+                                        end_ts=end_ts, limit=limit, base_url=base_url):
+        records_all.extend(page)
+    return records_all
+
+# -------------------------------
+# 5. オープンインタレスト・ロングショートレシオ取得（1時間足）
+# -------------------------------
+def fetch_cursor_windows(path, params, time_field, start_ts, end_ts, window_ms, label,
+                         base_url=BASE_URL, max_workers=8):
+    '''startTime/endTime とページ送り(nextPageCursor)で取得するエンドポイントの共通処理。
+    [start_ts, end_ts) を window_ms ごとのウィンドウに分割してスレッドプールで並列取得し、
+    レートリミッタ(bybit_api.TokenBucket)で間隔を制御する。レコードを time_field の昇順で返す。'''
+    windows = split_windows(start_ts, end_ts, window_ms, align=True)
 
-    while current_start < end_ts:
-        current_end = min(current_start + window_ms, end_ts)
+    def fetch_window(current_start, current_end):
+        records = []
         cursor = None
         while True:
-            params = {
-                "category": category,
-                "symbol": symbol,
-                "intervalTime": interval,
-                "startTime": current_start,
-                "endTime": current_end,
-                "limit": limit
-            }
+            window_params = {**params, "startTime": current_start, "endTime": current_end}
             if cursor:
-                params["cursor"] = cursor
-            req_start_dt = datetime.fromtimestamp(current_start / 1000)
-            req_end_dt = datetime.fromtimestamp(current_end / 1000)
-            print(f"[OPEN INTEREST] リクエスト: {req_start_dt.strftime('%Y-%m-%d %H:%M:%S')} ～ {req_end_dt.strftime('%Y-%m-%d %H:%M:%S')}")
+                window_params["cursor"] = cursor
             try:
-                response = session.get_open_interest(**params)
+                response = get_json(path, window_params, base_url=base_url)
             except Exception as e:
-                print(f"[OPEN INTEREST] API呼び出し例外: {e}")
+                print(f"[{label}] API呼び出し例外: {e}")
                 break
             if response.get("retCode") != 0:
-                print("[OPEN INTEREST] APIエラー:", response.get("retMsg"))
+                print(f"[{label}] APIエラー:", response.get("retMsg"))
                 break
             result = response.get("result", {})
-            records = result.get("list", [])
-            print(f"[OPEN INTEREST] {req_start_dt.strftime('%Y-%m-%d %H:%M:%S')} ～ {req_end_dt.strftime('%Y-%m-%d %H:%M:%S')} : {len(records)} 件取得")
-            records_all.extend(records)
+            page = result.get("list", [])
+            records.extend(page)
             cursor = result.get("nextPageCursor")
-            if not cursor:
+            if not cursor or not page:
                 break
-            time.sleep(1)
-        current_start = current_end
-        time.sleep(1)
+        return records
+
+    print(f"[{label}] {len(windows)} ウィンドウを最大 {max_workers} 並列で取得します。")
+    pages = fetch_windows_concurrently(fetch_window, windows, max_workers=max_workers)
+    # APIは新しい順で返すので、ウィンドウ順に連結した後に時刻の昇順へ並べ直す
+    records_all = [record for page in pages for record in page if int(record[time_field]) >= start_ts]
+    records_all.sort(key=lambda record: int(record[time_field]))
     return records_all
 
+
+def fetch_open_interest_data(symbol="BTCUSDT", category="linear", interval="1h",
+                             total_days=60, limit=200, base_url=BASE_URL, max_workers=8):
+    '''指定期間(total_days)分の1時間足のオープンインタレストデータを取得する関数。
+    期間を1リクエストでlimit件に収まる大きさのウィンドウに分割して並列取得し、結果は時刻の昇順で返す。'''
+    end_time = datetime.utcnow()
+    start_time = end_time - timedelta(days=total_days)
+    end_ts = int(end_time.timestamp() * 1000)
+    start_ts = int(start_time.timestamp() * 1000)
+    params = {"category": category, "symbol": symbol, "intervalTime": interval, "limit": limit}
+    window_ms = INTERVAL_TIME_MS[interval] * limit  # 1リクエストで取り切れる期間
+    return fetch_cursor_windows("/v5/market/open-interest", params, "timestamp", start_ts, end_ts, window_ms,
+                                "OPEN INTEREST", base_url=base_url, max_workers=max_workers)
+
+
+def fetch_long_short_ratio(symbol="BTCUSDT", category="linear", period="1h",
+                           total_days=60, limit=500, base_url=BASE_URL, max_workers=8):
+    '''指定期間(total_days)分のロングショートレシオ(アカウント数の買い・売りの比率)を取得する関数。
+    オープンインタレストと同じくウィンドウ単位で並列取得し、結果は時刻の昇順で返す。'''
+    end_time = datetime.utcnow()
+    start_time = end_time - timedelta(days=total_days)
+    end_ts = int(end_time.timestamp() * 1000)
+    start_ts = int(start_time.timestamp() * 1000)
+    params = {"category": category, "symbol": symbol, "period": period, "limit": limit}
+    window_ms = INTERVAL_TIME_MS[period] * limit
+    return fetch_cursor_windows("/v5/market/account-ratio", params, "timestamp", start_ts, end_ts, window_ms,
+                                "LONG SHORT RATIO", base_url=base_url, max_workers=max_workers)
+
+# -------------------------------
+# 6. 取得データの整形と統合
+# -------------------------------
+def build_funding_hourly(funding_records):
+    '''資金調達率レコードをDataFrame化し、1時間足にリサンプリング・線形補間して返す関数'''
+    if not funding_records:
+        return pd.DataFrame(columns=["time", "fundingRate"])
+    df_funding = pd.DataFrame(funding_records)
+    # 修正：フィールド名は "fundingRateTimestamp" を使用し、fundingRateも数値に変換
+    df_funding["time"] = pd.to_datetime(df_funding["fundingRateTimestamp"].astype(int), unit="ms")
+    df_funding["fundingRate"] = pd.to_numeric(df_funding["fundingRate"], errors="coerce")
+    df_funding.drop_duplicates(subset=["time"], inplace=True)
+    df_funding.set_index("time", inplace=True)
+    # 1時間足にリサンプリングし、線形補間
+    return df_funding.resample("H").interpolate(method="linear").reset_index()
+
+
+def build_open_interest_frame(oi_records):
+    '''オープンインタレストのレコードを time, openInterest 列のDataFrameにして返す関数'''
+    if not oi_records:
+        return pd.DataFrame(columns=["time", "openInterest"])
+    df_oi = pd.DataFrame(oi_records)
+    df_oi["time"] = pd.to_datetime(df_oi["timestamp"].astype(int), unit="ms")
+    # APIは文字列で返すので数値に変換（型を保持する形式で保存しても数値列として読めるように）
+    df_oi["openInterest"] = pd.to_numeric(df_oi["openInterest"], errors="coerce")
+    df_oi.drop_duplicates(subset=["time"], inplace=True)
+    return df_oi[["time", "openInterest"]]
+
+
+def build_long_short_frame(lsr_records):
+    '''ロングショートレシオのレコードを time, buyRatio, sellRatio, longShortRatio 列のDataFrameにして返す関数
+    （時刻・数値の変換は列単位でまとめて行う）'''
+    if not lsr_records:
+        return pd.DataFrame(columns=["time", "buyRatio", "sellRatio", "longShortRatio"])
+    df_lsr = pd.DataFrame(lsr_records)
+    df_lsr["time"] = pd.to_datetime(df_lsr["timestamp"].astype(np.int64), unit="ms")
+    df_lsr["buyRatio"] = pd.to_numeric(df_lsr["buyRatio"], errors="coerce")
+    df_lsr["sellRatio"] = pd.to_numeric(df_lsr["sellRatio"], errors="coerce")
+    df_lsr["longShortRatio"] = df_lsr["buyRatio"] / df_lsr["sellRatio"]
+    df_lsr.drop_duplicates(subset=["time"], inplace=True)
+    return df_lsr[["time", "buyRatio", "sellRatio", "longShortRatio"]]
+
+
+def build_feature_sides(df_hourly, df_funding_hourly, df_oi, extra_sides=(), timeframes=DEFAULT_TIMEFRAMES,
+                        base_interval_ms=KLINE_INTERVAL_MS["60"]):
+    '''1時間足から作った上位足(4時間足・日足・週足)の指標・資金調達率・オープンインタレストを
+    as-of 結合用の AsofSide のリストにする関数（時刻キーの計算と並べ替えはここで1回だけ行う。extra_sides は追加の AsofSide）。
+    base_interval_ms は結合先の足の長さ（1時間足以外に結合する場合に指定する）'''
+    return [
+        *timeframe_sides(df_hourly, timeframes, base_interval_ms=base_interval_ms),
+        AsofSide(df_funding_hourly),
+        AsofSide(df_oi),
+        *extra_sides,
+    ]
+
+
+def merge_features(df_hourly, df_funding_hourly, df_oi, extra_sides=(), timeframes=DEFAULT_TIMEFRAMES):
+    '''指標計算済みの1時間足に、確定済みの上位足の指標・資金調達率・オープンインタレスト・extra_sides を
+    as-of 結合(その時刻以前で最新の値)する関数'''
+    return asof_join(df_hourly, build_feature_sides(df_hourly, df_funding_hourly, df_oi, extra_sides, timeframes))
+
 # -------------------------------
-# 6. メイン処理：データ統合＆CSV出力
+# 7. メイン処理：データ統合＆ファイル出力
 # -------------------------------
 def main():
     '''
-    1時間足と日足、及び8時間ごとの資金調達率、さらに1時間足のオープンインタレストデータを取得し、
-    テクニカル指標計算およびmerge_asofや線形補間で統合し、1時間単位の最終データセットとしてCSVに出力する。
+    1時間足、及び8時間ごとの資金調達率、さらに1時間足のオープンインタレスト・ロングショートレシオデータを取得し、
+    1時間足から作った上位足(4時間足・日足・週足)のテクニカル指標とあわせて
+    as-of結合や線形補間で統合し、1時間単位の最終データセットとして出力する。
+    出力形式は dataset_io.DATASET_FORMAT（既定はCSV）に従う。
     '''
     total_days = 60  # 60日分のデータ
     symbol = "BTCUSDT"
     
+    store = KlineStore()  # 確定済みローソク足のローカル保存先（前回実行からの差分だけ取得する）
+    
+    # 各ステップの経過時間・CPU時間は metrics.span で記録し、最後に metrics.json / metrics.prom に書き出す
     # Step1: 1時間足データの取得とテクニカル指標計算
+    #   上位足(週足など)の指標を先頭の行から埋めるため、1時間足は history_days の日数分を取得し、Step5の後で絞る
     print("1時間足データ取得中...")
-    raw_hourly = fetch_klines(symbol=symbol, total_days=total_days)
-    if not raw_hourly:
+    with span("fetch_klines", interval="60"):
+        df_hourly = sync_klines(store, fetch_klines, symbol=symbol, interval="60",
+                                total_days=history_days(total_days))
+    if df_hourly.empty:
         print("1時間足データが取得できませんでした。")
         return
-    df_hourly = pd.DataFrame(raw_hourly, columns=["time", "open", "high", "low", "close", "volume", "turnover"])
-    df_hourly = calculate_indicators(df_hourly)
-    df_hourly.drop_duplicates(subset=["time"], inplace=True)
+    with span("calculate_indicators", interval="60"):
+        df_hourly = calculate_indicators(df_hourly)
+        df_hourly.drop_duplicates(subset=["time"], inplace=True)
     print("1時間足データ取得完了。")
     
-    # Step2: 日足データの取得とテクニカル指標計算
-    print("日足データ取得中...")
-    raw_daily = fetch_daily_klines(symbol=symbol, total_days=total_days)
-    if not raw_daily:
-        print("日足データが取得できませんでした。")
-        return
-    df_daily = pd.DataFrame(raw_daily, columns=["time", "open", "high", "low", "close", "volume", "turnover"])
-    df_daily = calculate_indicators(df_daily)
-    df_daily.drop_duplicates(subset=["time"], inplace=True)
-    print("日足データ取得完了。")
-    
-    # Step3: 1時間足データに日足データをマージ（merge_asof）
-    df_hourly["date"] = pd.to_datetime(df_hourly["time"]).dt.floor("D")
-    df_daily["date"] = pd.to_datetime(df_daily["time"]).dt.floor("D")
-    df_hourly = df_hourly.sort_values("time")
-    df_daily = df_daily.sort_values("date")
-    print("merge_asofで1時間足と日足データをマージ中...")
-    df_merged = pd.merge_asof(df_hourly, df_daily[["date", "MA20", "ATR", "RSI", "EMA"]],
-                              on="date", direction="backward", suffixes=("", "_daily"))
-    df_merged.drop(columns=["date"], inplace=True)
-    print("日足データの拡張完了。")
-    
-    # Step4: 資金調達率データの取得 & 補間（8時間ごと→1時間足へ）
-    print("資金調達率データ取得中...")
-    end_ts = int(datetime.utcnow().timestamp() * 1000)
-    start_ts = int((datetime.utcnow() - timedelta(days=total_days)).timestamp() * 1000)
-    funding_records = fetch_funding_rate_history_custom(symbol=symbol, total_days=total_days)
-    if funding_records:
-        df_funding = pd.DataFrame(funding_records)
-        # 修正：フィールド名は "fundingRateTimestamp" を使用し、fundingRateも数値に変換
-        df_funding["time"] = pd.to_datetime(df_funding["fundingRateTimestamp"].astype(int), unit="ms")
-        df_funding["fundingRate"] = pd.to_numeric(df_funding["fundingRate"], errors="coerce")
-        df_funding.drop_duplicates(subset=["time"], inplace=True)
-        df_funding.set_index("time", inplace=True)
-        # 1時間足にリサンプリングし、線形補間
-        df_funding_hourly = df_funding.resample("H").interpolate(method="linear").reset_index()
-        print("資金調達率データ取得＆補間完了。")
-    else:
-        print("資金調達率データが取得できませんでした。")
-        df_funding_hourly = pd.DataFrame(columns=["time", "fundingRate"])
-    
-    # Step5: オープンインタレストデータの取得（1時間足）
-    print("オープンインタレストデータ取得中...")
-    oi_records = fetch_open_interest_data(symbol=symbol, total_days=total_days)
-    if oi_records:
-        df_oi = pd.DataFrame(oi_records)
-        df_oi["time"] = pd.to_datetime(df_oi["timestamp"].astype(int), unit="ms")
-        df_oi.drop_duplicates(subset=["time"], inplace=True)
-        df_oi = df_oi[["time", "openInterest"]]
-        print("オープンインタレストデータ取得完了。")
-    else:
-        print("オープンインタレストデータが取得できませんでした。")
-        df_oi = pd.DataFrame(columns=["time", "openInterest"])
+    # Step2: 上位足(4時間足・日足・週足)はAPIから取得せず、Step5で1時間足を集約して作る
     
-    # Step6: 1時間足＋日足拡張データと資金調達率データをマージ
-    df_merged = df_merged.sort_values("time")
-    df_funding_hourly = df_funding_hourly.sort_values("time")
-    print("merge_asofで資金調達率データをマージ中...")
-    df_final = pd.merge_asof(df_merged, df_funding_hourly, on="time", direction="backward")
+    # Step3: 補助データ（資金調達率・オープンインタレスト・ロングショートレシオ）を並列に取得
+    #   資金調達率は8時間ごと→1時間足へ線形補間、OI・ロングショートレシオは1時間足
+    #   （リクエスト間隔はエンドポイントごとのレートリミッタが制御する）
+    print("資金調達率・オープンインタレスト・ロングショートレシオデータ取得中...")
+
+    def fetch_feed(name, fetch):
+        with span(f"fetch_{name}"):
+            return fetch(symbol=symbol, total_days=total_days)
+
+    feeds = {
+        "funding": fetch_funding_rate_history_custom,
+        "open_interest": fetch_open_interest_data,
+        "long_short_ratio": fetch_long_short_ratio,
+    }
+    with ThreadPoolExecutor(max_workers=len(feeds)) as executor:
+        futures = {name: executor.submit(fetch_feed, name, fetch) for name, fetch in feeds.items()}
+        records = {name: future.result() for name, future in futures.items()}
+    labels = {"funding": "資金調達率", "open_interest": "オープンインタレスト", "long_short_ratio": "ロングショートレシオ"}
+    for name, label in labels.items():
+        print(f"{label}データ取得完了。" if records[name] else f"{label}データが取得できませんでした。")
+
+    # Step4: 取得データをDataFrameに整形
+    with span("build_feeds"):
+        df_funding_hourly = build_funding_hourly(records["funding"])
+        df_oi = build_open_interest_frame(records["open_interest"])
+        df_lsr = build_long_short_frame(records["long_short_ratio"])
     
-    # Step7: 最終的にオープンインタレストデータもマージ（1時間足を基準）
-    df_final = pd.merge_asof(df_final.sort_values("time"), df_oi.sort_values("time"), on="time", direction="backward")
+    # Step5: 上位足の指標・資金調達率・オープンインタレスト・ロングショートレシオを1時間足にas-of結合で統合
+    print("as-of結合で上位足・資金調達率・オープンインタレスト・ロングショートレシオデータをマージ中...")
+    with span("merge_features"):
+        df_final = merge_features(df_hourly, df_funding_hourly, df_oi, extra_sides=[AsofSide(df_lsr)])
+        df_final = trim_days(df_final, total_days)
     
-    # Step8: 統合データをCSVに出力
-    output_file = "merged_dataset.csv"
-    df_final.to_csv(output_file, index=False)
+    # Step6: 列の型を schema の定義(float32 など)に揃え、重複列を落としてファイルに出力
+    with span("apply_schema"):
+        df_compact = apply_schema(df_final)
+    print(format_memory_report(memory_report(df_final, df_compact)))
+    df_final = df_compact
+    output_file = dataset_path("merged_dataset")
+    with span("write_dataset"):
+        write_dataset(df_final, output_file)
     print(f"最終統合データが '{output_file}' に保存されました。")
+    METRICS.inc("rows_written_total", len(df_final), dataset="merged_dataset")
+    print(METRICS.summary())
+    METRICS.export("metrics.json")
+    METRICS.export("metrics.prom")
 
 if __name__ == "__main__":
     main()
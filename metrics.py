@@ -0,0 +1,127 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# 計測用のメトリクス（カウンタ・ヒストグラム・ステージの所要時間）
+# プロセス内で1つのレジストリを共有し、HTTPリクエストのレイテンシや受信バイト数、
+# レートリミッタの待ち時間、ページあたりの件数、ステージごとの経過時間・CPU時間を記録する。
+# 結果は JSON か Prometheus のテキスト形式で書き出せる
+
+# レイテンシ用のヒストグラムの境界(秒)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 件数用のヒストグラムの境界
+ROW_BUCKETS = (0, 1, 10, 50, 100, 200, 500, 1000)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Metrics:
+    """スレッドセーフなメトリクスのレジストリ"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}    # (名前, ラベル) -> 値
+        self.histograms = {}  # (名前, ラベル) -> {"buckets", "counts", "sum", "count"}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = {"buckets": tuple(buckets), "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+                self.histograms[key] = hist
+            for i, bound in enumerate(hist["buckets"]):
+                if value <= bound:
+                    hist["counts"][i] += 1
+            hist["sum"] += value
+            hist["count"] += 1
+
+    @contextmanager
+    def span(self, stage, **labels):
+        """with ブロックの経過時間とCPU時間を stage_seconds / stage_cpu_seconds に記録する"""
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            self.observe("stage_seconds", time.perf_counter() - start, stage=stage, **labels)
+            self.inc("stage_cpu_seconds_total", time.process_time() - cpu_start, stage=stage, **labels)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    # -------------------------------
+    # 書き出し
+    # -------------------------------
+    def to_dict(self):
+        with self.lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in sorted(self.counters.items())]
+            histograms = [{"name": name, "labels": dict(labels), "count": h["count"], "sum": h["sum"],
+                           "buckets": dict(zip(map(str, h["buckets"]), h["counts"]))}
+                          for (name, labels), h in sorted(self.histograms.items())]
+        return {"counters": counters, "histograms": histograms}
+
+    def to_prometheus(self):
+        lines = []
+
+        def fmt_labels(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+        with self.lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{name}{fmt_labels(labels)} {value}")
+            for (name, labels), h in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                for bound, count in zip(h["buckets"], h["counts"]):
+                    lines.append(f"{name}_bucket{fmt_labels(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{fmt_labels(labels, [('le', '+Inf')])} {h['count']}")
+                lines.append(f"{name}_sum{fmt_labels(labels)} {h['sum']}")
+                lines.append(f"{name}_count{fmt_labels(labels)} {h['count']}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path):
+        """拡張子が .prom なら Prometheus のテキスト形式、それ以外は JSON で書き出す"""
+        with open(path, "w", encoding="utf-8") as f:
+            if path.endswith(".prom"):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+    def summary(self):
+        """ステージごとの経過時間と、エンドポイントごとのリクエスト数・平均レイテンシを文字列で返す"""
+        lines = []
+        with self.lock:
+            for (name, labels), h in sorted(self.histograms.items()):
+                if name == "stage_seconds":
+                    lines.append(f"[METRICS] stage {dict(labels)['stage']}: {h['sum']:.3f}s")
+                elif name == "http_request_seconds" and h["count"]:
+                    lines.append(f"[METRICS] {dict(labels)['endpoint']}: {h['count']} リクエスト, "
+                                 f"平均 {h['sum'] / h['count'] * 1000:.1f}ms")
+        return "\n".join(lines)
+
+
+# プロセス内で共有するレジストリ
+METRICS = Metrics()
+span = METRICS.span
+inc = METRICS.inc
+observe = METRICS.observe
@@ -0,0 +1,132 @@
+import functools
+import multiprocessing
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+from bybit_api import BASE_URL, get_json
+from dataset_io import dataset_path, write_dataset
+from kline_store import KlineStore, sync_klines
+from schema import apply_schema
+from main import (fetch_klines, fetch_funding_rate_history_custom,
+                  fetch_open_interest_data, fetch_long_short_ratio, calculate_indicators,
+                  build_funding_hourly, build_open_interest_frame, build_long_short_frame, merge_features)
+from asof_join import AsofSide
+from timeframes import history_days, trim_days
+
+# 複数銘柄の統合データセット作成
+# 取得(I/O)はスレッドプールで銘柄ごとに並列に行い、取得が終わった銘柄から順に
+# 指標計算とas-of結合(CPU処理)をプロセスプールに投入する。
+# 出力は output_dir/symbol=XXX/merged_dataset.<形式> の銘柄別パーティションにまとめる
+
+
+# -------------------------------
+# 対象銘柄の取得
+# -------------------------------
+def fetch_top_symbols(n=50, category="linear", quote="USDT", base_url=BASE_URL):
+    """24時間売買代金の大きい順に、無期限契約(期限付き先物を除く)の銘柄をn件返す"""
+    response = get_json("/v5/market/tickers", {"category": category}, base_url=base_url)
+    if response.get("retCode") != 0:
+        print("[TICKERS] APIエラー:", response.get("retMsg"))
+        return []
+    tickers = response.get("result", {}).get("list", [])
+    perpetuals = [t for t in tickers if t["symbol"].endswith(quote) and "-" not in t["symbol"]]
+    perpetuals.sort(key=lambda t: float(t.get("turnover24h") or 0), reverse=True)
+    return [t["symbol"] for t in perpetuals[:n]]
+
+
+# -------------------------------
+# 銘柄ごとの取得・計算処理
+# -------------------------------
+def fetch_symbol_sources(symbol, category="linear", total_days=60, store=None, base_url=BASE_URL):
+    """1銘柄分の1時間足・資金調達率・オープンインタレスト・ロングショートレシオを取得してdictで返す（スレッドで実行）
+    上位足は1時間足から作るので取得しない（1時間足は上位足の指標の分だけ長く取得する）"""
+    store = store or KlineStore()
+    return {
+        "symbol": symbol,
+        "total_days": total_days,
+        "hourly": sync_klines(store, functools.partial(fetch_klines, base_url=base_url), symbol=symbol,
+                              category=category, interval="60", total_days=history_days(total_days)),
+        "funding": fetch_funding_rate_history_custom(symbol=symbol, category=category,
+                                                     total_days=total_days, base_url=base_url),
+        "open_interest": fetch_open_interest_data(symbol=symbol, category=category,
+                                                  total_days=total_days, base_url=base_url),
+        "long_short_ratio": fetch_long_short_ratio(symbol=symbol, category=category,
+                                                   total_days=total_days, base_url=base_url),
+    }
+
+
+def build_symbol_dataset(sources):
+    """取得済みデータから指標計算とas-of結合を行い、1銘柄分の統合データを返す（プロセスで実行）"""
+    df_hourly = calculate_indicators(sources["hourly"])
+    df_hourly.drop_duplicates(subset=["time"], inplace=True)
+    df_final = merge_features(df_hourly,
+                              build_funding_hourly(sources["funding"]),
+                              build_open_interest_frame(sources["open_interest"]),
+                              extra_sides=[AsofSide(build_long_short_frame(sources["long_short_ratio"]))])
+    df_final = trim_days(df_final, sources["total_days"])
+    # 資金調達率のレコード由来のsymbol列は補間区間外で欠損するため、銘柄名で埋め直す
+    df_final["symbol"] = sources["symbol"]
+    return apply_schema(df_final)
+
+
+def partition_path(output_dir, symbol, file_name=None):
+    """銘柄別パーティションの出力先パスを返す"""
+    return os.path.join(output_dir, f"symbol={symbol}", file_name or dataset_path("merged_dataset"))
+
+
+# -------------------------------
+# メイン処理
+# -------------------------------
+def build_multi_symbol_dataset(symbols, category="linear", total_days=60, output_dir="merged_dataset",
+                               fetch_workers=8, compute_workers=None, base_url=BASE_URL):
+    """
+    複数銘柄の統合データセットを作成し、銘柄別パーティションとして output_dir に書き出す。
+    書き出した {銘柄: パス} のdictを返す。
+    """
+    store = KlineStore()
+    written = {}
+    # 取得スレッドが動いている最中に fork するとロックの状態などを引き継いでしまうため、プロセスは spawn で起動する
+    ctx = multiprocessing.get_context("spawn")
+    with ThreadPoolExecutor(max_workers=fetch_workers) as io_pool, \
+            ProcessPoolExecutor(max_workers=compute_workers, mp_context=ctx) as cpu_pool:
+        fetch_futures = {
+            io_pool.submit(fetch_symbol_sources, symbol, category, total_days, store, base_url): symbol
+            for symbol in symbols
+        }
+        build_futures = {}
+        for future in as_completed(fetch_futures):
+            symbol = fetch_futures[future]
+            try:
+                sources = future.result()
+            except Exception as e:
+                print(f"[{symbol}] データ取得中に例外: {e}")
+                continue
+            if sources["hourly"].empty:
+                print(f"[{symbol}] ローソク足データが取得できなかったためスキップします。")
+                continue
+            print(f"[{symbol}] データ取得完了。指標計算・マージを開始します。")
+            build_futures[cpu_pool.submit(build_symbol_dataset, sources)] = symbol
+
+        for future in as_completed(build_futures):
+            symbol = build_futures[future]
+            try:
+                df_final = future.result()
+            except Exception as e:
+                print(f"[{symbol}] 指標計算・マージ中に例外: {e}")
+                continue
+            path = partition_path(output_dir, symbol)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_dataset(df_final, path)
+            written[symbol] = path
+            print(f"[{symbol}] '{path}' に保存しました。（{len(df_final)} 行）")
+    print(f"{len(written)}/{len(symbols)} 銘柄の統合データを '{output_dir}' に保存しました。")
+    return written
+
+
+def main():
+    symbols = fetch_top_symbols(n=50)
+    build_multi_symbol_dataset(symbols, total_days=60)
+
+
+if __name__ == "__main__":
+    main()
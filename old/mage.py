@@ -1,34 +1,19 @@
 # CSVファイルを結合してひとつのCSVファイルにするスクリプト
 # テンプレートとして使いまわし
-import glob
-import pandas as pd
+import os
+import sys
+
+# リポジトリ直下の csv_merge（並列の確認・並べ替え＋メモリを一定に保つ k-way マージ）を使う
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from csv_merge import main
+
 
 def merge_and_sort_csv(output_file='merged.csv'):
     # 対象となるCSVファイルのパターンを指定（例：BTCUSDT_60_*.csv）
-    csv_files = glob.glob("BTCUSDT_60_*.csv")
-    
-    # 各CSVファイルを読み込み、データフレームのリストに格納
-    dfs = []
-    for file in csv_files:
-        # CSVファイルの読み込み（ヘッダーがない場合はheader=Noneで読み込む）
-        df = pd.read_csv(file, header=None)
-        dfs.append(df)
-    
-    # 全てのデータフレームを結合
-    merged_df = pd.concat(dfs, ignore_index=True)
-    
-    # 1列目が日時情報と仮定し、日時型に変換（例：2024.11.01 00:00）
-    merged_df[0] = pd.to_datetime(merged_df[0], format='%Y.%m.%d %H:%M')
-    
-    # 日時でソート
-    merged_df = merged_df.sort_values(by=0)
-    
-    # 日時を元の文字列形式に戻す
-    merged_df[0] = merged_df[0].dt.strftime('%Y.%m.%d %H:%M')
-    
-    # 結合後のデータを新しいCSVファイルに書き出す（元のファイルはそのまま）
-    merged_df.to_csv(output_file, header=False, index=False)
-    print(f"結合されたCSVファイルを {output_file} として保存しました。")
+    # 1列目の日時（例：2024.11.01 00:00）で並べ、同じ日時の行は後のファイルの行を残す。
+    # 行はヘッダーなしで、読み込んだ文字列のまま書き出す（元のファイルはそのまま）
+    main("BTCUSDT_60_*.csv", output_file, time_format='%Y.%m.%d %H:%M', header=False)
+
 
 if __name__ == '__main__':
     merge_and_sort_csv()
@@ -1,40 +1,49 @@
+import os
+import sys
+
+import numpy as np
 import pandas as pd
-from datetime import datetime
+from dateutil import tz
+
+# リポジトリ直下の asof_join（時刻キーを1回だけ計算する as-of 結合）を使う
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from asof_join import AsofSide, asof_join
 
 # ファイルパスの設定
 funding_file = "funding_rates.csv"
 long_short_file = "long_short_ratio.csv"
 output_file = "combined.csv"
 
-# --- funding_rates.csv の処理 ---
-df_fund = pd.read_csv(funding_file)
+# 時刻の表示に使うローカルタイムゾーン（datetime.fromtimestamp と同じくこのPCの設定に従う）
+# 固定のUTCオフセットではなく、夏時間の切り替えも含めて各時刻のオフセットを求める
+LOCAL_TZ = tz.tzlocal()
 
-# fundingRateTimestamp 列を UNIX ミリ秒から "yyyy/mm/dd/hh" 形式に変換し "time" 列として追加
-df_fund["time"] = df_fund["fundingRateTimestamp"].apply(
-    lambda x: datetime.fromtimestamp(x / 1000).strftime("%Y/%m/%d/%H")
-)
-# "time" 列を fundingRateTimestamp 列の前に移動する
-cols = df_fund.columns.tolist()
-time_index = cols.index("fundingRateTimestamp")
-cols.insert(time_index, cols.pop(cols.index("time")))
-df_fund = df_fund[cols]
-
-# --- long_short_ratio.csv の処理 ---
-df_long = pd.read_csv(long_short_file)
 
-# timestamp 列を UNIX ミリ秒から "yyyy/mm/dd/hh" 形式に変換し "time" 列として追加
-df_long["time"] = df_long["timestamp"].apply(
-    lambda x: datetime.fromtimestamp(x / 1000).strftime("%Y/%m/%d/%H")
-)
-# "time" 列を timestamp 列の前に移動する
-cols = df_long.columns.tolist()
-time_index = cols.index("timestamp")
-cols.insert(time_index, cols.pop(cols.index("time")))
-df_long = df_long[cols]
+def format_local_hours(timestamps_ms):
+    """UNIX ミリ秒の列を "yyyy/mm/dd/hh"(ローカル時刻) の文字列に列単位でまとめて変換する"""
+    local = pd.to_datetime(timestamps_ms.astype("int64"), unit="ms", utc=True).dt.tz_convert(LOCAL_TZ)
+    # "2020-04-01T09" 形式の文字列にまとめて変換してから区切り文字を置き換える（strftime より速い）
+    hours = np.datetime_as_string(local.dt.tz_localize(None).to_numpy().astype("datetime64[h]"), unit="h")
+    return pd.Series(hours, index=timestamps_ms.index).str.replace("-", "/").str.replace("T", "/")
+
+
+# --- funding_rates.csv / long_short_ratio.csv の読み込み ---
+# 時刻は UNIX ミリ秒のまま datetime 型に変換し（行ごとの変換はしない）、as-of 結合のキーにする
+df_fund = pd.read_csv(funding_file)
+df_fund["time"] = pd.to_datetime(df_fund["fundingRateTimestamp"].astype("int64"), unit="ms")
+df_long = pd.read_csv(long_short_file)
+df_long["time"] = pd.to_datetime(df_long["timestamp"].astype("int64"), unit="ms")
+df_long = df_long.sort_values("time").reset_index(drop=True)
 
 # --- 両DataFrameの統合 ---
-# それぞれのファイルで列は異なりますが、縦方向に結合するので union された列になる
-df_combined = pd.concat([df_fund, df_long], ignore_index=True, sort=False)
+# 1時間ごとのロングショートレシオの各行に、その時刻以前で最新の資金調達率を as-of 結合する
+df_combined = asof_join(df_long, [AsofSide(df_fund, columns=["fundingRate", "fundingRateTimestamp"])])
+
+# "time" 列を "yyyy/mm/dd/hh" 形式にして timestamp 列の前に置く
+df_combined["time"] = format_local_hours(df_combined["timestamp"])
+cols = df_combined.columns.tolist()
+cols.insert(cols.index("timestamp"), cols.pop(cols.index("time")))
+df_combined = df_combined[cols]
 
 # 結果を CSV に出力
 df_combined.to_csv(output_file, index=False)
@@ -0,0 +1,290 @@
+import functools
+import json
+import queue
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import lightgbm as lgb
+
+from bybit_api import BASE_URL, get_json
+from indicators import OnlineIndicators
+from kline_store import KLINE_INTERVAL_MS, KlineStore, sync_klines
+from main import build_funding_hourly, fetch_funding_rate_history_custom, fetch_klines
+from walk_forward import FEATURE_COLS
+
+# learn_test.py で保存した lgb_model.txt による予測サーバー
+# 銘柄ごとに直近の確定足の特徴量(learn_test.py と同じ列)をメモリに保持し、バックグラウンドで更新する。
+# 同時に届いたリクエストはマイクロバッチにまとめて1回の predict で処理し、
+# リクエストごとの処理時間の p50 / p99 を /stats で返す
+
+MODEL_FILE = "lgb_model.txt"
+KLINE_INTERVAL = "60"
+# 指標を温めるのに使う1時間足の日数。main.py の total_days と同じにして、EMA(最初の足の値から始まる漸化式)などを
+# 学習データと同じ値にする（指標の最長期間(20本)より十分長いので、開始位置の違いは無視できる）
+WARMUP_DAYS = 60
+FUNDING_DAYS = 2  # 資金調達率の補間に使う精算済みレコードの日数（8時間ごとなら直近6件）
+REFRESH_SECONDS = 30
+MAX_BATCH = 256
+MAX_WAIT_SECONDS = 0.0002  # バッチに相乗りするリクエストを待つ最大時間
+LATENCY_WINDOW = 10000  # p50/p99 の計算に使う直近のリクエスト数
+
+
+# -------------------------------
+# 特徴量キャッシュ
+# -------------------------------
+class FeatureCache:
+    """
+    銘柄ごとに OnlineIndicators の状態と、直近の確定足の特徴量ベクトルを保持するキャッシュ。
+    初回は KlineStore から学習データと同じ日数分の1時間足で指標を温め、以降は新しく確定した足だけを取得して更新する。
+    ベクトルは丸ごと差し替えるので、読み出し側はロック無しで参照できる。
+    """
+
+    def __init__(self, category="linear", store=None, base_url=BASE_URL):
+        self.category = category
+        self.store = store or KlineStore()
+        self.base_url = base_url
+        self.interval_ms = KLINE_INTERVAL_MS[KLINE_INTERVAL]
+        self.states = {}
+        self.vectors = {}  # 銘柄 -> (足の時刻ms, 特徴量ベクトル)
+        self.update_lock = threading.Lock()
+
+    def _funding_rate(self, symbol, bar_time):
+        """
+        bar_time(ms)の足の fundingRate。学習データと同じく main.build_funding_hourly で精算済みの資金調達率を
+        1時間足に線形補間し、bar_time 以前で最新の値を返す（最後の精算より後の足は最後の精算値になる）
+        """
+        records = fetch_funding_rate_history_custom(symbol=symbol, category=self.category, total_days=FUNDING_DAYS,
+                                                    base_url=self.base_url)
+        df_funding = build_funding_hourly(records)
+        times = df_funding["time"].to_numpy(dtype="datetime64[ms]").astype(np.int64)
+        i = np.searchsorted(times, bar_time, side="right") - 1
+        return float(df_funding["fundingRate"].iloc[i]) if i >= 0 else float("nan")
+
+    def _latest_open_interest(self, symbol):
+        response = get_json("/v5/market/open-interest",
+                            {"category": self.category, "symbol": symbol, "intervalTime": "1h", "limit": 1},
+                            base_url=self.base_url)
+        rows = response.get("result", {}).get("list", []) if response.get("retCode") == 0 else []
+        return float(rows[0]["openInterest"]) if rows else float("nan")
+
+    def _closed_bars(self, symbol, state):
+        """前回更新以降に確定した1時間足を (time, open, high, low, close, volume) の配列で返す"""
+        now_ms = int(time.time() * 1000)
+        if state["last_time"] is None:
+            fetch = functools.partial(fetch_klines, base_url=self.base_url)
+            df = sync_klines(self.store, fetch, symbol=symbol, category=self.category,
+                             interval=KLINE_INTERVAL, total_days=WARMUP_DAYS)
+            bars = df[["time", "open", "high", "low", "close", "volume"]].to_numpy(dtype=np.float64)
+        else:
+            start_ts = state["last_time"] + self.interval_ms
+            if start_ts + self.interval_ms > now_ms:
+                return np.empty((0, 6))
+            rows = fetch_klines(symbol=symbol, category=self.category, interval=KLINE_INTERVAL,
+                                start_ts=start_ts, end_ts=now_ms, base_url=self.base_url)
+            bars = np.asarray(rows, dtype=np.float64)[:, :6] if rows else np.empty((0, 6))
+        return bars[bars[:, 0] + self.interval_ms <= now_ms]
+
+    def refresh(self, symbol):
+        """銘柄の特徴量を最新の確定足で更新する（新しい足が無ければ資金調達率・OIだけ更新）"""
+        with self.update_lock:
+            state = self.states.setdefault(symbol, {"indicators": OnlineIndicators(), "last_time": None, "bar": None})
+            for bar in self._closed_bars(symbol, state):
+                state["indicators"].update(bar[2], bar[3], bar[4])
+                state["last_time"] = int(bar[0])
+                state["bar"] = bar
+            if state["bar"] is None:
+                print(f"[PREDICT] {symbol}: 確定足が取得できませんでした。")
+                return
+            values = state["indicators"].current()
+            features = {
+                "open": state["bar"][1], "high": state["bar"][2], "low": state["bar"][3],
+                "close": state["bar"][4], "volume": state["bar"][5],
+                "fundingRate": self._funding_rate(symbol, state["last_time"]),
+                "openInterest": self._latest_open_interest(symbol),
+            }
+            features.update((col, values[col]) for col in ("ATR", "MA20", "RSI", "EMA"))
+            self.vectors[symbol] = (state["last_time"], np.array([features[col] for col in FEATURE_COLS]))
+
+    def get(self, symbol):
+        """(足の時刻ms, 特徴量ベクトル) を返す。未登録の銘柄はその場で温める"""
+        entry = self.vectors.get(symbol)
+        if entry is None:
+            self.refresh(symbol)
+            entry = self.vectors.get(symbol)
+        return entry
+
+    def refresh_forever(self, interval_seconds=REFRESH_SECONDS):
+        """(バックグラウンドスレッドで実行) 登録済みの全銘柄を定期的に更新する"""
+        while True:
+            time.sleep(interval_seconds)
+            for symbol in list(self.states):
+                try:
+                    self.refresh(symbol)
+                except Exception as e:
+                    print(f"[PREDICT] {symbol} の特徴量更新中に例外: {e}")
+
+
+# -------------------------------
+# マイクロバッチ
+# -------------------------------
+class MicroBatcher:
+    """
+    複数スレッドから submit された特徴量行をまとめ、1回の predict_fn 呼び出しで処理する。
+    最初の行が届いてから max_wait 秒、または max_batch 行たまるまで待ってから実行する。
+    """
+
+    def __init__(self, predict_fn, max_batch=MAX_BATCH, max_wait=MAX_WAIT_SECONDS):
+        self.predict_fn = predict_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.batch_sizes = deque(maxlen=LATENCY_WINDOW)
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, rows):
+        """特徴量行(2次元配列)の予測値を返す。バッチの処理が終わるまでブロックする"""
+        pending = {"rows": rows, "done": threading.Event(), "result": None, "error": None}
+        self.queue.put(pending)
+        pending["done"].wait()
+        if pending["error"] is not None:
+            raise pending["error"]
+        return pending["result"]
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            n_rows = len(batch[0]["rows"])
+            deadline = time.perf_counter() + self.max_wait
+            while n_rows < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                try:
+                    item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(item)
+                n_rows += len(item["rows"])
+            try:
+                predictions = self.predict_fn(np.vstack([item["rows"] for item in batch]))
+                offset = 0
+                for item in batch:
+                    item["result"] = predictions[offset:offset + len(item["rows"])]
+                    offset += len(item["rows"])
+            except Exception as e:
+                for item in batch:
+                    item["error"] = e
+            self.batch_sizes.append(len(batch))
+            for item in batch:
+                item["done"].set()
+
+
+class LatencyStats:
+    """直近 window 件のリクエスト処理時間を保持し、p50/p99 を返す"""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.samples = np.zeros(window)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        with self.lock:
+            self.samples[self.count % len(self.samples)] = seconds
+            self.count += 1
+
+    def summary(self):
+        with self.lock:
+            samples = self.samples[:min(self.count, len(self.samples))].copy()
+        if len(samples) == 0:
+            return {"count": 0, "p50_ms": None, "p99_ms": None}
+        p50, p99 = np.percentile(samples, [50, 99]) * 1000
+        return {"count": self.count, "p50_ms": round(p50, 4), "p99_ms": round(p99, 4)}
+
+
+# -------------------------------
+# HTTPサーバー
+# -------------------------------
+class PredictionService:
+    """モデル・特徴量キャッシュ・マイクロバッチ・レイテンシ統計をまとめたもの"""
+
+    def __init__(self, model_file=MODEL_FILE, category="linear", base_url=BASE_URL):
+        self.booster = lgb.Booster(model_file=model_file)
+        self.features = FeatureCache(category=category, base_url=base_url)
+        # 少数行の予測はスレッド起動のコストの方が大きいので1スレッドで行う
+        self.batcher = MicroBatcher(lambda X: self.booster.predict(X, num_threads=1))
+        self.latency = LatencyStats()
+
+    def predict(self, symbols):
+        """銘柄ごとの {symbol, time, prediction} のリストを返す"""
+        start = time.perf_counter()
+        entries = [(symbol, self.features.get(symbol)) for symbol in symbols]
+        entries = [(symbol, entry) for symbol, entry in entries if entry is not None]
+        if not entries:
+            return []
+        predictions = self.batcher.submit(np.vstack([vector for _, (_, vector) in entries]))
+        self.latency.record(time.perf_counter() - start)
+        return [{"symbol": symbol, "time": bar_time, "prediction": float(pred)}
+                for (symbol, (bar_time, _)), pred in zip(entries, predictions)]
+
+    def stats(self):
+        summary = self.latency.summary()
+        sizes = self.batcher.batch_sizes
+        summary["mean_batch_size"] = round(float(np.mean(sizes)), 2) if sizes else None
+        summary["symbols"] = sorted(self.features.vectors)
+        return summary
+
+
+def make_handler(service):
+    class PredictHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status, body):
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/predict":
+                # /predict?symbol=BTCUSDT または /predict?symbol=BTCUSDT,ETHUSDT
+                symbols = [s for value in parse_qs(url.query).get("symbol", []) for s in value.split(",") if s]
+                if not symbols:
+                    self._send_json(400, {"error": "symbol を指定してください"})
+                    return
+                try:
+                    self._send_json(200, {"predictions": service.predict(symbols)})
+                except Exception as e:
+                    self._send_json(500, {"error": str(e)})
+            elif url.path == "/stats":
+                self._send_json(200, service.stats())
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def log_message(self, format, *args):
+            # リクエストごとのログ出力はレイテンシに影響するので行わない
+            pass
+
+    return PredictHandler
+
+
+def main(symbols=("BTCUSDT",), host="127.0.0.1", port=8000, model_file=MODEL_FILE):
+    service = PredictionService(model_file=model_file)
+    for symbol in symbols:
+        service.features.refresh(symbol)
+    threading.Thread(target=service.features.refresh_forever, daemon=True).start()
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    print(f"予測サーバーを http://{host}:{port} で起動しました。（/predict?symbol=..., /stats）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print("レイテンシ:", service.stats())
+
+
+if __name__ == "__main__":
+    main()
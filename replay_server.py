@@ -0,0 +1,333 @@
+import argparse
+import base64
+import hashlib
+import json
+import queue
+import struct
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import pandas as pd
+
+from kline_store import KLINE_COLUMNS, KLINE_INTERVAL_MS, KlineStore
+
+# live_stream.py をオフラインで動かすための、Bybitの公開WebSocket/RESTの代わりになるローカルサーバー
+# 保存済みのローソク足を speed 倍速で再生し、kline.<interval>.<symbol> と tickers.<symbol> の
+# メッセージを Bybit v5 と同じ形式で配信する。同じポートで /v5/market/kline も返すので
+# （再生位置までの確定足だけを返す）、再接続時のRESTによる欠損補完もそのまま試せる。
+# WebSocketは標準ライブラリだけで最小限（テキストフレーム・ping/pong・close）を実装している
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OP_TEXT, OP_CLOSE, OP_PING, OP_PONG = 0x1, 0x8, 0x9, 0xA
+
+
+# -------------------------------
+# WebSocketのフレーム
+# -------------------------------
+def encode_frame(payload, opcode=OP_TEXT):
+    """サーバーから送るフレーム（マスク無し）を作る"""
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 2**16:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+def read_frame(rfile):
+    """クライアントからのフレーム（マスク付き）を1つ読み、(opcode, payload) を返す。切断時は (None, b"")"""
+    head = rfile.read(2)
+    if len(head) < 2:
+        return None, b""
+    opcode = head[0] & 0x0F
+    masked = head[1] & 0x80
+    length = head[1] & 0x7F
+    if length == 126:
+        length = struct.unpack("!H", rfile.read(2))[0]
+    elif length == 127:
+        length = struct.unpack("!Q", rfile.read(8))[0]
+    mask = rfile.read(4) if masked else b""
+    payload = rfile.read(length)
+    if masked:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return opcode, payload
+
+
+# -------------------------------
+# メッセージ
+# -------------------------------
+# 再生が最後まで終わったことをクライアントに知らせるメッセージ（Bybitには無い、再生サーバー独自のもの）
+REPLAY_FINISHED = {"op": "replay_finished"}
+
+
+def kline_message(symbol, interval, bar, confirm, ts):
+    """Bybit v5 の kline トピックと同じ形式のメッセージ（値は文字列）"""
+    start = int(bar["time"])
+    return {
+        "topic": f"kline.{interval}.{symbol}",
+        "type": "snapshot",
+        "ts": ts,
+        "data": [{
+            "start": start,
+            "end": start + KLINE_INTERVAL_MS[interval] - 1,
+            "interval": interval,
+            **{col: str(bar[col]) for col in KLINE_COLUMNS[1:]},
+            "confirm": confirm,
+            "timestamp": ts,
+        }],
+    }
+
+
+def ticker_message(symbol, ts, funding_rate=None, next_funding_time=None, open_interest=None):
+    """Bybit v5 の tickers トピック(linear)のうち、資金調達率とオープンインタレストだけを持つメッセージ"""
+    data = {"symbol": symbol}
+    if funding_rate is not None:
+        data["fundingRate"] = str(funding_rate)
+        data["nextFundingTime"] = str(next_funding_time)
+    if open_interest is not None:
+        data["openInterest"] = str(open_interest)
+    return {"topic": f"tickers.{symbol}", "type": "snapshot", "ts": ts, "data": data}
+
+
+def _asof_values(times, values, ts):
+    """時刻順の (times, values) から ts 以前で最新の値を返す（無ければNone）"""
+    if times is None or len(times) == 0:
+        return None
+    i = np.searchsorted(times, ts, side="right") - 1
+    return float(values[i]) if i >= 0 else None
+
+
+# -------------------------------
+# 再生サーバー
+# -------------------------------
+class ReplayServer:
+    """
+    ローソク足(time はミリ秒)を speed 倍速で再生するサーバー。with 文で起動・停止する。
+      start_index       : 再生を始める足の位置（それより前の足は最初から確定済みとしてRESTで返す）
+      speed             : 再生速度（1本の足を interval / speed 秒で進める。0なら待たずに再生）
+      updates_per_bar   : 確定前に送る未確定の更新の回数
+      funding           : fundingRateTimestamp, fundingRate 列のDataFrame（backfill.read_backfill("funding") と同じ形）
+      open_interest     : timestamp, openInterest 列のDataFrame
+      disconnect_every  : この本数ごとに全接続を切断する（再接続と欠損補完の確認用）
+    """
+
+    def __init__(self, klines, symbol="BTCUSDT", interval="60", start_index=0, speed=60.0, updates_per_bar=2,
+                 funding=None, open_interest=None, disconnect_every=None, host="127.0.0.1", port=0):
+        self.klines = klines.sort_values("time").reset_index(drop=True)
+        self.times = self.klines["time"].to_numpy(dtype=np.int64)
+        self.rows = self.klines[KLINE_COLUMNS].astype(str).to_numpy().tolist()
+        self.symbol = symbol
+        self.interval = interval
+        self.interval_ms = KLINE_INTERVAL_MS[interval]
+        self.position = start_index  # 確定済みの足の本数
+        self.speed = speed
+        self.updates_per_bar = updates_per_bar
+        self.disconnect_every = disconnect_every
+        self.funding = None if funding is None else (funding["fundingRateTimestamp"].to_numpy(dtype=np.int64),
+                                                     funding["fundingRate"].to_numpy(dtype=np.float64))
+        self.open_interest = None if open_interest is None else (open_interest["timestamp"].to_numpy(dtype=np.int64),
+                                                                 open_interest["openInterest"].to_numpy(dtype=np.float64))
+        self.clients = set()
+        self.clients_lock = threading.Lock()
+        self.finished = threading.Event()
+        self.stopped = threading.Event()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_port}"
+        self.ws_url = f"ws://{host}:{self.server.server_port}/v5/public/linear"
+
+    # 再生
+    def _ticker(self, ts):
+        funding_rate = next_funding_time = None
+        if self.funding is not None:
+            funding_rate = _asof_values(self.funding[0], self.funding[1], ts)
+            later = self.funding[0][self.funding[0] > ts]
+            next_funding_time = int(later[0]) if len(later) else ts
+        open_interest = None
+        if self.open_interest is not None:
+            open_interest = _asof_values(self.open_interest[0], self.open_interest[1], ts)
+        return ticker_message(self.symbol, ts, funding_rate, next_funding_time, open_interest)
+
+    def _broadcast(self, message):
+        with self.clients_lock:
+            clients = list(self.clients)
+        for client in clients:
+            client.put(message)
+
+    def _play(self):
+        wait = self.interval_ms / 1000 / self.speed if self.speed else 0.0
+        for i in range(self.position, len(self.rows)):
+            bar = self.klines.iloc[i]
+            start = int(bar["time"])
+            for k in range(self.updates_per_bar):
+                if self.stopped.wait(wait / (self.updates_per_bar + 1)):
+                    return
+                self._broadcast(kline_message(self.symbol, self.interval, bar, False,
+                                              start + (k + 1) * self.interval_ms // (self.updates_per_bar + 1)))
+            if self.stopped.wait(wait / (self.updates_per_bar + 1)):
+                return
+            close_ts = start + self.interval_ms
+            self.position = i + 1
+            self._broadcast(kline_message(self.symbol, self.interval, bar, True, close_ts))
+            self._broadcast(self._ticker(close_ts))
+            if self.disconnect_every and self.position % self.disconnect_every == 0:
+                self._broadcast(None)  # None は切断の合図
+        self.finished.set()
+        self._broadcast(REPLAY_FINISHED)
+
+    # HTTP / WebSocket
+    def _handler(self):
+        replay = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                if self.headers.get("Upgrade", "").lower() == "websocket":
+                    self._websocket()
+                    return
+                url = urlparse(self.path)
+                if url.path != "/v5/market/kline":
+                    self._send_json(404, {"retCode": 10001, "retMsg": "not found"})
+                    return
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                closed = replay.times[:replay.position]
+                lo = np.searchsorted(closed, int(query.get("start", 0)), side="left")
+                hi = np.searchsorted(closed, int(query.get("end", 2**62)), side="right")
+                hi = min(hi, lo + int(query.get("limit", 200)))
+                self._send_json(200, {"retCode": 0, "result": {"list": replay.rows[lo:hi][::-1]}})
+
+            def _send_json(self, status, body):
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _websocket(self):
+                key = self.headers["Sec-WebSocket-Key"]
+                accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode("ascii")).digest()).decode("ascii")
+                self.send_response(101, "Switching Protocols")
+                self.send_header("Upgrade", "websocket")
+                self.send_header("Connection", "Upgrade")
+                self.send_header("Sec-WebSocket-Accept", accept)
+                self.end_headers()
+                self.close_connection = True
+
+                outbox = queue.Queue()
+                topics = set()
+                send_lock = threading.Lock()
+
+                def send(payload, opcode=OP_TEXT):
+                    with send_lock:
+                        self.wfile.write(encode_frame(payload, opcode))
+
+                def receive():
+                    # クライアントからの subscribe / ping / close を処理する
+                    while True:
+                        try:
+                            opcode, payload = read_frame(self.rfile)
+                        except (OSError, ValueError, struct.error):
+                            opcode = None
+                        if opcode is None or opcode == OP_CLOSE:
+                            outbox.put(None)
+                            return
+                        if opcode == OP_PING:
+                            send(payload, OP_PONG)
+                        elif opcode == OP_TEXT:
+                            request = json.loads(payload)
+                            if request.get("op") == "subscribe":
+                                topics.update(request.get("args", []))
+                                send(json.dumps({"success": True, "op": "subscribe", "ret_msg": ""}))
+                                # 購読直後に最新の tickers を送る（Bybitも購読時にスナップショットを送る）
+                                if f"tickers.{replay.symbol}" in topics and replay.position:
+                                    close_ts = int(replay.times[replay.position - 1]) + replay.interval_ms
+                                    outbox.put(replay._ticker(close_ts))
+                                # 再生が終わった後に接続してきたクライアントにも終了を知らせる
+                                if replay.finished.is_set():
+                                    outbox.put(REPLAY_FINISHED)
+                            elif request.get("op") == "ping":
+                                send(json.dumps({"success": True, "op": "pong", "ret_msg": "pong"}))
+
+                threading.Thread(target=receive, daemon=True).start()
+                with replay.clients_lock:
+                    replay.clients.add(outbox)
+                try:
+                    while not replay.stopped.is_set():
+                        try:
+                            message = outbox.get(timeout=0.5)
+                        except queue.Empty:
+                            continue
+                        if message is None:
+                            break
+                        if message is REPLAY_FINISHED:
+                            send(json.dumps(message))
+                            break
+                        if message["topic"] in topics:
+                            send(json.dumps(message))
+                    send(b"", OP_CLOSE)
+                except OSError:
+                    pass
+                finally:
+                    with replay.clients_lock:
+                        replay.clients.discard(outbox)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        threading.Thread(target=self._play, daemon=True).start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stopped.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main(symbol="BTCUSDT", category="linear", interval="60", days=7, speed=60.0, port=8765, disconnect_every=None):
+    """KlineStore に保存済みの直近 days 日分の足を再生する（funding / open_interest のバックフィルがあれば配信する）"""
+    from backfill import read_backfill
+
+    stored = np.array(KlineStore().read(symbol, category, interval))
+    if len(stored) == 0:
+        print(f"{symbol} {interval} のローソク足が保存されていません。先に main.py などで取得してください。")
+        return
+    klines = pd.DataFrame({col: stored[col] for col in KLINE_COLUMNS})
+    start_index = int(np.searchsorted(stored["time"], stored["time"][-1] - days * 24 * 60 * 60 * 1000))
+    funding = read_backfill("funding", symbol, category)
+    open_interest = read_backfill("open_interest", symbol, category)
+    with ReplayServer(klines, symbol=symbol, interval=interval, start_index=start_index, speed=speed,
+                      funding=funding if len(funding) else None,
+                      open_interest=open_interest if len(open_interest) else None,
+                      disconnect_every=disconnect_every, port=port) as replay:
+        print(f"再生中: WebSocket {replay.ws_url} / REST {replay.url} "
+              f"（{len(klines) - start_index} 本を {speed} 倍速）")
+        try:
+            replay.finished.wait()
+        except KeyboardInterrupt:
+            pass
+    print("再生が終了しました。")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="保存済みローソク足をBybit互換のWebSocketで再生するサーバー")
+    parser.add_argument("--symbol", default="BTCUSDT")
+    parser.add_argument("--interval", default="60")
+    parser.add_argument("--days", type=int, default=7, help="再生する直近の日数")
+    parser.add_argument("--speed", type=float, default=60.0, help="再生速度（0なら待たずに再生）")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--disconnect-every", type=int, default=None, help="この本数ごとに接続を切断する")
+    args = parser.parse_args()
+    main(args.symbol, interval=args.interval, days=args.days, speed=args.speed, port=args.port,
+         disconnect_every=args.disconnect_every)
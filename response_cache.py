@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+# APIレスポンスのディスクキャッシュ
+# キーは「ベースURL＋エンドポイント＋パラメータ」のSHA-256。
+# 取得期間がすでに確定している(終了時刻が足1本分以上過去の)レスポンスは無期限、
+# 形成中の足を含みうるレスポンスは短いTTLで保存し、合計サイズが上限を超えたら最終利用の古い順に削除する
+
+DEFAULT_CACHE_DIR = ".http_cache"
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+OPEN_RANGE_TTL = 60  # 秒
+
+
+class ResponseCache:
+    """
+    レスポンス(JSONのdict)を root/<キー先頭2文字>/<キー>.json に保存するLRUキャッシュ。
+    スレッドセーフで、複数の取得スレッドから共有して使う。
+    """
+
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.total_bytes = sum(size for _, size, _ in self._entries())
+
+    @staticmethod
+    def make_key(base_url, path, params):
+        """パラメータの順序に依存しないキーを作る"""
+        payload = json.dumps([base_url, path, sorted((k, str(v)) for k, v in params.items())])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key + ".json")
+
+    def _entries(self):
+        """(パス, サイズ, 最終利用時刻) のリストを返す"""
+        entries = []
+        if not os.path.isdir(self.root):
+            return entries
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith(".json"):
+                    file_path = os.path.join(dirpath, name)
+                    stat = os.stat(file_path)
+                    entries.append((file_path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def get(self, key):
+        """キャッシュ済みのレスポンスを返す。無い・期限切れの場合はNone"""
+        file_path = self._path(key)
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        expires = entry.get("expires")
+        if expires is not None and expires < time.time():
+            self._remove(file_path)
+            return None
+        # 最終利用時刻を更新してLRUの順序に反映する
+        try:
+            os.utime(file_path)
+        except OSError:
+            pass
+        return entry["response"]
+
+    def put(self, key, response, ttl=None):
+        """レスポンスを保存する。ttl=None なら無期限"""
+        file_path = self._path(key)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        data = json.dumps({"expires": None if ttl is None else time.time() + ttl, "response": response})
+        tmp_path = f"{file_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+        with self.lock:
+            old_size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+            os.replace(tmp_path, file_path)
+            self.total_bytes += os.path.getsize(file_path) - old_size
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _remove(self, file_path):
+        with self.lock:
+            try:
+                size = os.path.getsize(file_path)
+                os.remove(file_path)
+                self.total_bytes -= size
+            except OSError:
+                pass
+
+    def _evict(self):
+        """合計サイズが上限の9割を下回るまで、最終利用の古いエントリから削除する（ロック取得済みで呼ぶ）"""
+        target = self.max_bytes * 0.9
+        for file_path, size, _ in sorted(self._entries(), key=lambda entry: entry[2]):
+            if self.total_bytes <= target:
+                break
+            try:
+                os.remove(file_path)
+                self.total_bytes -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        for file_path, _, _ in self._entries():
+            self._remove(file_path)
+
+
+def response_ttl(params, interval_ms, now_ms=None):
+    """
+    リクエストの終了時刻から保存期間を決める。
+    終了時刻に足1本分(interval_ms)を足しても現在より前なら確定済みとして無期限(None)、
+    それ以外や終了時刻の指定が無いリクエストは OPEN_RANGE_TTL 秒。
+    """
+    now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+    end = params.get("end", params.get("endTime"))
+    if end is None:
+        return OPEN_RANGE_TTL
+    if int(end) + interval_ms <= now_ms:
+        return None
+    return OPEN_RANGE_TTL
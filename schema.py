@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+# 統合データセットの列と型の定義
+# 作成時(main.py などでの書き出し前)と読み込み時(targets.read_with_targets)に同じ定義を適用し、
+# 特徴量は float32、銘柄名は category、time は datetime64[ns]（中身は int64 のエポックナノ秒。
+# Parquet・Featherにも int64 のタイムスタンプとして保存される）に揃える。
+# 重複列・計算途中の列は落とし、float64・文字列のままの列を残さないことでメモリ使用量を抑える
+
+# 保存しない列
+#   MA20_calc              : MA20 と同じ値（ボリンジャーバンドの中心線）
+#   avg_gain, avg_loss     : RSI の計算途中の値
+#   fundingRateTimestamp   : 精算時刻の行にしか値が無く、time 列と同じ情報
+DROP_COLUMNS = ["MA20_calc", "avg_gain", "avg_loss", "fundingRateTimestamp"]
+
+TIME_COLUMN = "time"
+CATEGORY_COLUMNS = ["symbol"]
+# float32 の有効桁(約7桁)で足りる列。価格は10万ドル台でも刻み(0.1)より細かい精度が残る
+FLOAT32_COLUMNS = [
+    "open", "high", "low", "close", "volume", "turnover",
+    "ATR", "MA20", "BB_upper", "BB_lower", "MA5", "MA10", "RSI", "EMA",
+    *(f"{col}{suffix}" for suffix in ("_4h", "_daily", "_weekly") for col in ("MA20", "ATR", "RSI", "EMA")),
+    "fundingRate", "openInterest", "buyRatio", "sellRatio", "longShortRatio",
+]
+
+COLUMN_DTYPES = {
+    TIME_COLUMN: "datetime64[ns]",
+    **{col: "category" for col in CATEGORY_COLUMNS},
+    **{col: "float32" for col in FLOAT32_COLUMNS},
+}
+
+
+def apply_schema(df, drop=True):
+    """
+    COLUMN_DTYPES の型に変換したDataFrameを返す（定義に無い列はそのまま残す）。
+    drop=True なら DROP_COLUMNS を落とす。文字列のまま結合された数値列(openInterest など)も数値に変換する。
+    """
+    if drop:
+        df = df.drop(columns=[col for col in DROP_COLUMNS if col in df.columns])
+    converted = {}
+    for col, dtype in COLUMN_DTYPES.items():
+        if col not in df.columns or str(df[col].dtype) == dtype:
+            continue
+        if dtype == "datetime64[ns]":
+            values = df[col]
+            if pd.api.types.is_integer_dtype(values):
+                converted[col] = pd.to_datetime(values, unit="ms")
+            else:
+                converted[col] = pd.to_datetime(values)
+        elif dtype == "category":
+            converted[col] = df[col].astype("category")
+        else:
+            values = df[col]
+            if not pd.api.types.is_numeric_dtype(values):
+                values = pd.to_numeric(values, errors="coerce")
+            converted[col] = values.astype(np.dtype(dtype))
+    if converted:
+        df = df.assign(**converted)
+    return df
+
+
+def memory_report(before, after):
+    """型変換前後のDataFrameのメモリ使用量(バイト)を比較した dict を返す"""
+    before_bytes = int(before.memory_usage(index=False, deep=True).sum())
+    after_bytes = int(after.memory_usage(index=False, deep=True).sum())
+    return {
+        "rows": len(after),
+        "before_bytes": before_bytes,
+        "after_bytes": after_bytes,
+        "saved_bytes": before_bytes - after_bytes,
+        "saved_ratio": (before_bytes - after_bytes) / before_bytes if before_bytes else 0.0,
+    }
+
+
+def format_memory_report(report):
+    return (f"[SCHEMA] {report['rows']} 行: {report['before_bytes'] / 2**20:.1f}MB → "
+            f"{report['after_bytes'] / 2**20:.1f}MB（{report['saved_bytes'] / 2**20:.1f}MB, "
+            f"{report['saved_ratio']:.0%} 削減）")
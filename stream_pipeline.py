@@ -0,0 +1,97 @@
+import functools
+import time
+
+import numpy as np
+import pandas as pd
+
+from bybit_api import BASE_URL
+from dataset_io import DatasetWriter, dataset_path
+from kline_store import KLINE_INTERVAL_MS, KLINE_DTYPE, KlineStore, parse_kline_page, records_to_frame, sync_klines
+from main import (iter_kline_pages, fetch_klines, fetch_funding_rate_history_custom,
+                  fetch_open_interest_data, fetch_long_short_ratio, calculate_indicators,
+                  build_funding_hourly, build_open_interest_frame, build_long_short_frame, build_feature_sides)
+from asof_join import AsofSide, asof_join
+from schema import apply_schema
+from timeframes import history_days
+
+# ストリーミング版のデータセット作成
+# ローソク足をページ単位で取得→型付き配列に変換→指標計算→as-of結合→ファイルへ追記、を繰り返すため、
+# 1分足を数年分取得してもメモリ使用量はページサイズ＋補助データ分で一定に保たれる
+
+# 指標計算に必要な直前の足の本数（最長のウィンドウはボリンジャーバンドの20本）
+WARMUP_ROWS = 20
+EMA_SPAN = 20
+
+
+# -------------------------------
+# チャンク単位の指標計算
+# -------------------------------
+class ChunkIndicatorCalculator:
+    """
+    calculate_indicators をチャンクごとに適用するためのクラス。
+    前チャンク末尾の WARMUP_ROWS 本を持ち越してローリング系指標を連続させ、
+    EMAは前チャンク最後の値を初期値として計算し直すことで、一括計算と同じ値になる。
+    """
+
+    def __init__(self):
+        self.tail = np.empty(0, dtype=KLINE_DTYPE)
+        self.last_ema = None
+
+    def process(self, records):
+        """時刻昇順の構造化配列を受け取り、指標列を追加したDataFrameを返す"""
+        n_tail = len(self.tail)
+        combined = np.concatenate([self.tail, records])
+        df = calculate_indicators(records_to_frame(combined))
+        df = df.iloc[n_tail:].reset_index(drop=True)
+        if self.last_ema is not None:
+            # 先頭に前回のEMAを置いて漸化式を継続させる
+            seeded = np.concatenate([[self.last_ema], df["close"].to_numpy()])
+            df["EMA"] = pd.Series(seeded).ewm(span=EMA_SPAN, adjust=False).mean().to_numpy()[1:]
+        self.tail = combined[-WARMUP_ROWS:]
+        if len(df):
+            self.last_ema = float(df["EMA"].iloc[-1])
+        return df
+
+
+# -------------------------------
+# ストリーミング処理本体
+# -------------------------------
+def stream_dataset(symbol="BTCUSDT", category="linear", interval="60", total_days=60,
+                   output_file=None, limit=1000, base_url=BASE_URL):
+    """
+    指定した足(interval)のローソク足をページ単位で処理し、統合データセットをファイルに逐次追記する関数。
+    output_file を省略した場合は DATASET_FORMAT 形式の merged_dataset に出力する。
+    上位足(1時間足のストアから集約)・資金調達率・オープンインタレストは足数が少ないため先に全期間を用意しておき、
+    時刻キーを1回だけ計算して各ページの as-of 結合に使い回す。書き込んだ行数を返す。
+    """
+    end_ts = int(time.time() * 1000)
+    start_ts = end_ts - total_days * 24 * 60 * 60 * 1000
+
+    print("補助データ（上位足用の1時間足・資金調達率・オープンインタレスト・ロングショートレシオ）取得中...")
+    df_hourly = sync_klines(KlineStore(), functools.partial(fetch_klines, base_url=base_url),
+                            symbol=symbol, category=category, interval="60", total_days=history_days(total_days))
+    df_funding_hourly = build_funding_hourly(
+        fetch_funding_rate_history_custom(symbol=symbol, category=category, total_days=total_days,
+                                          base_url=base_url))
+    df_oi = build_open_interest_frame(
+        fetch_open_interest_data(symbol=symbol, category=category, total_days=total_days, base_url=base_url))
+    df_lsr = build_long_short_frame(
+        fetch_long_short_ratio(symbol=symbol, category=category, total_days=total_days, base_url=base_url))
+    sides = build_feature_sides(df_hourly, df_funding_hourly, df_oi, extra_sides=[AsofSide(df_lsr)],
+                                base_interval_ms=KLINE_INTERVAL_MS[interval])
+
+    output_file = output_file or dataset_path("merged_dataset")
+    calculator = ChunkIndicatorCalculator()
+    with DatasetWriter(output_file) as writer:
+        for page in iter_kline_pages(symbol=symbol, category=category, interval=interval,
+                                     start_ts=start_ts, end_ts=end_ts, limit=limit, base_url=base_url):
+            df_chunk = calculator.process(parse_kline_page(page))
+            writer.write(apply_schema(asof_join(df_chunk, sides)))
+            print(f"[STREAM] {writer.rows} 行書き込み済み")
+    rows_written = writer.rows
+    print(f"最終統合データが '{output_file}' に保存されました。（{rows_written} 行）")
+    return rows_written
+
+
+if __name__ == "__main__":
+    stream_dataset()
@@ -0,0 +1,102 @@
+import os
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from dataset_io import dataset_path, read_dataset, write_dataset
+from schema import apply_schema
+
+# 学習用ターゲット(将来リターンなど)の作成
+# 統合データからは time と close の2列だけを読み、複数の予測期間のターゲットをまとめて計算して
+# time 列付きの別ファイル(サイドカー: <統合データ名>_targets.<形式>)に書き出す。
+# 統合データ本体は書き換えず、学習時に read_with_targets で time をキーに結合する
+
+HORIZONS = (1, 4, 24)  # 予測期間（時間）
+HOUR_NS = 60 * 60 * 1_000_000_000
+# 従来の test.py が作っていた列名。1時間先の return_pct_1h と同じ値
+LEGACY_TARGET = "return_pct"
+
+
+def target_columns(horizons=HORIZONS):
+    """compute_targets が作る列名のリストを返す"""
+    columns = [LEGACY_TARGET]
+    for h in horizons:
+        columns += [f"return_pct_{h}h", f"log_return_{h}h", f"direction_{h}h", f"max_drawdown_{h}h"]
+    return columns
+
+
+def targets_path(features_path):
+    """統合データのパスから、対応するターゲットのサイドカーのパスを返す"""
+    stem, ext = os.path.splitext(features_path)
+    return f"{stem}_targets{ext}"
+
+
+# -------------------------------
+# ターゲット計算
+# -------------------------------
+def compute_targets(time_ns, close, horizons=HORIZONS):
+    """
+    時刻(int64ナノ秒、昇順)と終値の配列から、各予測期間hのターゲットをdictで返す。
+      return_pct_{h}h   : h時間後の終値への変化率(%)
+      log_return_{h}h   : h時間後の終値への対数リターン
+      direction_{h}h    : 上昇 1 / 変化なし 0 / 下落 -1
+      max_drawdown_{h}h : 1～h時間後の終値のうち最も低いものへの変化率(%)。下落しなければ0
+    h行先の時刻がちょうどh時間後でない(途中に欠けた足がある)行や、末尾のh行はNaNにする。
+    """
+    close = np.asarray(close, dtype=np.float64)
+    time_ns = np.asarray(time_ns, dtype=np.int64)
+    n = len(close)
+    targets = {}
+    for h in horizons:
+        future = np.full(n, np.nan)
+        lowest = np.full(n, np.nan)
+        if n > h:
+            # 時刻は昇順なので、h行先がちょうどh時間後なら間の足も欠けていない
+            valid = (time_ns[h:] - time_ns[:-h]) == h * HOUR_NS
+            future[:-h] = np.where(valid, close[h:], np.nan)
+            window_min = sliding_window_view(close[1:], h).min(axis=1)
+            lowest[:-h] = np.where(valid, window_min, np.nan)
+        ratio = future / close
+        targets[f"return_pct_{h}h"] = (ratio - 1) * 100
+        targets[f"log_return_{h}h"] = np.log(ratio)
+        targets[f"direction_{h}h"] = np.sign(ratio - 1)
+        targets[f"max_drawdown_{h}h"] = np.minimum(lowest / close - 1, 0) * 100
+    if 1 in horizons:
+        targets[LEGACY_TARGET] = targets["return_pct_1h"]
+    return targets
+
+
+def build_targets(df, horizons=HORIZONS):
+    """time・close 列を持つDataFrameから、time とターゲット列のDataFrameを作る"""
+    time_ns = df["time"].to_numpy(dtype="datetime64[ns]").astype(np.int64)
+    targets = compute_targets(time_ns, df["close"].to_numpy(), horizons)
+    columns = [col for col in target_columns(horizons) if col in targets]
+    return pd.DataFrame({"time": df["time"].to_numpy(), **{col: targets[col] for col in columns}})
+
+
+# -------------------------------
+# 読み書き
+# -------------------------------
+def write_targets(features_path, horizons=HORIZONS):
+    """統合データの time・close 列だけを読み、ターゲットのサイドカーを書き出してそのパスを返す"""
+    df = read_dataset(features_path, columns=["time", "close"])
+    output_path = targets_path(features_path)
+    write_dataset(build_targets(df, horizons), output_path)
+    return output_path
+
+
+def read_with_targets(features_path=None, columns=None, target_cols=None):
+    """
+    統合データとターゲットのサイドカーを読み込み、time をキーに結合して返す。
+    統合データの列は schema.apply_schema で作成時と同じ型に揃える（古い形式のファイルも float32 などに変換される）。
+    columns / target_cols を指定した場合はその列だけを読み込む。
+    """
+    features_path = features_path or dataset_path("merged_dataset")
+    if columns is not None and "time" not in columns:
+        columns = ["time"] + list(columns)
+    if target_cols is not None:
+        target_cols = ["time"] + list(target_cols)
+    df = apply_schema(read_dataset(features_path, columns=columns))
+    targets = read_dataset(targets_path(features_path), columns=target_cols)
+    return df.merge(targets, on="time", how="left")
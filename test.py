@@ -1,19 +1,9 @@
-import pandas as pd
-
-# CSVファイルを読み込み。time列をdatetime型に変換
-df = pd.read_csv('merged_dataset.csv', parse_dates=['time'])
-
-# 次の行の終値を取得
-df['next_close'] = df['close'].shift(-1)
-
-# 終値のパーセンテージ変化率を計算
-# (次の終値 - 現在の終値) / 現在の終値 * 100
-df['return_pct'] = (df['next_close'] - df['close']) / df['close'] * 100
-
-# 不要になったnext_close列は削除
-df.drop(columns=['next_close'], inplace=True)
-
-# 終値変化率の結果を含むCSVファイルとして出力
-output_file = 'merged_dataset_with_return.csv'
-df.to_csv(output_file, index=False)
-print(f"新しいCSVファイル '{output_file}' に終値のパーセンテージ変化が書き込まれました。")
+from dataset_io import dataset_path
+from targets import HORIZONS, write_targets
+
+# 統合データ(形式は dataset_io.DATASET_FORMAT に従う)の time・close 列だけを読み込み、
+# 1・4・24時間先の終値変化率(%)・対数リターン・方向・最大ドローダウンを一度に計算する。
+# 統合データ本体は書き換えず、ターゲット列だけを time 列付きの別ファイルに出力する
+# （1時間先の終値変化率は従来どおり return_pct 列にも入る。学習時は targets.read_with_targets で結合する）
+output_file = write_targets(dataset_path('merged_dataset'), horizons=HORIZONS)
+print(f"新しいファイル '{output_file}' に {HORIZONS} 時間先の終値変化率などのターゲットが書き込まれました。")
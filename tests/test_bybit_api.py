@@ -0,0 +1,88 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import bybit_api
+from bybit_api import INTERVAL_TIME_MS
+from main import fetch_open_interest_data
+
+# Bybitの /v5/market/open-interest を真似る標準ライブラリだけのスタブサーバ
+# [startTime, endTime] の1時間ごとのレコードを新しい順に PAGE_SIZE 件ずつ返し、続きは nextPageCursor で渡す
+PAGE_SIZE = 10
+HOUR_MS = INTERVAL_TIME_MS["1h"]
+RATE = 10
+
+
+class OpenInterestStub(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        self.server.arrivals.append(time.monotonic())
+        if url.path != "/v5/market/open-interest":
+            self.send_error(404)
+            return
+        start, end = int(query["startTime"]), int(query["endTime"])
+        first = -(-start // HOUR_MS) * HOUR_MS
+        timestamps = list(range(first, end + 1, HOUR_MS))[::-1]
+        offset = int(query.get("cursor", 0))
+        page = timestamps[offset:offset + PAGE_SIZE]
+        cursor = str(offset + PAGE_SIZE) if offset + PAGE_SIZE < len(timestamps) else ""
+        body = json.dumps({
+            "retCode": 0, "retMsg": "OK",
+            "result": {"list": [{"openInterest": str(ts // HOUR_MS), "timestamp": str(ts)} for ts in page],
+                       "nextPageCursor": cursor},
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server(monkeypatch):
+    # キャッシュを通さず、テスト専用のレートでリミッタを作り直す
+    monkeypatch.setattr(bybit_api, "CACHE_ENABLED", False)
+    monkeypatch.setattr(bybit_api, "_limiters", {})
+    monkeypatch.setitem(bybit_api.RATE_LIMITS, "/v5/market/open-interest", RATE)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), OpenInterestStub)
+    server.arrivals = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_open_interest_pages_come_back_in_time_order(stub_server):
+    base_url = f"http://127.0.0.1:{stub_server.server_address[1]}"
+    records = fetch_open_interest_data(total_days=5, limit=24, base_url=base_url)
+    timestamps = [int(record["timestamp"]) for record in records]
+    # ウィンドウ・ページをまたいでも重複・欠落なく1時間刻みの昇順になる
+    assert len(timestamps) >= 5 * 24
+    assert all(b - a == HOUR_MS for a, b in zip(timestamps, timestamps[1:]))
+    assert [record["openInterest"] for record in records] == [str(ts // HOUR_MS) for ts in timestamps]
+    # 1ウィンドウ(24本)は PAGE_SIZE ずつ3ページに分かれる
+    assert len(stub_server.arrivals) >= 3 * 5
+
+
+def test_open_interest_requests_follow_rate_limit(stub_server):
+    base_url = f"http://127.0.0.1:{stub_server.server_address[1]}"
+    started = time.monotonic()
+    fetch_open_interest_data(total_days=10, limit=24, base_url=base_url, max_workers=8)
+    elapsed = time.monotonic() - started
+    arrivals = sorted(stub_server.arrivals)
+    n_requests = len(arrivals)
+    assert n_requests > 2 * RATE
+    # バケット容量(RATE)を使い切った後は、k件目のリクエストは (k - RATE) / RATE 秒より前には届かない
+    for k, arrived in enumerate(arrivals, start=1):
+        assert arrived - started >= (k - RATE) / RATE - 0.05
+    # 並列に取得しているので、所要時間はほぼレートだけで決まる
+    assert elapsed < (n_requests - RATE) / RATE + 1.0
@@ -0,0 +1,50 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from indicators import INDICATOR_COLUMNS, OnlineIndicators
+from main import calculate_indicators
+
+
+def make_klines(n_rows, seed):
+    """ランダムウォークの疑似ローソク足（横ばいの区間を含める）"""
+    rng = np.random.default_rng(seed)
+    close = 30000 + np.cumsum(rng.normal(0, 50, n_rows))
+    close[100:130] = close[100]  # 値上がり・値下がりが無い区間(RSIの0除算)と、EMAが更新されない区間
+    return pd.DataFrame({
+        "time": 1_600_000_000_000 + np.arange(n_rows) * 3_600_000,
+        "open": close + rng.normal(0, 10, n_rows),
+        "high": close + rng.uniform(0, 80, n_rows),
+        "low": close - rng.uniform(0, 80, n_rows),
+        "close": close,
+        "volume": rng.uniform(1, 100, n_rows),
+        "turnover": rng.uniform(1, 100, n_rows),
+    })
+
+
+def assert_identical(actual, expected):
+    """NaN同士は等しいとみなして、値が完全に一致することを確認する"""
+    np.testing.assert_array_equal(actual, expected, strict=True)
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_online_matches_batch_exactly(seed):
+    df = make_klines(3000, seed)
+    expected = calculate_indicators(df.copy())
+    actual = OnlineIndicators().update_frame(df)
+    for col in INDICATOR_COLUMNS:
+        assert_identical(actual[col], expected[col].to_numpy(dtype=np.float64))
+
+
+def test_online_state_round_trip_matches_batch_exactly():
+    df = make_klines(3000, seed=3)
+    expected = calculate_indicators(df.copy())
+    half = len(df) // 2
+    engine = OnlineIndicators()
+    first = engine.update_frame(df.iloc[:half])
+    engine = OnlineIndicators.from_dict(json.loads(json.dumps(engine.to_dict())))
+    second = engine.update_frame(df.iloc[half:])
+    for col in INDICATOR_COLUMNS:
+        assert_identical(np.concatenate([first[col], second[col]]), expected[col].to_numpy(dtype=np.float64))
@@ -0,0 +1,12 @@
+import numpy as np
+import pytest
+
+from learn_test2 import prepare_data
+
+
+def test_prepare_data_rejects_split_shorter_than_window():
+    X = np.random.default_rng(0).normal(size=(100, 3))
+    y = np.arange(100, dtype=np.float64)
+    assert len(prepare_data(X, y, window=5)['X_val']) >= 5
+    with pytest.raises(ValueError, match="val"):
+        prepare_data(X, y, window=24)
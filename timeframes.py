@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+
+from asof_join import AsofSide, to_epoch_hours
+from indicators import BB_PERIOD
+
+# 上位足(4時間足・日足・週足)の特徴量
+# APIから上位足を別に取得せず、1時間足をローカルで集約して作り、足ごとに指標を計算する。
+# 1時間足の各行には、その行の足が確定した時点で確定済みの上位足だけを結合する
+# （形成中の上位足の値は結合しないので、先読みが起きない）。
+# データの先頭が上位足の境界から始まらない場合、期間の一部しか含まない先頭の上位足は捨てる。
+# 週足の指標(最長20本)を埋めるには60日分の1時間足では足りないので、history_days の日数を取得してから
+# trim_days で結合後の行を必要な日数に絞る
+
+HOUR_MS = 60 * 60 * 1000
+# 足の名前 -> (1本の時間数, 境界のずれ(時間)。週足はBybitと同じ月曜0時(UTC)始まり。1970-01-01は木曜)
+TIMEFRAMES = {"4h": (4, 0), "D": (24, 0), "W": (168, 96)}
+TIMEFRAME_SUFFIXES = {"4h": "_4h", "D": "_daily", "W": "_weekly"}
+DEFAULT_TIMEFRAMES = ("4h", "D", "W")
+# 1時間足に結合する上位足の列
+HTF_COLUMNS = ["MA20", "ATR", "RSI", "EMA"]
+
+
+def resample_klines(df_hourly, timeframe):
+    """
+    1時間足(time はミリ秒またはdatetime)を上位足に集約し、calculate_indicators に渡せる形
+    （time は足の開始時刻のミリ秒）で返す。close_time 列に足が確定する時刻(ミリ秒)を入れる。
+    先頭の1時間足が上位足の境界に無い場合、その上位足は期間の途中からしか無いので出力しない。
+    """
+    hours_per_bar, offset = TIMEFRAMES[timeframe]
+    hours = to_epoch_hours(df_hourly["time"].to_numpy())
+    order = None
+    if len(hours) > 1 and (np.diff(hours) < 0).any():
+        order = np.argsort(hours, kind="stable")
+        hours = hours[order]
+    bucket = (hours - offset) // hours_per_bar
+    # 各上位足の先頭行の位置
+    starts = np.flatnonzero(np.concatenate([[True], bucket[1:] != bucket[:-1]])) if len(bucket) else bucket
+    ends = np.append(starts[1:], len(bucket)) - 1
+    if len(hours) and (hours[0] - offset) % hours_per_bar != 0:
+        starts, ends = starts[1:], ends[1:]
+
+    def column(col):
+        values = df_hourly[col].to_numpy(dtype=np.float64)
+        return values[order] if order is not None else values
+
+    if len(starts) == 0:
+        return pd.DataFrame(columns=["time", "open", "high", "low", "close", "volume", "turnover", "close_time"])
+    open_ms = (bucket[starts] * hours_per_bar + offset) * HOUR_MS
+    return pd.DataFrame({
+        "time": open_ms,
+        "open": column("open")[starts],
+        "high": np.maximum.reduceat(column("high"), starts),
+        "low": np.minimum.reduceat(column("low"), starts),
+        "close": column("close")[ends],
+        "volume": np.add.reduceat(column("volume"), starts),
+        "turnover": np.add.reduceat(column("turnover"), starts),
+        "close_time": open_ms + hours_per_bar * HOUR_MS,
+    })
+
+
+def history_days(total_days, timeframes=DEFAULT_TIMEFRAMES):
+    """
+    total_days 分の行で上位足の指標が先頭から埋まるように、取得する1時間足の日数を返す。
+    最長の上位足で、最長の指標ウィンドウ(BB_PERIOD本)と捨てる先頭の不完全な足1本の分を足す（週足なら147日）。
+    """
+    hours = max((TIMEFRAMES[timeframe][0] for timeframe in timeframes), default=0)
+    return total_days + -(-hours * (BB_PERIOD + 1) // 24)
+
+
+def trim_days(df, total_days):
+    """history_days で余分に取得した期間を落とし、最後の行から total_days 日分の行を返す"""
+    if len(df) == 0:
+        return df
+    times = pd.to_datetime(df["time"])
+    return df[times > times.iloc[-1] - pd.Timedelta(days=total_days)].reset_index(drop=True)
+
+
+def timeframe_side(df_htf, timeframe, columns=HTF_COLUMNS, base_interval_ms=HOUR_MS):
+    """
+    指標計算済みの上位足を as-of 結合用の AsofSide にする。
+    上位足は、その中の最後の基準足(close_time の base_interval_ms 前に始まる足)の行から参照できるようにする。
+    その行の足が確定した時点で上位足も確定しているため、先読みにならない。
+    （基準足が1時間より短い場合、キーは時間単位に切り上がるので次の1時間の先頭から参照される）
+    """
+    close_ms = df_htf["close_time"].to_numpy(dtype=np.int64)
+    frame = pd.DataFrame({"time": close_ms - base_interval_ms, **{col: df_htf[col].to_numpy() for col in columns}})
+    return AsofSide(frame, columns=columns, suffix=TIMEFRAME_SUFFIXES[timeframe])
+
+
+def timeframe_sides(df_hourly, timeframes=DEFAULT_TIMEFRAMES, columns=HTF_COLUMNS, base_interval_ms=HOUR_MS):
+    """
+    1時間足から各上位足を作って指標を計算し、AsofSide のリストで返す。
+    base_interval_ms は結合先(基準)の足の長さ。
+    """
+    from main import calculate_indicators
+
+    sides = []
+    for timeframe in timeframes:
+        df_htf = resample_klines(df_hourly, timeframe)
+        if len(df_htf):
+            df_htf = calculate_indicators(df_htf)
+        else:
+            df_htf = df_htf.reindex(columns=list(df_htf.columns) + columns)
+        sides.append(timeframe_side(df_htf, timeframe, columns, base_interval_ms))
+    return sides
@@ -0,0 +1,155 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import lightgbm as lgb
+from sklearn.metrics import mean_squared_error, r2_score
+
+from dataset_io import dataset_path
+from targets import read_with_targets
+
+# LightGBMモデル(learn_test.pyと同じ特徴量・設定)のウォークフォワード評価
+# 特徴量行列のビニング(lgb.Dataset の構築)は各ワーカーで1回だけ行い、各フォールドは subset で参照する。
+# フォールドは RETRAIN_EVERY 個ずつの連続した区間(チェーン)に分けてプロセスプールで実行し、チェーン内では
+# 直前のフォールドのモデルから追加学習(ウォームスタート)する。チェーンの区切りはワーカー数に依存しないので、
+# 結果はワーカー数によらず同じになる
+
+# learn_test.py と同じ特徴量
+FEATURE_COLS = ["open", "high", "low", "close", "volume", "ATR", "MA20", "RSI", "EMA", "fundingRate", "openInterest"]
+TARGET_COL = "return_pct"
+
+# learn_test.py の LGBMRegressor(n_estimators=100, learning_rate=0.1) に相当する設定
+LGB_PARAMS = {"objective": "regression", "learning_rate": 0.1, "verbosity": -1}
+NUM_BOOST_ROUND = 100
+# ウォームスタート時に追加する木の本数
+WARM_START_ROUNDS = 20
+# ウォームスタートを続けるフォールド数。この数ごとにモデルを最初から学習し直す
+RETRAIN_EVERY = 8
+
+
+# -------------------------------
+# フォールドの作成
+# -------------------------------
+def make_folds(n_rows, test_size, n_folds=None, train_size=None, min_train_size=None):
+    """
+    時系列順のフォールド (train_start, train_end, test_start, test_end) のリストを返す（endは含まない）。
+    train_size を指定するとローリング(直近train_size行で学習)、省略するとエクスパンディング(先頭から全行で学習)。
+    n_folds を省略した場合は、データの末尾まで test_size 刻みで作れるだけ作る。
+    """
+    min_train_size = min_train_size or train_size or test_size
+    folds = []
+    test_start = min_train_size
+    while test_start + test_size <= n_rows:
+        train_start = test_start - train_size if train_size else 0
+        folds.append((max(0, train_start), test_start, test_start, test_start + test_size))
+        test_start += test_size
+    if n_folds is not None:
+        folds = folds[-n_folds:]
+    return folds
+
+
+# -------------------------------
+# ワーカー処理
+# -------------------------------
+_worker_data = {}
+
+
+def _init_worker(X, y):
+    """ワーカープロセスの初期化。全行の lgb.Dataset を構築(ビニング)して保持する"""
+    dataset = lgb.Dataset(X, label=y, params={"verbosity": -1}, free_raw_data=False).construct()
+    _worker_data.update(X=X, y=y, dataset=dataset)
+
+
+def _run_chain(folds, warm_start):
+    """
+    (ワーカープロセスで実行) 連続したフォールドを順に学習・評価する。
+    warm_start=True の場合、2つ目以降のフォールドは直前のモデルに WARM_START_ROUNDS 本の木を追加する。
+    """
+    X, y, dataset = _worker_data["X"], _worker_data["y"], _worker_data["dataset"]
+    booster = None
+    results = []
+    for fold_id, (train_start, train_end, test_start, test_end) in folds:
+        train_set = dataset.subset(np.arange(train_start, train_end))
+        if warm_start and booster is not None:
+            booster = lgb.train(LGB_PARAMS, train_set, num_boost_round=WARM_START_ROUNDS,
+                                init_model=booster, keep_training_booster=True)
+        else:
+            booster = lgb.train(LGB_PARAMS, train_set, num_boost_round=NUM_BOOST_ROUND,
+                                keep_training_booster=True)
+        y_pred = booster.predict(X[test_start:test_end])
+        y_test = y[test_start:test_end]
+        results.append({
+            "fold": fold_id,
+            "train_start": train_start,
+            "train_end": train_end,
+            "test_start": test_start,
+            "test_end": test_end,
+            "num_trees": booster.num_trees(),
+            "RMSE": mean_squared_error(y_test, y_pred) ** 0.5,
+            "R2": r2_score(y_test, y_pred),
+            "predicted": y_pred,
+        })
+    return results
+
+
+# -------------------------------
+# ウォークフォワード評価
+# -------------------------------
+def make_chains(folds, retrain_every=RETRAIN_EVERY, warm_start=True):
+    """
+    (フォールド番号, フォールド) を retrain_every 個ずつの連続したチェーンに分ける。
+    各チェーンの先頭のフォールドは最初から学習する。warm_start=False なら1フォールドずつのチェーンにする。
+    """
+    size = max(1, retrain_every) if warm_start else 1
+    indexed = list(enumerate(folds))
+    return [indexed[i:i + size] for i in range(0, len(indexed), size)]
+
+
+def walk_forward(df, folds, n_workers=None, warm_start=True, retrain_every=RETRAIN_EVERY):
+    """
+    フォールドごとのRMSE・R²のDataFrameと、テスト期間の予測値のDataFrameを返す。
+    フォールドは retrain_every 個ずつのチェーンに分割し、チェーン単位でプロセスプールで並列に処理する。
+    """
+    X = df[FEATURE_COLS].to_numpy(dtype=np.float64)
+    y = df[TARGET_COL].to_numpy(dtype=np.float64)
+    chains = make_chains(folds, retrain_every, warm_start)
+    n_workers = max(1, min(n_workers or os.cpu_count() or 1, len(chains)))
+
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(X, y)) as pool:
+        chain_results = list(pool.map(_run_chain, chains, [warm_start] * len(chains)))
+
+    metrics = []
+    predictions = []
+    times = df["time"].to_numpy()
+    for result in (r for chain in chain_results for r in chain):
+        test_slice = slice(result["test_start"], result["test_end"])
+        predictions.append(pd.DataFrame({
+            "fold": result["fold"],
+            "time": times[test_slice],
+            "actual": y[test_slice],
+            "predicted": result.pop("predicted"),
+        }))
+        result["train_start_time"] = times[result["train_start"]]
+        result["test_start_time"] = times[result["test_start"]]
+        result["test_end_time"] = times[result["test_end"] - 1]
+        metrics.append(result)
+    return pd.DataFrame(metrics), pd.concat(predictions, ignore_index=True)
+
+
+def main(test_size=24, train_size=None, n_folds=None, retrain_every=RETRAIN_EVERY):
+    """統合データとターゲットを読み込み、ウォークフォワード評価の結果をCSVに保存する"""
+    df = read_with_targets(dataset_path("merged_dataset"), columns=FEATURE_COLS, target_cols=[TARGET_COL])
+    df = df.dropna(subset=[TARGET_COL]).reset_index(drop=True)
+    folds = make_folds(len(df), test_size=test_size, n_folds=n_folds, train_size=train_size,
+                       min_train_size=int(0.5 * len(df)))
+    print(f"{len(folds)} フォールドでウォークフォワード評価を行います。")
+    metrics, predictions = walk_forward(df, folds, retrain_every=retrain_every)
+    metrics.to_csv("walk_forward_metrics.csv", index=False)
+    predictions.to_csv("walk_forward_predictions.csv", index=False)
+    print(f"平均RMSE: {metrics['RMSE'].mean():.6f}, 平均R²: {metrics['R2'].mean():.6f}")
+    print("フォールドごとの結果は 'walk_forward_metrics.csv'、予測値は 'walk_forward_predictions.csv' に保存されました。")
+
+
+if __name__ == "__main__":
+    main()